@@ -0,0 +1,202 @@
+"""
+End to end load generator
+
+Drives RexProConnection or RexProSessionPool from a number of threads and
+reports the request rate and latency percentiles. Without --host it
+benchmarks against an in process StandInServer, so the numbers measure the
+client rather than rexster.
+
+    python -m rexpro.bench --mode pool --concurrency 16 --requests 20000 --result-size 100
+"""
+__author__ = 'bdeggleston'
+
+import argparse
+from itertools import count
+import sys
+from threading import Lock, Thread
+import time
+
+from rexpro.connection import RexProConnection, RexProSessionPool
+from rexpro.server import StandInServer
+
+MODES = ('connection', 'pool')
+
+def percentile(sorted_values, percent):
+    """
+    Returns the nearest rank percentile of a sorted list
+
+    :param sorted_values: the values, in increasing order
+    :type sorted_values: list
+    :param percent: the percentile, between 0 and 100
+    :type percent: float
+    """
+    if not sorted_values:
+        return 0.0
+    index = int(round(percent / 100.0 * len(sorted_values))) - 1
+    return sorted_values[min(max(index, 0), len(sorted_values) - 1)]
+
+
+def run_benchmark(host, port, graph_name='emptygraph', mode='connection', concurrency=8, requests=10000,
+                  duration=None, script='g.v(id)', params=None, pool_size=None):
+    """
+    Runs a benchmark against a rexpro server
+
+    :param host: the rexpro server to connect to
+    :type host: str
+    :param port: the rexpro server port to connect to
+    :type port: int
+    :param graph_name: the graph to connect to
+    :type graph_name: str
+    :param mode: 'connection' gives every thread its own connection, 'pool' shares a session pool between them
+    :type mode: str
+    :param concurrency: the number of threads making requests
+    :type concurrency: int
+    :param requests: the total number of requests to make
+    :type requests: int
+    :param duration: stop after this many seconds instead of after a number of requests
+    :type duration: float
+    :param script: the script to execute
+    :type script: str
+    :param params: the script params
+    :type params: dict
+    :param pool_size: the size of the session pool, defaults to concurrency
+    :type pool_size: int
+
+    :returns: dict of the request count, errors, elapsed seconds, requests per second and latency percentiles in seconds
+    """
+    if mode not in MODES:
+        raise ValueError('mode must be one of {}'.format(', '.join(MODES)))
+    params = params or {'id': 1}
+
+    if mode == 'pool':
+        pool = RexProSessionPool(host, port, graph_name, pool_size or concurrency)
+        connections = [pool] * concurrency
+    else:
+        pool = None
+        connections = [RexProConnection(host, port, graph_name) for i in range(concurrency)]
+
+    issued = count()
+    deadline = None
+    latencies = []
+    errors = []
+    lock = Lock()
+
+    def worker(conn):
+        local_latencies = []
+        local_errors = 0
+        while True:
+            if deadline is not None:
+                if time.time() >= deadline:
+                    break
+            elif next(issued) >= requests:
+                break
+
+            started_at = time.time()
+            try:
+                conn.execute(script, params)
+            except Exception:
+                local_errors += 1
+            local_latencies.append(time.time() - started_at)
+
+        with lock:
+            latencies.extend(local_latencies)
+            errors.append(local_errors)
+
+    threads = [Thread(target=worker, args=(conn,)) for conn in connections]
+    started_at = time.time()
+    if duration is not None:
+        deadline = started_at + duration
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - started_at
+
+    if pool is not None:
+        pool.close_all()
+    else:
+        for conn in connections:
+            conn.close()
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': sum(errors),
+        'elapsed': elapsed,
+        'rps': len(latencies) / elapsed if elapsed else 0.0,
+        'p50': percentile(latencies, 50),
+        'p90': percentile(latencies, 90),
+        'p99': percentile(latencies, 99),
+        'max': latencies[-1] if latencies else 0.0,
+    }
+
+
+def format_report(results):
+    """
+    Formats the results of run_benchmark for printing, latencies in milliseconds
+
+    :rtype: str
+    """
+    return '\n'.join([
+        'requests: {requests} ({errors} errors) in {elapsed:.2f}s',
+        'throughput: {rps:.0f} req/s',
+        'latency: p50 {p50_ms:.3f}ms  p90 {p90_ms:.3f}ms  p99 {p99_ms:.3f}ms  max {max_ms:.3f}ms',
+    ]).format(
+        p50_ms=results['p50'] * 1000,
+        p90_ms=results['p90'] * 1000,
+        p99_ms=results['p99'] * 1000,
+        max_ms=results['max'] * 1000,
+        **results
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m rexpro.bench', description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--host', help='rexpro server to benchmark, defaults to an in process stand-in server')
+    parser.add_argument('--port', type=int, default=8184)
+    parser.add_argument('--graph', default='emptygraph')
+    parser.add_argument('--mode', choices=MODES, default='connection')
+    parser.add_argument('--concurrency', type=int, default=8, help='number of threads making requests')
+    parser.add_argument('--requests', type=int, default=10000, help='total number of requests')
+    parser.add_argument('--duration', type=float, help='run for this many seconds instead of a number of requests')
+    parser.add_argument('--pool-size', type=int, help='session pool size in pool mode, defaults to the concurrency')
+    parser.add_argument('--script', default='g.v(id)')
+    parser.add_argument('--latency', type=float, default=0.0, help='stand-in server latency, in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='stand-in server latency jitter, in seconds')
+    parser.add_argument('--result-size', type=int, default=1, help='number of vertices the stand-in server returns')
+    parser.add_argument('--property-size', type=int, default=16, help='length of the stand-in vertices\' properties')
+    args = parser.parse_args(argv)
+
+    server = None
+    host, port = args.host, args.port
+    if host is None:
+        server = StandInServer(
+            latency=args.latency,
+            jitter=args.jitter,
+            result_size=args.result_size,
+            property_size=args.property_size
+        ).start()
+        host, port = server.address
+
+    try:
+        results = run_benchmark(
+            host,
+            port,
+            graph_name=args.graph,
+            mode=args.mode,
+            concurrency=args.concurrency,
+            requests=args.requests,
+            duration=args.duration,
+            script=args.script,
+            pool_size=args.pool_size
+        )
+    finally:
+        if server is not None:
+            server.stop()
+
+    print format_report(results)
+    return 1 if results['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
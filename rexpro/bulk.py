@@ -0,0 +1,293 @@
+"""
+Bulk loading of vertices and edges
+
+Elements are sent in parameterized batch scripts of batch_size elements,
+and committed every commit_every elements. Commit groups are loaded
+concurrently on sessions checked out of a pool, and a group that fails is
+rolled back and loaded again, up to max_retries times. Without
+transactions every chunk is committed on its own, so only the chunks that
+failed are loaded again.
+"""
+__author__ = 'bdeggleston'
+
+from Queue import Queue
+from threading import Lock, Thread
+import time
+
+from rexpro import utils
+
+#adds a vertex per property map, a map's _id is used as the vertex id, if the graph allows it
+ADD_VERTICES = 'elements.collect { p -> g.addVertex(p.remove("_id"), p).id }'
+
+#adds an edge per [out vertex id, in vertex id, label, properties] list
+ADD_EDGES = 'elements.collect { e -> g.addEdge(null, g.v(e[0]), g.v(e[1]), e[2], e[3]).id }'
+
+def vertex_params(record):
+    """
+    Converts a vertex record, a dictionary of properties, to its batch script parameters
+    """
+    return dict(record)
+
+def edge_params(record):
+    """
+    Converts an edge record to its batch script parameters, records are
+    either dictionaries with _outV, _inV and _label keys and the edge
+    properties, or (out vertex id, in vertex id, label[, properties]) tuples
+    """
+    if isinstance(record, dict):
+        properties = dict((k, v) for k, v in record.items() if k not in ('_outV', '_inV', '_label'))
+        return [record['_outV'], record['_inV'], record['_label'], properties]
+    out_v, in_v, label = record[:3]
+    return [out_v, in_v, label, dict(record[3]) if len(record) > 3 else {}]
+
+
+class BulkLoadReport(object):
+    """
+    Progress of a bulk load, updated as commit groups finish
+    """
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.finished_at = None
+
+        #elements committed, and elements in groups that failed every retry
+        self.loaded = 0
+        self.failed = 0
+
+        self.chunks = 0
+        self.commits = 0
+        self.retries = 0
+
+        #the exceptions of the groups that failed every retry
+        self.errors = []
+
+        #ids of the created elements in input order, if they're being collected
+        self.ids = None
+
+    @property
+    def elapsed(self):
+        return (self.finished_at or time.time()) - self.started_at
+
+    @property
+    def rate(self):
+        """ elements loaded per second """
+        elapsed = self.elapsed
+        return self.loaded / elapsed if elapsed else 0.0
+
+    def __repr__(self):
+        return '<BulkLoadReport loaded={} failed={} commits={} retries={} rate={:.0f}/s>'.format(
+            self.loaded, self.failed, self.commits, self.retries, self.rate
+        )
+
+
+class BulkLoader(object):
+
+    def __init__(self, pool, batch_size=500, commit_every=10000, concurrency=4, max_retries=3, retry_delay=0.5,
+                 transactions=True, progress=None, progress_interval=1.0, timeout=None):
+        """
+        Loads vertices and edges in batches over several pooled sessions
+
+        :param pool: the sessions to load with, anything with a contextual_connection method, like a RexProSessionPool or RexProCluster
+        :type pool: RexProSessionPool
+        :param batch_size: the number of elements sent in each script
+        :type batch_size: int
+        :param commit_every: the number of elements committed in each transaction
+        :type commit_every: int
+        :param concurrency: the number of sessions loading at once
+        :type concurrency: int
+        :param max_retries: the number of times a failed commit group is retried
+        :type max_retries: int
+        :param retry_delay: seconds to wait before the first retry, doubled for each one after it
+        :type retry_delay: float
+        :param transactions: commit groups in a transaction, graphs that don't support transactions need this set to False,
+            and commit every script as it's executed
+        :type transactions: bool
+        :param progress: called with the BulkLoadReport every progress_interval seconds, and when the load finishes
+        :type progress: callable
+        :param progress_interval: seconds between progress calls
+        :type progress_interval: float
+        :param timeout: seconds each attempt at loading a commit group can take, including waiting for a session
+        :type timeout: float
+        """
+        self.pool = pool
+        self.batch_size = batch_size
+        self.commit_every = max(commit_every, batch_size)
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.transactions = transactions
+        self.progress = progress
+        self.progress_interval = progress_interval
+        self.timeout = timeout
+
+    def load_vertices(self, records, collect_ids=False):
+        """
+        Adds a vertex for each record
+
+        :param records: dictionaries of vertex properties, an _id property is used as the vertex id
+        :type records: iterable
+        :param collect_ids: put the ids of the new vertices on the report, in the order of the records
+        :type collect_ids: bool
+
+        :rtype: BulkLoadReport
+        """
+        return self.load(ADD_VERTICES, (vertex_params(r) for r in records), collect_ids=collect_ids)
+
+    def load_edges(self, records, collect_ids=False):
+        """
+        Adds an edge for each record
+
+        :param records: (out vertex id, in vertex id, label[, properties]) tuples, or dictionaries with _outV, _inV, _label and property keys
+        :type records: iterable
+        :param collect_ids: put the ids of the new edges on the report, in the order of the records
+        :type collect_ids: bool
+
+        :rtype: BulkLoadReport
+        """
+        return self.load(ADD_EDGES, (edge_params(r) for r in records), collect_ids=collect_ids)
+
+    def _groups(self, elements):
+        """ splits the elements into commit groups of chunks """
+        group, chunk = [], []
+        for element in elements:
+            chunk.append(element)
+            if len(chunk) >= self.batch_size:
+                group.append(chunk)
+                chunk = []
+                if len(group) * self.batch_size >= self.commit_every:
+                    yield group
+                    group = []
+        if chunk:
+            group.append(chunk)
+        if group:
+            yield group
+
+    def _load_group(self, script, group):
+        """
+        Loads a commit group on one session, pipelining its chunks
+
+        :returns: the ids of the elements of each chunk. Without transactions each chunk is committed on its
+            own, so a chunk that fails gets the exception it failed with instead, and the other chunks are kept
+        """
+        deadline = utils.deadline(self.timeout)
+        with self.pool.contextual_connection(timeout=utils.time_left(deadline)) as conn:
+            if self.transactions:
+                conn.open_transaction()
+                pending = [conn.execute_pipelined(script, {'elements': chunk}, transaction=False,
+                                                  timeout=utils.time_left(deadline))
+                           for chunk in group]
+                ids = [chunk_result.result() for chunk_result in pending]
+                conn.close_transaction(success=True)
+                return ids
+
+            pending = []
+            for chunk in group:
+                try:
+                    pending.append(conn.execute_pipelined(script, {'elements': chunk},
+                                                          timeout=utils.time_left(deadline)))
+                except Exception as ex:
+                    pending.append(ex)
+
+            ids = []
+            for chunk_result in pending:
+                try:
+                    ids.append(chunk_result if isinstance(chunk_result, Exception) else chunk_result.result())
+                except Exception as ex:
+                    ids.append(ex)
+            return ids
+
+    def load(self, script, elements, collect_ids=False):
+        """
+        Runs a batch script over chunks of elements, the script gets each chunk
+        as a list in the elements param, and should return a list with a
+        result per element
+
+        :param script: the batch script
+        :type script: str
+        :param elements: the parameters of each element
+        :type elements: iterable
+        :param collect_ids: put the results of the script on the report, in the order of the elements, elements
+            of groups that failed get None
+        :type collect_ids: bool
+
+        :rtype: BulkLoadReport
+        """
+        report = BulkLoadReport()
+        lock = Lock()
+        results = {}
+
+        #bounds the number of groups read from the input ahead of the workers
+        work = Queue(maxsize=self.concurrency)
+
+        def worker():
+            while True:
+                item = work.get()
+                if item is None:
+                    return
+                index, group = item
+
+                #the ids of each chunk's elements, chunks that haven't been loaded yet are None
+                ids = [None] * len(group)
+                for attempt in range(self.max_retries + 1):
+                    #only the chunks that failed are loaded again, the others have already been committed
+                    chunks = [i for i, chunk_ids in enumerate(ids) if chunk_ids is None]
+                    try:
+                        outcomes = self._load_group(script, [group[i] for i in chunks])
+                    except Exception as ex:
+                        outcomes = [ex] * len(chunks)
+
+                    error = None
+                    for i, outcome in zip(chunks, outcomes):
+                        if isinstance(outcome, Exception):
+                            error = outcome
+                        else:
+                            ids[i] = outcome
+                    loaded = [i for i in chunks if ids[i] is not None]
+                    with lock:
+                        report.loaded += sum(len(group[i]) for i in loaded)
+                        report.chunks += len(loaded)
+
+                    if error is None:
+                        with lock:
+                            report.commits += 1
+                        break
+                    if attempt == self.max_retries:
+                        with lock:
+                            report.failed += sum(len(group[i]) for i in chunks if ids[i] is None)
+                            report.errors.append(error)
+                        break
+                    with lock:
+                        report.retries += 1
+                    time.sleep(self.retry_delay * 2 ** attempt)
+
+                if collect_ids:
+                    with lock:
+                        results[index] = [i for chunk, chunk_ids in zip(group, ids)
+                                          for i in (chunk_ids if chunk_ids is not None else [None] * len(chunk))]
+
+        threads = [Thread(target=worker, name='rexpro-bulk-loader') for i in range(self.concurrency)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        last_progress = time.time()
+        for item in enumerate(self._groups(elements)):
+            work.put(item)
+            if self.progress is not None and time.time() - last_progress >= self.progress_interval:
+                self.progress(report)
+                last_progress = time.time()
+
+        for thread in threads:
+            work.put(None)
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(self.progress_interval)
+            if self.progress is not None and any(thread.is_alive() for thread in threads):
+                self.progress(report)
+
+        report.finished_at = time.time()
+        if collect_ids:
+            report.ids = [i for index in sorted(results) for i in results[index]]
+        if self.progress is not None:
+            self.progress(report)
+        return report
@@ -0,0 +1,250 @@
+"""
+Read-through cache of script results
+
+Results are cached by graph, script and params. Concurrent misses for the
+same key are collapsed into a single request, entries are evicted least
+recently used first when the cache is over its entry count or memory
+budget, and expire after a ttl. Connections invalidate the entries of
+their graph when they commit a transaction.
+"""
+__author__ = 'bdeggleston'
+
+from collections import OrderedDict
+import json
+from threading import Event, Lock
+import time
+
+import msgpack
+
+from rexpro import encoders, messages
+
+def _size_default(obj):
+    """ packs results that were decoded into objects, like graph elements or arrays, for sizing """
+    if hasattr(obj, 'to_dict'):
+        return obj.to_dict()
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    raise TypeError('{!r} is not msgpack serializable'.format(obj))
+
+class _Flight(object):
+    """ a request for a key that other callers are waiting on """
+
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.exception = None
+
+
+class ResultCache(object):
+    """
+    LRU cache of script results, with single-flight misses
+
+    cached results are shared by every caller that gets them, so they
+    shouldn't be modified
+    """
+
+    def __init__(self, max_entries=1000, ttl=None, max_bytes=None, registry=None):
+        """
+        :param max_entries: the maximum number of results to keep
+        :type max_entries: int
+        :param ttl: the number of seconds results are kept for, None keeps them until they're evicted
+        :type ttl: float
+        :param max_bytes: the maximum msgpack serialized size of the cached results, None doesn't limit it
+        :type max_bytes: int
+        :param registry: the encoders used to canonicalize params, defaults to encoders.default_registry
+        :type registry: ParamEncoderRegistry
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.registry = registry or encoders.default_registry
+
+        #key -> (result, size, time cached), least recently used first
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+        #key -> _Flight of the request being made for it
+        self._flights = {}
+        self._lock = Lock()
+
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'collapsed': 0,
+            'evictions': 0,
+            'expirations': 0,
+            'invalidations': 0,
+        }
+
+    def encode_params(self, params):
+        """
+        Returns a copy of params with the values msgpack can't serialize encoded
+        by the registry, the same way they'd be encoded for the request. Params
+        have to be encoded before they're keyed, so values that can only be
+        read once, like generators, are sent as well as keyed.
+
+        :param params: the script params
+        :type params: dict
+
+        :rtype: dict
+        """
+        return self._encode(params or {})
+
+    def _encode(self, value):
+        if isinstance(value, dict):
+            return dict((self._encode(k), self._encode(v)) for k, v in value.iteritems())
+        if isinstance(value, (list, tuple)):
+            return [self._encode(v) for v in value]
+        if isinstance(value, encoders.NATIVE_TYPES):
+            return value
+        return self._encode(self.registry.default(value))
+
+    def key(self, graph_name, script, params, result_factory=None):
+        """
+        Returns the cache key of a script request, params are serialized with
+        sorted keys so equal params always give the same key. Params that can
+        only be read once have to be encoded with encode_params first.
+
+        :param graph_name: the graph the script runs against
+        :type graph_name: str
+        :param script: the gremlin script, or a prepared script
+        :type script: str/PreparedScript
+        :param params: the script params
+        :type params: dict
+        :param result_factory: the factory the results are decoded with, results decoded by different factories are cached separately
+        :type result_factory: ResultFactory
+
+        :rtype: tuple
+        """
+        if isinstance(script, messages.PreparedScript):
+            script = script.script
+        key = graph_name, script, json.dumps(params or {}, sort_keys=True, default=self.registry.default)
+        if result_factory is not None:
+            key += (result_factory,)
+        return key
+
+    def _size(self, result):
+        return len(msgpack.dumps(result, default=_size_default))
+
+    def _get(self, key, now):
+        """ returns the entry for a key if it's cached and hasn't expired, must be called with the lock held """
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        if self.ttl is not None and now - entry[2] >= self.ttl:
+            self._bytes -= entry[1]
+            self._stats['expirations'] += 1
+            return None
+        #move it to the most recently used end
+        self._entries[key] = entry
+        return entry
+
+    def _store(self, key, result, size, now):
+        """ caches a result, evicting entries until it fits, must be called with the lock held """
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old[1]
+        self._entries[key] = (result, size, now)
+        self._bytes += size
+
+        while self._entries and (len(self._entries) > self.max_entries or
+                                 (self.max_bytes is not None and self._bytes > self.max_bytes)):
+            evicted_key, (evicted, evicted_size, cached_at) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self._stats['evictions'] += 1
+
+    def get_or_execute(self, key, execute):
+        """
+        Returns the cached result for a key, or calls execute to get it. If
+        another caller is already executing the same key, waits for its result
+        instead of executing it again.
+
+        :param key: the cache key, from ResultCache.key
+        :type key: tuple
+        :param execute: callable that makes the request and returns its result
+        :type execute: callable
+        """
+        with self._lock:
+            entry = self._get(key, time.time())
+            if entry is not None:
+                self._stats['hits'] += 1
+                return entry[0]
+
+            self._stats['misses'] += 1
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                leader = True
+            else:
+                self._stats['collapsed'] += 1
+                leader = False
+
+        if not leader:
+            flight.done.wait()
+            if flight.exception is not None:
+                raise flight.exception
+            return flight.result
+
+        size = None
+        try:
+            flight.result = execute()
+            try:
+                size = self._size(flight.result)
+            except Exception:
+                #results msgpack can't pack, like objects from a ResultFactory without to_dict, aren't cached
+                pass
+        except Exception as ex:
+            flight.exception = ex
+            raise
+        finally:
+            with self._lock:
+                #an invalidation while the request was in flight removes the flight, don't cache a stale result
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                    if flight.exception is None and size is not None:
+                        self._store(key, flight.result, size, time.time())
+            flight.done.set()
+        return flight.result
+
+    def invalidate(self, graph_name=None):
+        """
+        Removes the cached results of a graph, or every cached result
+
+        :param graph_name: the graph to invalidate, None invalidates every graph
+        :type graph_name: str
+        """
+        with self._lock:
+            if graph_name is None:
+                keys = list(self._entries)
+                flights = list(self._flights)
+            else:
+                keys = [key for key in self._entries if key[0] == graph_name]
+                flights = [key for key in self._flights if key[0] == graph_name]
+
+            for key in keys:
+                self._bytes -= self._entries.pop(key)[1]
+            for key in flights:
+                #waiters still get the result, but it won't be cached
+                del self._flights[key]
+            self._stats['invalidations'] += len(keys)
+
+    def clear(self):
+        """ removes every cached result """
+        self.invalidate()
+
+    def get_stats(self):
+        """
+        Returns the cache's hit, miss, collapsed miss, eviction, expiration
+        and invalidation counts, and its current size
+
+        :rtype: dict
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._bytes
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / float(lookups) if lookups else 0.0
+        return stats
@@ -0,0 +1,411 @@
+"""
+Client for several rexster servers serving the same graph
+
+RexProCluster keeps a session pool per host, and routes each checkout to
+the host with the fewest outstanding sessions, or the lowest latency
+weighted by its outstanding sessions. Hosts that fail to connect are marked
+down, and are tried again after retry_interval.
+"""
+__author__ = 'bdeggleston'
+
+from contextlib import contextmanager
+import random
+from threading import Lock
+import time
+
+from rexpro import exceptions, utils
+from rexpro.connection import RexProSessionPool, execute_hedged
+from rexpro.metrics import RequestListener
+from rexpro.retry import CONNECTION_ERRORS
+
+LEAST_OUTSTANDING = 'least_outstanding'
+EWMA = 'ewma'
+
+class ClusterHost(RequestListener):
+    """
+    A host in the cluster, its session pool, and the load and latency
+    numbers used to route to it
+
+    it listens to the requests of its pool's connections to keep the
+    moving average of their latency
+    """
+
+    def __init__(self, host, port, pool, decay=0.3):
+        """
+        :param host: the rexpro server
+        :type host: str
+        :param port: the rexpro server port
+        :type port: int
+        :param pool: the sessions to the host
+        :type pool: RexProSessionPool
+        :param decay: the weight of the newest latency in the moving average
+        :type decay: float
+        """
+        self.host = host
+        self.port = port
+        self.pool = pool
+        self.decay = decay
+
+        #number of sessions checked out of the pool
+        self.outstanding = 0
+
+        #moving average of the request latency, None until the first request finishes
+        self.latency = None
+
+        #consecutive connection failures
+        self.failures = 0
+
+        #when the host can be tried again, None if it's up
+        self.down_until = None
+
+        #a probe of a down host is in progress
+        self.probing = False
+
+    @property
+    def address(self):
+        return self.host, self.port
+
+    def on_request(self, event):
+        if event.error_type not in (None, 'SCRIPT_FAILURE_ERROR'):
+            #requests that didn't make it to a response don't say anything about the host's latency
+            return
+        if self.latency is None:
+            self.latency = event.total
+        else:
+            self.latency += self.decay * (event.total - self.latency)
+
+    def cost(self, policy):
+        """ the cost of sending a session to this host, lower is better """
+        if policy == EWMA:
+            #hosts without a latency yet are free, so they get measured
+            return (self.latency or 0.0) * (self.outstanding + 1)
+        return self.outstanding
+
+    def __repr__(self):
+        return 'ClusterHost({}:{})'.format(self.host, self.port)
+
+
+class RexProCluster(object):
+
+    def __init__(self, hosts, graph_name, pool_size=10, policy=LEAST_OUTSTANDING, decay=0.3, max_failures=1,
+                 retry_interval=5.0, retry_policy=None, hedge_policy=None, **kwargs):
+        """
+        Routes sessions between several rexster servers serving the same graph
+
+        :param hosts: the servers, as (host, port) tuples or 'host:port' strings, the port defaults to 8184
+        :type hosts: list
+        :param graph_name: the graph to connect to
+        :type graph_name: str
+        :param pool_size: the maximum number of sessions to each host
+        :type pool_size: int
+        :param policy: LEAST_OUTSTANDING routes to the host with the fewest checked out sessions, EWMA to
+            the host with the lowest moving average latency multiplied by its checked out sessions + 1
+        :type policy: str
+        :param decay: the weight of the newest latency in each host's moving average
+        :type decay: float
+        :param max_failures: the number of consecutive connection failures that mark a host down
+        :type max_failures: int
+        :param retry_interval: the number of seconds a down host is left alone before it's tried again
+        :type retry_interval: float
+        :param retry_policy: the default policy for retrying failed executes, each attempt checks out a
+            session from the host chosen for it
+        :type retry_policy: RetryPolicy
+        :param hedge_policy: hedges read only executes on a session from another host
+        :type hedge_policy: HedgePolicy
+
+        other keyword arguments are passed to each host's RexProSessionPool
+        """
+        if policy not in (LEAST_OUTSTANDING, EWMA):
+            raise ValueError('unknown routing policy {}'.format(policy))
+        if not hosts:
+            raise ValueError('at least one host is required')
+
+        self.graph_name = graph_name
+        self.policy = policy
+        self.max_failures = max_failures
+        self.retry_interval = retry_interval
+        self.retry_policy = retry_policy
+        self.hedge_policy = hedge_policy
+        self.request_timeout = kwargs.get('request_timeout')
+
+        listeners = kwargs.pop('listeners', None) or []
+        kwargs.setdefault('max_size', pool_size)
+
+        self.hosts = []
+        for address in hosts:
+            if isinstance(address, basestring):
+                host, _, port = address.partition(':')
+                address = host, int(port or 8184)
+            host, port = address
+
+            #sessions are opened as they're needed, so a host that's down doesn't stop the cluster starting
+            pool = RexProSessionPool(host, port, graph_name, 0, **kwargs)
+            cluster_host = ClusterHost(host, port, pool, decay=decay)
+            pool.listeners = [cluster_host] + list(listeners)
+            self.hosts.append(cluster_host)
+
+        self._lock = Lock()
+
+    def _choose(self, exclude=()):
+        """
+        Picks the host for the next session and counts it as outstanding
+
+        :param exclude: hosts that have already failed to connect for this session
+        :type exclude: list
+
+        :returns: tuple of (host, whether the session is the probe of a host that's down)
+        """
+        now = time.time()
+        with self._lock:
+            hosts = [host for host in self.hosts if host not in exclude]
+            candidates = []
+            probe = False
+            for host in hosts:
+                if host.down_until is None:
+                    candidates.append(host)
+                elif now >= host.down_until and not host.probing:
+                    #probe it with this session
+                    candidates = [host]
+                    host.probing = probe = True
+                    break
+
+            if not candidates:
+                #every host is down, try the one that's been down longest rather than fail outright
+                candidates = [min(hosts, key=lambda h: h.down_until)]
+
+            lowest = min(host.cost(self.policy) for host in candidates)
+            host = random.choice([h for h in candidates if h.cost(self.policy) == lowest])
+            host.outstanding += 1
+            return host, probe
+
+    def _release(self, host, failed=False, probe=False):
+        """
+        Uncounts a host's outstanding session, marking the host down if it
+        failed too many times in a row, or up if it didn't fail
+
+        :param probe: the session was the host's probe, as returned by _choose
+        :type probe: bool
+        """
+        close_idle = False
+        with self._lock:
+            host.outstanding -= 1
+            if probe:
+                #another session can probe the host if this one failed
+                host.probing = False
+            if not failed:
+                host.failures = 0
+                host.down_until = None
+                return
+
+            host.failures += 1
+            if host.failures >= self.max_failures:
+                host.down_until = time.time() + self.retry_interval
+                close_idle = True
+
+        if close_idle:
+            #the idle sessions are probably dead too
+            host.pool.close_all()
+
+    def mark_down(self, host):
+        """
+        Marks a host down until retry_interval has passed
+
+        :param host: the host, or its (host, port) address
+        :type host: ClusterHost/tuple
+        """
+        host = self._find(host)
+        with self._lock:
+            host.failures = max(host.failures, self.max_failures)
+            host.down_until = time.time() + self.retry_interval
+        host.pool.close_all()
+
+    def mark_up(self, host):
+        """
+        Marks a host up
+
+        :param host: the host, or its (host, port) address
+        :type host: ClusterHost/tuple
+        """
+        host = self._find(host)
+        with self._lock:
+            host.failures = 0
+            host.down_until = None
+
+    def _find(self, host):
+        if isinstance(host, ClusterHost):
+            return host
+        for cluster_host in self.hosts:
+            if cluster_host.address == tuple(host):
+                return cluster_host
+        raise ValueError('{} is not in the cluster'.format(host))
+
+    def _checkout(self, timeout=None):
+        """
+        Checks out a session, moving on to the next host if one can't be
+        connected to, until every host has been tried
+
+        :returns: tuple of (host, whether the session is the host's probe, connection)
+        """
+        error = None
+        tried = []
+        deadline = utils.deadline(timeout)
+        for attempt in range(len(self.hosts)):
+            timeout = utils.time_left(deadline)
+            host, probe = self._choose(exclude=tried)
+            tried.append(host)
+            try:
+                return host, probe, host.pool.get(timeout=timeout)
+            except exceptions.RexProTimeoutException:
+                #the host is busy, not down
+                self._release(host, probe=probe)
+                raise
+            except CONNECTION_ERRORS as ex:
+                self._release(host, failed=True, probe=probe)
+                error = ex
+        raise exceptions.RexProConnectionException('could not connect to any host: {}'.format(error))
+
+    @contextmanager
+    def contextual_connection(self, timeout=None):
+        """
+        context manager that checks out a session from the chosen host, and
+        returns it at the end of the block. The session stays on its host for
+        the whole block.
+
+        :param timeout: the number of seconds to wait for a free session on the chosen host
+        :type timeout: float
+        """
+        host, probe, conn = self._checkout(timeout=timeout)
+        failed = False
+        try:
+            yield conn
+        except exceptions.RexProTimeoutException:
+            #a slow request doesn't mean the host is down, but its connection can't be reused
+            host.pool.discard(conn)
+            raise
+        except CONNECTION_ERRORS:
+            failed = True
+            host.pool.discard(conn)
+            raise
+        except exceptions.RexProScriptException:
+            host.pool.put(conn)
+            raise
+        except:
+            host.pool.discard(conn)
+            raise
+        else:
+            host.pool.put(conn)
+        finally:
+            self._release(host, failed=failed, probe=probe)
+
+    @contextmanager
+    def transaction(self, timeout=None):
+        """
+        context manager that checks out a session and runs its block in a
+        transaction on it, committing if the block succeeds and rolling back
+        if it raises. Every request in the block goes to the same host.
+        """
+        with self.contextual_connection(timeout=timeout) as conn:
+            with conn.transaction():
+                yield conn
+
+    def execute(self, script, params={}, timeout=None, idempotent=False, read_only=False, retry_policy=None,
+                **kwargs):
+        """
+        executes the given gremlin script on a session from the chosen host,
+        takes the same arguments as RexProConnection.execute
+
+        :param timeout: the number of seconds checking out a session, including trying other hosts, and the
+            request, including any retries, can take altogether, defaults to the request_timeout given to the
+            host pools
+        :type timeout: float
+        :param idempotent: the script can safely be run more than once, so it can be retried after errors that
+            leave it unknown whether it ran
+        :type idempotent: bool
+        :param read_only: the script doesn't change the graph, it's retried like an idempotent script, and hedged
+            if the cluster has a hedge policy
+        :type read_only: bool
+        :param retry_policy: retries the request on a newly chosen host if it fails, defaults to the cluster's
+            retry_policy
+        :type retry_policy: RetryPolicy
+
+        :rtype: list
+        """
+        deadline = utils.deadline(self.request_timeout if timeout is None else timeout)
+
+        if read_only and self.hedge_policy is not None:
+            attempt = lambda: self._execute_hedged(script, params, deadline, **kwargs)
+        else:
+            attempt = lambda: self._execute(script, params, deadline, **kwargs)
+
+        retry_policy = retry_policy or self.retry_policy
+        if retry_policy is None:
+            return attempt()
+        return retry_policy.call(attempt, idempotent=idempotent or read_only, deadline=deadline)
+
+    def _execute(self, script, params, deadline, **kwargs):
+        with self.contextual_connection(timeout=utils.time_left(deadline)) as conn:
+            return conn.execute(script, params, timeout=utils.time_left(deadline), **kwargs)
+
+    def _execute_hedged(self, script, params, deadline, **kwargs):
+        """
+        executes a read only script, hedging it on a session from another
+        host, or from the same host if it's the only one
+        """
+        #the host of each connection checked out for the request, and whether it's the host's probe
+        hosts = {}
+
+        def checkout(hedge):
+            if not hedge:
+                host, probe, conn = self._checkout(timeout=utils.time_left(deadline))
+            else:
+                exclude = [h for h, p in hosts.values()] if len(self.hosts) > 1 else ()
+                host, probe = self._choose(exclude=exclude)
+                try:
+                    conn = host.pool.get_nowait()
+                except CONNECTION_ERRORS:
+                    self._release(host, failed=True, probe=probe)
+                    return None
+                if conn is None:
+                    self._release(host, probe=probe)
+                    return None
+            hosts[conn] = host, probe
+            return conn
+
+        def release(conn):
+            host, probe = hosts.pop(conn)
+            #timeouts don't mean the host is down
+            failed = isinstance(conn._error, CONNECTION_ERRORS) and \
+                not isinstance(conn._error, exceptions.RexProTimeoutException)
+            try:
+                host.pool.put(conn)
+            finally:
+                self._release(host, failed=failed, probe=probe)
+
+        return execute_hedged(self.hedge_policy, checkout, release, script, params, deadline=deadline, **kwargs)
+
+    def get_stats(self):
+        """
+        Returns the routing stats and pool stats of each host
+
+        :returns: dict of 'host:port' -> stats
+        """
+        now = time.time()
+        stats = {}
+        for host in self.hosts:
+            host_stats = host.pool.get_stats()
+            host_stats.update({
+                'up': host.down_until is None,
+                'down_for': max(host.down_until - now, 0) if host.down_until is not None else 0.0,
+                'outstanding': host.outstanding,
+                'latency': host.latency,
+                'failures': host.failures,
+            })
+            stats['{}:{}'.format(host.host, host.port)] = host_stats
+        return stats
+
+    def close_all(self):
+        """
+        closes the idle sessions to every host
+        """
+        for host in self.hosts:
+            host.pool.close_all()
@@ -0,0 +1,320 @@
+"""
+Codec microbenchmarks
+
+Times message serialization and deserialization over representative
+message shapes, and reports operations per second and the memory used by
+a single operation. Results can be saved as a baseline, and later runs
+compared against it, failing if any benchmark got slower than the
+threshold allows.
+
+    python -m rexpro.codecbench --save baseline.json
+    python -m rexpro.codecbench --compare baseline.json --threshold 0.15
+
+Memory is measured with tracemalloc where it's available. Otherwise each
+operation is run once in a forked child process, whose peak resident size
+starts out at the size of the process, and its growth is reported as the
+peak. Bytes still allocated are only reported by tracemalloc.
+"""
+__author__ = 'bdeggleston'
+
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from rexpro import messages, results, utils
+
+class Benchmark(object):
+    """
+    A named operation to time, setup is called once and its result passed to the operation
+    """
+
+    def __init__(self, name, setup, operation):
+        """
+        :param name: the name of the benchmark
+        :type name: str
+        :param setup: callable returning the argument of the operation
+        :type setup: callable
+        :param operation: the callable to time
+        :type operation: callable
+        """
+        self.name = name
+        self.setup = setup
+        self.operation = operation
+
+
+def _vertex(i, num_properties=2):
+    properties = dict(('property_{}'.format(p), 'value {} {}'.format(i, p)) for p in range(num_properties))
+    return {'_id': i, '_type': 'vertex', '_properties': properties}
+
+def _response_payload(results):
+    response = messages.MsgPackScriptResponse(results=results, bindings={}, request_id=utils.random_uuid_bytes())
+    return response.get_payload()
+
+def _request(params):
+    return messages.ScriptRequest('g.v(id).out(label)', params, session_key=utils.random_uuid_bytes(), graph_name='emptygraph')
+
+def _serialize(request):
+    #a new id is generated for every message that's sent
+    request.request_id = None
+    return request.serialize()
+
+def _message_list(request):
+    request.request_id = None
+    return request.get_message_list()
+
+def _deserialize(payload):
+    return messages.MsgPackScriptResponse.deserialize(payload)
+
+def _deserialize_elements(payload):
+    return messages.MsgPackScriptResponse.deserialize(payload, result_factory=results.ElementFactory())
+
+def _deserialize_columns(payload):
+    return messages.MsgPackScriptResponse.deserialize(payload, result_factory=results.ColumnarFactory())
+
+BENCHMARKS = [
+    #tiny lookups
+    Benchmark('serialize_tiny_request', lambda: _request({'id': 1, 'label': 'knows'}), _serialize),
+    Benchmark('message_list_tiny_request', lambda: _request({'id': 1, 'label': 'knows'}), _message_list),
+    Benchmark('deserialize_single_vertex', lambda: _response_payload([_vertex(1)]), _deserialize),
+
+    #wide property maps
+    Benchmark('serialize_wide_params', lambda: _request(_vertex(1, 200)['_properties']), _serialize),
+    Benchmark('deserialize_wide_vertex', lambda: _response_payload([_vertex(1, 200)]), _deserialize),
+
+    #large results
+    Benchmark('deserialize_100k_ids', lambda: _response_payload(range(100000)), _deserialize),
+    Benchmark('deserialize_100k_id_column', lambda: _response_payload(range(100000)), _deserialize_columns),
+    Benchmark('deserialize_100k_score_column', lambda: _response_payload([i * 0.5 for i in range(100000)]),
+              _deserialize_columns),
+    Benchmark('deserialize_100k_vertices', lambda: _response_payload([_vertex(i) for i in range(100000)]), _deserialize),
+    Benchmark('deserialize_100k_vertex_objects', lambda: _response_payload([_vertex(i) for i in range(100000)]),
+              _deserialize_elements),
+
+    #large params
+    Benchmark('serialize_100k_id_params', lambda: _request({'ids': range(100000)}), _serialize),
+    Benchmark('serialize_10k_vertex_params', lambda: _request({'vertices': [_vertex(i) for i in range(10000)]}), _serialize),
+
+    Benchmark('int_to_32bit_array', lambda: 123456789, utils.int_to_32bit_array),
+]
+
+def _time(operation, arg, loops):
+    started_at = time.time()
+    for i in xrange(loops):
+        operation(arg)
+    return time.time() - started_at
+
+def _measure_memory(operation, arg):
+    """
+    Measures the memory used by a single operation
+
+    :returns: tuple of (bytes allocated and still held by the result, peak bytes allocated), either can be None
+    """
+    gc.collect()
+    if tracemalloc is not None:
+        tracemalloc.start()
+        try:
+            before, _ = tracemalloc.get_traced_memory()
+            result = operation(arg)
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        del result
+        return current - before, peak - before
+
+    if resource is not None and hasattr(os, 'fork'):
+        return None, _measure_peak_in_child(operation, arg)
+
+    return None, None
+
+def _measure_peak_in_child(operation, arg):
+    """
+    Runs an operation in a forked child process and returns the growth of
+    its peak resident size. The peak is a high water mark for the whole
+    process, so measuring in this process would only register operations
+    that use more memory than every earlier one did. Pages the child
+    copies from the parent when it writes to them are counted too, so small
+    operations report a few hundred kilobytes.
+
+    :returns: the peak bytes, or None if the child failed
+    """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        #the child's high water mark starts at the parent's current size
+        try:
+            os.close(read_fd)
+            before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            operation(arg)
+            after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            os.write(write_fd, str(after - before))
+        finally:
+            os._exit(0)
+
+    os.close(write_fd)
+    try:
+        output = os.read(read_fd, 64)
+    finally:
+        os.close(read_fd)
+        os.waitpid(pid, 0)
+    if not output:
+        return None
+    #linux reports kilobytes, osx bytes
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return int(output) * scale
+
+def run_benchmark(benchmark, min_time=0.2, repeat=3):
+    """
+    Runs a benchmark, calibrating the number of loops so each timing takes at
+    least min_time, and keeping the best of the repeats
+
+    :param benchmark: the benchmark to run
+    :type benchmark: Benchmark
+    :param min_time: the minimum number of seconds each timing should take
+    :type min_time: float
+    :param repeat: the number of timings to take
+    :type repeat: int
+
+    :returns: dict of ops_per_sec, allocated and peak_memory
+    """
+    arg = benchmark.setup()
+    allocated, peak_memory = _measure_memory(benchmark.operation, arg)
+
+    loops = 1
+    while True:
+        elapsed = _time(benchmark.operation, arg, loops)
+        if elapsed >= min_time:
+            break
+        loops *= 10 if elapsed < min_time / 10 else 2
+
+    best = elapsed
+    for i in range(repeat - 1):
+        best = min(best, _time(benchmark.operation, arg, loops))
+
+    return {
+        'ops_per_sec': loops / best,
+        'allocated': allocated,
+        'peak_memory': peak_memory,
+    }
+
+def run_all(benchmarks=None, names=None, min_time=0.2, repeat=3):
+    """
+    Runs the benchmarks
+
+    :param benchmarks: the benchmarks to choose from, defaults to BENCHMARKS
+    :type benchmarks: list
+    :param names: the names of the benchmarks to run, defaults to all of them
+    :type names: list
+
+    :returns: dict of benchmark name -> results
+    """
+    results = {}
+    for benchmark in benchmarks or BENCHMARKS:
+        if names and benchmark.name not in names:
+            continue
+        results[benchmark.name] = run_benchmark(benchmark, min_time=min_time, repeat=repeat)
+    return results
+
+def find_regressions(results, baseline, threshold=0.1):
+    """
+    Compares results against a baseline
+
+    :param results: the results of run_all
+    :type results: dict
+    :param baseline: the results of an earlier run
+    :type baseline: dict
+    :param threshold: the fraction of a benchmark's baseline ops/sec it's allowed to lose
+    :type threshold: float
+
+    :returns: list of (name, baseline ops/sec, ops/sec) tuples of the benchmarks that regressed
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        expected = baseline[name]['ops_per_sec']
+        if result['ops_per_sec'] < expected * (1 - threshold):
+            regressions.append((name, expected, result['ops_per_sec']))
+    return regressions
+
+def _format_bytes(value):
+    if value is None:
+        return '-'
+    for unit in ['B', 'KB', 'MB']:
+        if abs(value) < 1024:
+            return '{:.0f}{}'.format(value, unit)
+        value /= 1024.0
+    return '{:.1f}GB'.format(value)
+
+def format_results(results, baseline=None):
+    """
+    Formats benchmark results as a table, with the change from the baseline if one is given
+
+    :rtype: str
+    """
+    lines = ['{:<30} {:>14} {:>10} {:>10} {:>8}'.format('benchmark', 'ops/sec', 'allocated', 'peak', 'change')]
+    for name, result in sorted(results.items()):
+        change = ''
+        if baseline and name in baseline:
+            change = '{:+.1%}'.format(result['ops_per_sec'] / baseline[name]['ops_per_sec'] - 1)
+        lines.append('{:<30} {:>14,.1f} {:>10} {:>10} {:>8}'.format(
+            name,
+            result['ops_per_sec'],
+            _format_bytes(result['allocated']),
+            _format_bytes(result['peak_memory']),
+            change
+        ))
+    return '\n'.join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m rexpro.codecbench', description='rexpro codec microbenchmarks')
+    parser.add_argument('names', nargs='*', help='the benchmarks to run, defaults to all of them')
+    parser.add_argument('--save', metavar='FILE', help='save the results as a baseline')
+    parser.add_argument('--compare', metavar='FILE', help='compare the results against a saved baseline')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='fraction of the baseline ops/sec a benchmark can lose before failing')
+    parser.add_argument('--min-time', type=float, default=0.2, help='minimum seconds per timing')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timings per benchmark, the best is kept')
+    parser.add_argument('--list', action='store_true', help='list the benchmarks')
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for benchmark in BENCHMARKS:
+            print benchmark.name
+        return 0
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    results = run_all(names=args.names, min_time=args.min_time, repeat=args.repeat)
+    print format_results(results, baseline)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if baseline is not None:
+        regressions = find_regressions(results, baseline, args.threshold)
+        for name, expected, actual in regressions:
+            print '{} regressed: {:,.1f} ops/sec, baseline {:,.1f}'.format(name, actual, expected)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
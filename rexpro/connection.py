@@ -1,59 +1,260 @@
 from rexpro.exceptions import RexProConnectionException
 from rexpro.messages import ErrorResponse
 
+from collections import deque, OrderedDict
 from contextlib import contextmanager
 from hashlib import md5
 from Queue import Queue
+from select import select
 import struct
-from socket import socket
+from socket import socket, error as socket_error, timeout as socket_timeout, IPPROTO_TCP, SHUT_RDWR, TCP_NODELAY
 from textwrap import dedent
+from threading import BoundedSemaphore, Condition, Event, Lock, RLock, Thread, current_thread
+import time
 
 from rexpro import exceptions
+from rexpro import groovy
 from rexpro import messages
+from rexpro import metrics
 from rexpro import utils
+from rexpro.retry import CONNECTION_ERRORS
 
-class RexProSocket(socket):
-    """ Subclass of python's socket that sends and received rexpro messages """
+#error policies of RexProSessionPool.execute_parallel
+ERRORS_RAISE = 'raise'
+ERRORS_RETURN = 'return'
+ERRORS_SKIP = 'skip'
+
+class RexProSocketMixin(object):
+    """
+    Sends and receives rexpro messages, mixed into a socket class
+    """
+
+    HEADER = messages.RexProMessage.HEADER
+
+    #initial size of the receive buffer, grown as larger messages come in
+    DEFAULT_BUFFER_SIZE = 64 * 1024
+
+    #the receive buffer isn't grown past this, larger messages are read into a buffer of their own that's
+    #freed once they've been decoded, rather than held by the socket for as long as it's open
+    MAX_BUFFER_SIZE = 1024 * 1024
+
+    #messages smaller than this are joined with their header and sent with a single call
+    SMALL_MESSAGE_SIZE = 16 * 1024
+
+    def __init__(self, *args, **kwargs):
+        super(RexProSocketMixin, self).__init__(*args, **kwargs)
+        #receive buffer, reused across messages on this socket
+        self._buffer = bytearray(self.DEFAULT_BUFFER_SIZE)
+        self._view = memoryview(self._buffer)
+        #messages are always written whole, so don't let nagle hold back the tail of a frame
+        self.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+
+        #the number of seconds a single read or write can wait, None waits forever
+        self.read_timeout = None
 
-    def send_message(self, msg):
+        #the time the response being read has to have arrived by, None if there isn't one
+        self.deadline = None
+
+    def set_read_timeout(self, timeout):
+        """
+        Sets the number of seconds a single read or write can wait before it times out
+
+        :param timeout: the number of seconds, None waits forever
+        :type timeout: float
+        """
+        self.read_timeout = timeout
+        self.settimeout(timeout)
+
+    def send_message(self, msg, event=None):
         """
         Serializes the given message and sends it to rexster
 
         :param msg: the message instance to send to rexster
         :type msg: RexProMessage
+        :param event: if given, the serialize and send timings and bytes sent are recorded on it
+        :type event: RequestEvent
+        """
+        if event is not None:
+            started_at = time.time()
+
+        header, payload = msg.serialize_parts()
+
+        if event is not None:
+            serialized_at = time.time()
+            event.timings['serialize'] = serialized_at - started_at
+            event.bytes_sent = len(header) + len(payload)
+
+        try:
+            if len(payload) < self.SMALL_MESSAGE_SIZE:
+                #copying a small payload is cheaper than a second syscall
+                self.sendall(header + payload)
+            else:
+                self.sendall(header)
+                self.sendall(payload)
+        except socket_timeout:
+            raise exceptions.RexProTimeoutException('timed out sending a message to rexster')
+
+        if event is not None:
+            event.timings['send'] = time.time() - serialized_at
+
+    def _ensure_buffer(self, size):
+        """
+        Grows the receive buffer so it can hold at least size bytes
+
+        :param size: the number of bytes the buffer needs to hold
+        :type size: int
+        """
+        if size <= len(self._buffer):
+            return
+        new_size = len(self._buffer)
+        while new_size < size:
+            new_size *= 2
+        self._buffer = bytearray(new_size)
+        self._view = memoryview(self._buffer)
+
+    def _recv_into_buffer(self, size):
+        """
+        Fills the first size bytes of the receive buffer from the socket
+
+        :param size: the number of bytes to read
+        :type size: int
+        """
+        self._ensure_buffer(size)
+        self._recv_into(self._view, size)
+
+    def _recv_into(self, view, size):
+        """
+        Fills the first size bytes of a buffer from the socket
+
+        :param view: the buffer to fill
+        :type view: memoryview
+        :param size: the number of bytes to read
+        :type size: int
         """
-        self.send(msg.serialize())
+        received = 0
+        while received < size:
+            if self.deadline is not None:
+                #wait for the read timeout, or until the deadline if that's sooner
+                left = utils.time_left(self.deadline)
+                self.settimeout(left if self.read_timeout is None else min(left, self.read_timeout))
+            try:
+                num_bytes = self.recv_into(view[received:size], size - received)
+            except socket_timeout:
+                raise exceptions.RexProTimeoutException('timed out waiting for rexster')
+            if not num_bytes:
+                raise exceptions.RexProConnectionException('socket connection has been closed')
+            received += num_bytes
 
-    def get_response(self):
+    def read_header(self):
+        """
+        reads and validates the message header
+
+        :returns: tuple of (message type, message length)
+        """
+        self._recv_into_buffer(self.HEADER.size)
+        msg_version, serializer_type, msg_type, msg_len = self.HEADER.unpack_from(self._buffer)
+
+        if msg_version != 1:
+            raise exceptions.RexProConnectionException('unsupported protocol version: {}'.format(msg_version))
+        if serializer_type != 0:
+            raise exceptions.RexProConnectionException('unsupported serializer version: {}'.format(serializer_type))
+
+        return msg_type, msg_len
+
+    def read_body(self, msg_len):
+        """
+        reads a message body into the receive buffer
+
+        the returned buffer is a view onto the socket's receive buffer,
+        and is only valid until the next message is read. Bodies larger
+        than MAX_BUFFER_SIZE are read into a buffer of their own.
+
+        :param msg_len: the length of the message body
+        :type msg_len: int
+
+        :returns: buffer
+        """
+        if msg_len > self.MAX_BUFFER_SIZE:
+            body = bytearray(msg_len)
+            self._recv_into(memoryview(body), msg_len)
+            return buffer(body)
+        self._recv_into_buffer(msg_len)
+        return buffer(self._buffer, 0, msg_len)
+
+    def recv_chunk(self, size):
+        """
+        reads up to size bytes, for results that are decoded as they're read
+
+        :param size: the maximum number of bytes to read
+        :type size: int
+
+        :returns: str
+        """
+        try:
+            return self.recv(size)
+        except socket_timeout:
+            raise exceptions.RexProTimeoutException('timed out waiting for rexster')
+
+    def get_response(self, stream=False, skip_bindings=True, event=None, result_factory=None, result_factory_for=None,
+                     deadline=None):
         """
         gets the message type and message from rexster
 
+        :param stream: if True, script responses are returned with an iterator of results that are decoded as they're read off the socket
+        :type stream: bool
+        :param skip_bindings: discard streamed script response bindings without decoding them
+        :type skip_bindings: bool
+        :param event: if given, the wait, read and decode timings and bytes received are recorded on it
+        :type event: RequestEvent
+        :param result_factory: decodes script responses instead of msgpack
+        :type result_factory: ResultFactory
+        :param result_factory_for: callable that takes the body of a script response and returns the
+            ResultFactory to decode it with, or None, used instead of result_factory
+        :type result_factory_for: callable
+        :param deadline: the time the response has to have been read by, streamed results only have to have started
+            arriving by then
+        :type deadline: float
+
         :returns: RexProMessage
+        :raises RexProTimeoutException: if the deadline passes, or a read takes longer than the read timeout
         """
-        msg_version = self.recv(1)
-        if not msg_version:
-            raise exceptions.RexProConnectionException('socket connection has been closed')
-        if bytearray([msg_version])[0] != 1:
-            raise exceptions.RexProConnectionException('unsupported protocol version: {}'.format())
-
-        serializer_type = self.recv(1)
-        if bytearray(serializer_type)[0] != 0:
-            raise exceptions.RexProConnectionException('unsupported serializer version: {}'.format())
+        if deadline is None:
+            return self._get_response(stream, skip_bindings, event, result_factory, result_factory_for)
 
-        #get padding
-        self.recv(4)
+        self.deadline = deadline
+        try:
+            return self._get_response(stream, skip_bindings, event, result_factory, result_factory_for)
+        finally:
+            self.deadline = None
+            self.settimeout(self.read_timeout)
 
-        msg_type = self.recv(1)
-        msg_type = bytearray(msg_type)[0]
+    def _get_response(self, stream, skip_bindings, event, result_factory, result_factory_for):
+        if event is not None:
+            started_at = time.time()
 
-        msg_len = struct.unpack('!I', self.recv(4))[0]
+        msg_type, msg_len = self.read_header()
 
-        response = ''
-        while len(response) < msg_len:
-            response += self.recv(msg_len)
+        if event is not None:
+            header_at = time.time()
+            event.timings['wait'] = header_at - started_at
+            event.bytes_received = self.HEADER.size + msg_len
 
         MessageTypes = messages.MessageTypes
 
+        if stream and msg_type == MessageTypes.SCRIPT_RESPONSE:
+            return messages.MsgPackScriptResponse.deserialize_stream(
+                self.recv_chunk,
+                msg_len,
+                skip_bindings=skip_bindings,
+                result_factory=result_factory
+            )
+
+        body = self.read_body(msg_len)
+
+        if event is not None:
+            body_at = time.time()
+            event.timings['read'] = body_at - header_at
+
         type_map = {
             MessageTypes.ERROR: messages.ErrorResponse,
             MessageTypes.SESSION_RESPONSE: messages.SessionResponse,
@@ -62,11 +263,25 @@ class RexProSocket(socket):
 
         if msg_type not in type_map:
             raise exceptions.RexProConnectionException("can't deserialize message type {}".format(msg_type))
-        return type_map[msg_type].deserialize(response)
+        if msg_type == MessageTypes.SCRIPT_RESPONSE:
+            if result_factory_for is not None:
+                result_factory = result_factory_for(body)
+            response = messages.MsgPackScriptResponse.deserialize(body, result_factory=result_factory)
+        else:
+            response = type_map[msg_type].deserialize(body)
+
+        if event is not None:
+            event.timings['decode'] = time.time() - body_at
+
+        return response
+
+class RexProSocket(RexProSocketMixin, socket):
+    """ Subclass of python's socket that sends and received rexpro messages """
 
 class RexProConnectionPool(object):
 
-    def __init__(self, host, port, size):
+    def __init__(self, host, port, size, max_size=None, timeout=None, max_idle_time=None, max_lifetime=None,
+                 validate=True, connect_timeout=None, read_timeout=None):
         """
         Connection constructor
 
@@ -76,59 +291,883 @@ class RexProConnectionPool(object):
         :type port: int
         :param size: the initial connection pool size
         :type size: int
+        :param max_size: the maximum number of open connections, defaults to size
+        :type max_size: int
+        :param timeout: the default number of seconds get waits for a free connection, None waits forever
+        :type timeout: float
+        :param max_idle_time: connections idle in the pool for longer than this many seconds are closed
+        :type max_idle_time: float
+        :param max_lifetime: connections open for longer than this many seconds are closed instead of reused
+        :type max_lifetime: float
+        :param validate: check that idle connections are still usable when they're checked out
+        :type validate: bool
+        :param connect_timeout: the number of seconds opening a connection can take, defaults to read_timeout
+        :type connect_timeout: float
+        :param read_timeout: the number of seconds a single read or write on a connection can wait, None waits forever
+        :type read_timeout: float
         """
 
         self.host = host
         self.port = port
         self.size = size
+        self.max_size = max(max_size or size, 1)
+        self.timeout = timeout
+        self.max_idle_time = max_idle_time
+        self.max_lifetime = max_lifetime
+        self.validate = validate
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+        self._lock = Condition()
 
-        self.pool = Queue()
-        for i in range(size):
-            self.pool.put(self._new_conn())
+        #idle connections and the time they were returned, most recently used last
+        self._idle = deque()
+
+        #open times of every connection belonging to the pool, in or out of it
+        self._created_at = {}
+
+        #number of connections that are open or being opened
+        self._num_connections = 0
+
+        self._stats = {
+            'checkouts': 0,
+            'created': 0,
+            'discarded': 0,
+            'timeouts': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+        }
+
+        for i in range(min(size, self.max_size)):
+            self._num_connections += 1
+            self._add_idle(self._create_conn())
 
     def _new_conn(self):
         """
         Creates and returns a new connection
         """
         conn = RexProSocket()
-        conn.connect((self.host, self.port))
+        conn.settimeout(self.read_timeout if self.connect_timeout is None else self.connect_timeout)
+        try:
+            conn.connect((self.host, self.port))
+        except socket_timeout:
+            conn.close()
+            raise RexProConnectionException('timed out connecting to {}:{}'.format(self.host, self.port))
+        conn.set_read_timeout(self.read_timeout)
         return conn
 
-    def get(self):
+    def _close_conn(self, conn):
+        """
+        Closes a connection that's leaving the pool
+        """
+        conn.close()
+
+    def _is_usable(self, conn):
+        """
+        Checks that an idle connection can still be used
+
+        nothing should ever be waiting to be read on an idle connection, if
+        there is, the server has closed it or it's out of sync with rexster
+        """
+        readable, writable, errored = select([conn], [], [conn], 0)
+        return not (readable or errored)
+
+    def _create_conn(self):
+        """
+        Opens a connection the pool has already counted, uncounting it if that fails
+        """
+        try:
+            conn = self._new_conn()
+        except:
+            with self._lock:
+                self._num_connections -= 1
+                self._lock.notify()
+            raise
+        with self._lock:
+            self._created_at[conn] = time.time()
+            self._stats['created'] += 1
+        return conn
+
+    def _add_idle(self, conn):
+        with self._lock:
+            self._idle.append((conn, time.time()))
+            self._lock.notify()
+
+    def _is_expired(self, conn, now):
+        if self.max_lifetime is None:
+            return False
+        return now - self._created_at.get(conn, now) > self.max_lifetime
+
+    def _remove_idle(self, now):
+        """
+        Takes the idle connections that have expired out of the pool, the caller
+        needs to hold the lock and discard them
+
+        :rtype: list
+        """
+        expired = []
+        if self.max_idle_time is not None:
+            #the least recently used connections are at the front
+            while self._idle and now - self._idle[0][1] > self.max_idle_time:
+                expired.append(self._idle.popleft()[0])
+        if self.max_lifetime is not None:
+            for item in list(self._idle):
+                if self._is_expired(item[0], now):
+                    self._idle.remove(item)
+                    expired.append(item[0])
+        return expired
+
+    def evict_idle(self):
+        """
+        Closes the idle connections that have been idle for longer than max_idle_time
+        or open for longer than max_lifetime, this is also done as connections are
+        checked out and returned
+        """
+        with self._lock:
+            expired = self._remove_idle(time.time())
+        for conn in expired:
+            self.discard(conn)
+
+    def get(self, timeout=None):
         """
-        Returns a connection, creating a new one if the pool is empty
+        Returns a connection, opening a new one if none are free and the pool isn't
+        at max_size, otherwise waiting for one to be returned
+
+        :param timeout: the number of seconds to wait for a free connection, defaults to the pool timeout
+        :type timeout: float
         """
-        if self.pool.empty():
-            return self._new_conn()
-        return self.pool.get()
+        timeout = self.timeout if timeout is None else timeout
+        start = time.time()
+        deadline = None if timeout is None else start + timeout
+
+        while True:
+            conn = None
+            with self._lock:
+                while True:
+                    now = time.time()
+                    expired = self._remove_idle(now)
+                    if expired:
+                        break
+                    if self._idle:
+                        conn = self._idle.pop()[0]
+                        break
+                    if self._num_connections < self.max_size:
+                        self._num_connections += 1
+                        break
+                    if deadline is not None and now >= deadline:
+                        self._stats['timeouts'] += 1
+                        raise exceptions.RexProTimeoutException('timed out waiting for a free connection')
+                    self._lock.wait(None if deadline is None else deadline - now)
+
+            if expired:
+                for expired_conn in expired:
+                    self.discard(expired_conn)
+                continue
+
+            if conn is None:
+                conn = self._create_conn()
+            elif self.validate and not self._is_usable(conn):
+                self.discard(conn)
+                continue
+
+            wait_time = time.time() - start
+            with self._lock:
+                self._stats['checkouts'] += 1
+                self._stats['wait_time_total'] += wait_time
+                self._stats['wait_time_max'] = max(self._stats['wait_time_max'], wait_time)
+            return conn
+
+    def get_nowait(self):
+        """
+        Returns an idle connection, or a new one if the pool isn't at max_size,
+        or None rather than wait for a connection to be returned
+        """
+        with self._lock:
+            available = self._idle or self._num_connections < self.max_size
+        if not available:
+            return None
+        try:
+            return self.get(timeout=0)
+        except exceptions.RexProTimeoutException:
+            #another thread got there first
+            return None
 
     def put(self, conn):
         """
-        returns a connection to the pool, will close the connection if the pool is full
+        returns a connection to the pool, will close the connection if it's been open for longer than max_lifetime
         """
-        if self.pool.qsize() >= self.size:
-            conn.close()
+        if conn not in self._created_at or self._is_expired(conn, time.time()):
+            self.discard(conn)
             return
 
-        self.pool.put(conn)
+        self._add_idle(conn)
+
+    def discard(self, conn):
+        """
+        closes a connection instead of returning it to the pool, use this for
+        connections that are broken or left in an unknown state
+        """
+        with self._lock:
+            if self._created_at.pop(conn, None) is not None:
+                self._num_connections -= 1
+                self._stats['discarded'] += 1
+            self._lock.notify()
+        try:
+            self._close_conn(conn)
+        except Exception:
+            pass
 
     @contextmanager
-    def contextual_connection(self):
+    def contextual_connection(self, timeout=None):
         """
-        context manager that will open, yield, and close a connection
+        context manager that will check out, yield, and return a connection
+
+        connections are discarded instead of returned if the block raises
+        anything other than a script error
         """
-        conn = self.get()
-        yield conn
-        self.put(conn)
+        conn = self.get(timeout=timeout)
+        try:
+            yield conn
+        except exceptions.RexProScriptException:
+            self.put(conn)
+            raise
+        except:
+            self.discard(conn)
+            raise
+        else:
+            self.put(conn)
+
+    def get_stats(self):
+        """
+        Returns a dictionary of pool usage stats, wait times are in seconds
+
+        :rtype: dict
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = self._num_connections
+            stats['max_size'] = self.max_size
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = self._num_connections - len(self._idle)
+            stats['utilization'] = stats['in_use'] / float(self.max_size)
+            stats['wait_time_avg'] = stats['wait_time_total'] / stats['checkouts'] if stats['checkouts'] else 0.0
+        return stats
+
+    def close_all(self):
+        """
+        closes all of the idle connections in the pool
+        """
+        with self._lock:
+            idle = [item[0] for item in self._idle]
+            self._idle.clear()
+        for conn in idle:
+            self.discard(conn)
 
     def __del__(self):
-        while not self.pool.empty():
-            self.pool.get().close()
+        for conn, returned_at in getattr(self, '_idle', []):
+            try:
+                self._close_conn(conn)
+            except Exception:
+                pass
+
+
+class RexProSessionPool(RexProConnectionPool):
+
+    def __init__(self, host, port, graph_name, size, graph_obj_name='g', username='', password='', procedures=None,
+                 normalizer=None, listeners=None, cache=None, result_factory=None, request_timeout=None,
+                 retry_policy=None, hedge_policy=None, **kwargs):
+        """
+        Pool of RexProConnections with open sessions, takes the same keyword
+        arguments as RexProConnectionPool
+
+        :param host: the rexpro server to connect to
+        :type host: str (ip address)
+        :param port: the rexpro server port to connect to
+        :type port: int
+        :param graph_name: the graph to connect to
+        :type graph_name: str
+        :param size: the initial connection pool size
+        :type size: int
+        :param username: the username to use for authentication (optional)
+        :type username: str
+        :param password: the password to use for authentication (optional)
+        :type password: str
+        :param procedures: stored procedures to define on the pooled sessions
+        :type procedures: StoredProcedures
+        :param normalizer: hoists literals out of scripts into params, shared by the pooled connections
+        :type normalizer: ScriptNormalizer
+        :param listeners: RequestListeners told about the requests of every pooled connection
+        :type listeners: list
+        :param cache: result cache shared by the pooled connections
+        :type cache: ResultCache
+        :param result_factory: decodes the script results of the pooled connections
+        :type result_factory: ResultFactory
+        :param request_timeout: the default number of seconds a script request on a pooled connection can take
+        :type request_timeout: float
+        :param retry_policy: the default policy for retrying failed executes, each attempt is made on a
+            session checked out for it
+        :type retry_policy: RetryPolicy
+        :param hedge_policy: hedges read only executes on a second pooled session
+        :type hedge_policy: HedgePolicy
+
+        connections that time out are discarded rather than returned to the pool
+        """
+        self.graph_name = graph_name
+        self.graph_obj_name = graph_obj_name
+        self.username = username
+        self.password = password
+        self.procedures = procedures
+        self.normalizer = normalizer
+        self.listeners = list(listeners or [])
+        self.cache = cache
+        self.result_factory = result_factory
+        self.request_timeout = request_timeout
+        self.retry_policy = retry_policy
+        self.hedge_policy = hedge_policy
+        super(RexProSessionPool, self).__init__(host, port, size, **kwargs)
+
+    def _new_conn(self):
+        """
+        Creates and returns a new connection
+        """
+        return RexProConnection(
+            self.host,
+            self.port,
+            self.graph_name,
+            graph_obj_name=self.graph_obj_name,
+            username=self.username,
+            password=self.password,
+            procedures=self.procedures,
+            normalizer=self.normalizer,
+            listeners=self.listeners,
+            cache=self.cache,
+            result_factory=self.result_factory,
+            connect_timeout=self.connect_timeout,
+            read_timeout=self.read_timeout,
+            request_timeout=self.request_timeout
+        )
+
+    def _close_conn(self, conn):
+        try:
+            if conn._session_key is not None:
+                conn.close()
+        finally:
+            conn._conn.close()
+
+    def _is_usable(self, conn):
+        if conn._session_key is None:
+            return False
+        return super(RexProSessionPool, self)._is_usable(conn._conn)
+
+    def put(self, conn):
+        """
+        returns a connection to the pool, reading any pipelined responses
+        still outstanding and rolling back any transaction left open on it
+        """
+        if conn._session_key is None:
+            self.discard(conn)
+            return
+
+        try:
+            conn.flush()
+            if conn._in_transaction:
+                conn.close_transaction(success=False)
+        except exceptions.RexProException:
+            self.discard(conn)
+            return
+
+        super(RexProSessionPool, self).put(conn)
+
+    @contextmanager
+    def transaction(self, timeout=None):
+        """
+        context manager that checks out a connection and yields it inside of a
+        transaction, the transaction is committed at the end of the block and
+        rolled back if the block raises
+        """
+        with self.contextual_connection(timeout=timeout) as conn:
+            with conn.transaction():
+                yield conn
+
+    def execute(self, script, params={}, timeout=None, idempotent=False, read_only=False, retry_policy=None,
+                **kwargs):
+        """
+        executes the given gremlin script on a pooled connection, takes the
+        same arguments as RexProConnection.execute
+
+        if rexster has killed the connection's session, a new session is
+        opened and the script is run again
+
+        :param timeout: the number of seconds waiting for a connection, the request, and running it again on a new
+            session or retrying it can take altogether, defaults to the pool's request_timeout
+        :type timeout: float
+        :param idempotent: the script can safely be run more than once, so it can be retried after errors that
+            leave it unknown whether it ran
+        :type idempotent: bool
+        :param read_only: the script doesn't change the graph, it's retried like an idempotent script, and hedged
+            if the pool has a hedge policy
+        :type read_only: bool
+        :param retry_policy: retries the request on another session if it fails, defaults to the pool's retry_policy
+        :type retry_policy: RetryPolicy
+
+        :rtype: list
+        """
+        deadline = utils.deadline(self.request_timeout if timeout is None else timeout)
+
+        if kwargs.get('cached') and self.cache is not None and kwargs.get('isolate', True):
+            #cache hits don't need a connection
+            cached_kwargs = dict(kwargs, cached=False, result_factory=kwargs.get('result_factory') or self.result_factory)
+            params = self.cache.encode_params(params)
+            return self.cache.get_or_execute(
+                self.cache.key(self.graph_name, script, params, cached_kwargs['result_factory']),
+                lambda: self.execute(script, params, timeout=utils.time_left(deadline), idempotent=idempotent,
+                                     read_only=read_only, retry_policy=retry_policy, **cached_kwargs)
+            )
+
+        if read_only and self.hedge_policy is not None:
+            attempt = lambda: self._execute_hedged(script, params, deadline, **kwargs)
+        else:
+            attempt = lambda: self._execute(script, params, deadline, **kwargs)
+
+        retry_policy = retry_policy or self.retry_policy
+        if retry_policy is None:
+            return attempt()
+        return retry_policy.call(attempt, idempotent=idempotent or read_only, deadline=deadline)
+
+    def _execute(self, script, params, deadline, **kwargs):
+        """
+        executes a script on a pooled connection, running it again on a new
+        session if rexster has killed the connection's session
+        """
+        with self.contextual_connection(timeout=utils.time_left(deadline)) as conn:
+            try:
+                return conn.execute(script, params, timeout=utils.time_left(deadline), **kwargs)
+            except exceptions.RexProScriptException:
+                if conn._session_key is not None:
+                    raise
+
+            conn._open_session(deadline=deadline)
+            return conn.execute(script, params, timeout=utils.time_left(deadline), **kwargs)
+
+    def _execute_hedged(self, script, params, deadline, **kwargs):
+        """
+        executes a read only script, hedging it on a second pooled session
+        """
+        def checkout(hedge):
+            if not hedge:
+                return self.get(timeout=utils.time_left(deadline))
+            try:
+                #waiting on a session that's in use could take longer than the request
+                return self.get_nowait()
+            except CONNECTION_ERRORS:
+                return None
+
+        kwargs.pop('cached', None)
+        return execute_hedged(self.hedge_policy, checkout, self.put, script, params, deadline=deadline, **kwargs)
+
+    def execute_parallel(self, script, params_iterable, concurrency=None, ordered=True, errors=ERRORS_RAISE,
+                         buffer_size=None, **kwargs):
+        """
+        executes a script once for each params dictionary, on concurrency
+        sessions at once, takes the same keyword arguments as RexProConnection.execute,
+        a timeout applies to each execution
+
+        params are read from params_iterable as results are consumed, so at
+        most buffer_size of them are in flight or waiting to be yielded at once
+
+        :param script: the gremlin script, or a prepared script
+        :type script: string/PreparedScript
+        :param params_iterable: the params of each execution
+        :type params_iterable: iterable
+        :param concurrency: the number of sessions to execute on, defaults to and can't be more than the
+            pool's max_size
+        :type concurrency: int
+        :param ordered: yield the results in the order of the params, if False they're yielded as
+            (index, result) tuples as they complete
+        :type ordered: bool
+        :param errors: what to do when an execution fails, ERRORS_RAISE raises the exception,
+            ERRORS_RETURN yields it in place of the result, and ERRORS_SKIP leaves the result out
+        :type errors: str
+        :param buffer_size: the maximum number of params read ahead of the results, defaults to twice the concurrency
+        :type buffer_size: int
+
+        :rtype: iterator
+        """
+        if errors not in (ERRORS_RAISE, ERRORS_RETURN, ERRORS_SKIP):
+            raise ValueError('unknown error policy {}'.format(errors))
+        #workers hold on to their sessions, so any more than the pool can open would wait on them forever
+        concurrency = min(concurrency or self.max_size, self.max_size)
+        buffer_size = max(buffer_size or concurrency * 2, concurrency)
+
+        work = Queue()
+        done = Queue()
+        stopped = Event()
+
+        def worker():
+            conn = None
+            try:
+                while True:
+                    item = work.get()
+                    if item is None or stopped.is_set():
+                        return
+                    index, params = item
+                    try:
+                        if conn is None:
+                            conn = self.get()
+                        result = conn.execute(script, params, **kwargs)
+                    except exceptions.RexProScriptException as ex:
+                        if conn._session_key is None:
+                            self.discard(conn)
+                            conn = None
+                        done.put((index, False, ex))
+                    except Exception as ex:
+                        if conn is not None:
+                            self.discard(conn)
+                            conn = None
+                        done.put((index, False, ex))
+                    else:
+                        done.put((index, True, result))
+            finally:
+                if conn is not None:
+                    self.put(conn)
+
+        threads = [Thread(target=worker, name='rexpro-parallel') for i in range(concurrency)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        params_iter = iter(params_iterable)
+        exhausted = False
+        submitted = 0
+        consumed = 0
+
+        #results that arrived before the results of earlier params, by index
+        completed = {}
+
+        try:
+            while True:
+                while not exhausted and submitted - consumed < buffer_size:
+                    try:
+                        params = next(params_iter)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    work.put((submitted, params))
+                    submitted += 1
+
+                if submitted == consumed:
+                    return
+
+                index, succeeded, value = done.get()
+                if ordered:
+                    completed[index] = (succeeded, value)
+                    ready = []
+                    while consumed in completed:
+                        ready.append((consumed, completed.pop(consumed)))
+                        consumed += 1
+                else:
+                    ready = [(index, (succeeded, value))]
+                    consumed += 1
+
+                for index, (succeeded, value) in ready:
+                    if not succeeded:
+                        if errors == ERRORS_RAISE:
+                            raise value
+                        if errors == ERRORS_SKIP:
+                            continue
+                    yield value if ordered else (index, value)
+        finally:
+            stopped.set()
+            for thread in threads:
+                work.put(None)
+
+
+class PendingResult(object):
+    """
+    The eventual result of a script request that has been sent on a
+    connection, but whose response may not have been read yet
+    """
+
+    def __init__(self, connection, request_id):
+        """
+        :param connection: the connection the request was sent on
+        :type connection: RexProConnection
+        :param request_id: the id of the request
+        :type request_id: str (uuid bytes)
+        """
+        self.connection = connection
+        self.request_id = request_id
+        self._response = None
+
+        #timings of the request, if the connection has listeners
+        self.event = None
+
+        #decodes the response, None decodes it into plain lists and dicts
+        self.result_factory = None
+
+        #the time the response has to have arrived by, None if there isn't one
+        self.deadline = None
+
+        #the exception the request failed with, if it never got a response
+        self._exception = None
+
+    def _set_response(self, response):
+        self._response = response
+
+    def _set_exception(self, exception):
+        self._exception = exception
+
+    def _take_event(self):
+        """ returns the request's event and clears it, so it's only reported once """
+        event, self.event = self.event, None
+        return event
+
+    def done(self):
+        """ returns True if the response for this request has been read, or the request failed """
+        return self._response is not None or self._exception is not None
+
+    def result(self):
+        """
+        returns the results of the request, reading responses from the
+        connection until this request's response arrives
+
+        :rtype: list
+        :raises RexProTimeoutException: if the response doesn't arrive by the request's deadline
+        """
+        while self._response is None and self._exception is None:
+            self.connection._read_response(deadline=self.deadline)
+
+        if self._exception is not None:
+            raise self._exception
+
+        if isinstance(self._response, messages.ErrorResponse):
+            meta = self._response.meta or {}
+            if meta.get('flag') == messages.ErrorResponse.INVALID_SESSION_ERROR:
+                #rexster doesn't know about our session anymore
+                self.connection._session_key = None
+            raise exceptions.RexProScriptException(self._response.message, meta=meta)
+
+        return self._response.results
+
+
+class ResponseFuture(PendingResult):
+    """
+    PendingResult of a ThreadSafeRexProConnection, resolved by the
+    connection's reader thread, that can be waited on from any thread
+    """
+
+    def __init__(self, connection, request_id):
+        super(ResponseFuture, self).__init__(connection, request_id)
+        self._done = Event()
+        self._callbacks = []
+        self._callbacks_lock = Lock()
+
+    def _set_response(self, response):
+        self._response = response
+        self._resolve()
+
+    def _set_exception(self, exception):
+        self._exception = exception
+        self._resolve()
+
+    def _take_event(self):
+        #the reader thread and a caller that timed out can both try to report it
+        with self._callbacks_lock:
+            return super(ResponseFuture, self)._take_event()
+
+    def _resolve(self):
+        self._done.set()
+        with self._callbacks_lock:
+            callbacks, self._callbacks = self._callbacks, None
+        for callback in callbacks:
+            callback(self)
+
+    def done(self):
+        """ returns True if the response for this request has arrived, or the request failed """
+        return self._done.is_set()
+
+    def add_done_callback(self, callback):
+        """
+        Calls callback with this future when it's resolved, immediately if it already is
+
+        callbacks of unresolved futures are called from the connection's reader
+        thread, so they shouldn't block
+
+        :param callback: callable that takes the future
+        :type callback: callable
+        """
+        with self._callbacks_lock:
+            if self._callbacks is not None:
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def response(self, timeout=None):
+        """
+        Waits for and returns the response message
+
+        :param timeout: the number of seconds to wait, None waits until the request's deadline, or forever
+        :type timeout: float
+
+        :rtype: RexProMessage
+        """
+        if self.deadline is not None and not self._done.is_set():
+            left = utils.time_left(self.deadline)
+            timeout = left if timeout is None else min(timeout, left)
+        if not self._done.wait(timeout):
+            exception = exceptions.RexProTimeoutException('timed out waiting for a response')
+            if self.deadline is not None and time.time() >= self.deadline:
+                #the request has failed, even if its response arrives later
+                event = self._take_event()
+                if event is not None:
+                    self.connection._fail_event(event, exception)
+            raise exception
+        if self._exception is not None:
+            raise self._exception
+        return self._response
+
+    def exception(self, timeout=None):
+        """
+        Waits for the request and returns the exception its result would raise, or None
+
+        :param timeout: the number of seconds to wait, None waits forever
+        :type timeout: float
+        """
+        try:
+            self.result(timeout=timeout)
+        except exceptions.RexProException as ex:
+            return ex
+
+    def result(self, timeout=None):
+        """
+        returns the results of the request, waiting for the reader thread to receive them
+
+        :param timeout: the number of seconds to wait, None waits forever
+        :type timeout: float
+
+        :rtype: list
+        """
+        self.response(timeout)
+        return super(ResponseFuture, self).result()
+
+
+#graph features are the same for every connection to a graph, so they're shared
+#between connections, keyed by (host, port, graph name), values are (features, time fetched)
+_graph_features = {}
+_graph_features_lock = Lock()
+
+def wait_first(pending_results, timeout=None):
+    """
+    Waits for the first of several pipelined requests, each sent on a
+    different RexProConnection, to be answered
+
+    requests whose deadline passes fail, and their connections are
+    abandoned, as they would be if their results were read
+
+    :param pending_results: the requests
+    :type pending_results: list
+    :param timeout: the number of seconds to wait, None waits until a request is answered or they've all failed
+    :type timeout: float
+
+    :returns: the PendingResult answered first, the first one if they all failed, or None if the timeout passed first
+    """
+    wait_until = utils.deadline(timeout)
+    while True:
+        now = time.time()
+        waiting = []
+        for pending in pending_results:
+            if not pending.done() and pending.deadline is not None and now >= pending.deadline:
+                pending.connection._abandon(exceptions.RexProTimeoutException('timed out waiting for rexster'))
+            if not pending.done():
+                waiting.append(pending)
+            elif pending._exception is None:
+                #an error response is an answer too
+                return pending
+
+        if not waiting:
+            return pending_results[0]
+        if wait_until is not None and now >= wait_until:
+            return None
+
+        ends = [end for end in [wait_until] + [p.deadline for p in waiting] if end is not None]
+        sockets = dict((pending.connection._conn, pending) for pending in waiting)
+        readable, writable, errored = select(list(sockets), [], [], min(ends) - now if ends else None)
+        for sock in readable:
+            pending = sockets[sock]
+            try:
+                pending.connection._read_response(deadline=pending.deadline)
+            except CONNECTION_ERRORS:
+                #the connection has been abandoned, failing the request
+                if not pending.done():
+                    raise
+
+def execute_hedged(policy, checkout, release, script, params={}, deadline=None, **kwargs):
+    """
+    executes a read only script on a connection, and if it isn't answered
+    within the hedge policy's delay, sends it again on a second connection,
+    returning the results of whichever is answered first
+
+    :param policy: the hedge policy
+    :type policy: HedgePolicy
+    :param checkout: called with hedge=False to get the first connection, and with hedge=True to get the
+        second, when it should return None rather than wait for one
+    :type checkout: callable
+    :param release: called with each connection once it's been used, on a background thread for a
+        connection whose response is still on its way, so it can be read before the connection is reused
+    :type release: callable
+    :param script: the gremlin script, or a prepared script
+    :type script: string/PreparedScript
+    :param params: the parameters to execute the script with
+    :type params: dictionary
+    :param deadline: the time the response has to have arrived by
+    :type deadline: float
+
+    other keyword arguments are passed to RexProConnection.execute_pipelined
+
+    :rtype: list
+    """
+    sessions = []
+    pending = []
+    started_at = time.time()
+    try:
+        conn = checkout(hedge=False)
+        sessions.append(conn)
+        pending.append(conn.execute_pipelined(script, params, timeout=utils.time_left(deadline), **kwargs))
+
+        answered = wait_first(pending, timeout=policy.delay())
+        if answered is None:
+            conn = checkout(hedge=True)
+            if conn is not None:
+                sessions.append(conn)
+                try:
+                    pending.append(conn.execute_pipelined(script, params, timeout=utils.time_left(deadline), **kwargs))
+                except CONNECTION_ERRORS:
+                    #the first request can still be answered
+                    pass
+            answered = wait_first(pending)
+
+        if answered._exception is None:
+            policy.observe(time.time() - started_at, hedged=len(pending) > 1, hedge_won=answered is not pending[0])
+        return answered.result()
+    finally:
+        for conn in sessions:
+            if conn._pending:
+                thread = Thread(target=release, args=(conn,), name='rexpro-hedge')
+                thread.daemon = True
+                thread.start()
+            else:
+                release(conn)
 
 
 class RexProConnection(object):
 
-    def __init__(self, host, port, graph_name, graph_obj_name='g', username='', password=''):
+    #the socket class used to talk to rexster
+    socket_class = RexProSocket
+
+    def __init__(self, host, port, graph_name, graph_obj_name='g', username='', password='', max_in_flight=32,
+                 graph_features_ttl=None, procedures=None, normalizer=None, listeners=None, cache=None,
+                 result_factory=None, connect_timeout=None, read_timeout=None, request_timeout=None,
+                 retry_policy=None):
         """
         Connection constructor
 
@@ -142,41 +1181,169 @@ class RexProConnection(object):
         :type username: str
         :param password: the password to use for authentication (optional)
         :type password: str
+        :param max_in_flight: the maximum number of pipelined requests waiting on a response
+        :type max_in_flight: int
+        :param graph_features_ttl: the number of seconds the shared graph features are cached for, None caches them forever
+        :type graph_features_ttl: float
+        :param procedures: stored procedures to define on this connection's session
+        :type procedures: StoredProcedures
+        :param normalizer: hoists literals out of isolated scripts into params before they're sent
+        :type normalizer: ScriptNormalizer
+        :param listeners: RequestListeners told about the timings and sizes of every script request
+        :type listeners: list
+        :param cache: caches the results of executes made with cached=True, can be shared between connections
+        :type cache: ResultCache
+        :param result_factory: decodes script results, like results.ElementFactory, None returns plain lists and dicts
+        :type result_factory: ResultFactory
+        :param connect_timeout: the number of seconds connecting and opening the session can take, defaults to read_timeout
+        :type connect_timeout: float
+        :param read_timeout: the number of seconds a single read or write on the socket can wait, None waits forever
+        :type read_timeout: float
+        :param request_timeout: the default number of seconds a script request can take, None doesn't limit it
+        :type request_timeout: float
+        :param retry_policy: the default policy for retrying failed executes, None doesn't retry them
+        :type retry_policy: RetryPolicy
+
+        a request that times out leaves its response on the way, so the connection
+        can't be used anymore once one has, unless it's reconnected to retry a request
         """
         self.host = host
         self.port = port
         self.graph_name = graph_name
         self.username = username
         self.password = password
+        self.max_in_flight = max_in_flight
+        self.graph_features_ttl = graph_features_ttl
+        self.procedures = procedures
+        self.normalizer = normalizer
+        self.listeners = list(listeners or [])
+        self.cache = cache
+        self.result_factory = result_factory
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.request_timeout = request_timeout
+        self.retry_policy = retry_policy
 
-        self.graph_features = None
+        #set once a request has been sent with a result factory, after which the request id of every
+        #script response is read before it's decoded, to find the factory to decode it with
+        self._uses_factories = result_factory is not None
 
-        #connect to server
-        self._conn = RexProSocket()
-        self._conn.connect((self.host, self.port))
+        #(registry, version) of the stored procedures defined on the current session, the registry is kept so
+        #replacing it with another one at the same version still defines its procedures
+        self._procedures_version = None
 
         #indicates that we're in a transaction
         self._in_transaction = False
 
+        #requests that have been sent but not answered, by request id
+        self._pending = OrderedDict()
+
         #stores the session key
         self._session_key = None
-        self._open_session()
 
-    def _open_session(self):
-        """ Creates a session with rexster and creates the graph object """
-        self._conn.send_message(
+        #the exception that made the connection unusable
+        self._error = None
+
+        #connect to server
+        self._connect()
+
+    def _connect(self, deadline=None):
+        """
+        Opens the socket and the session
+
+        :param deadline: the time the session has to have been opened by, if that's sooner than the connect timeout
+        :type deadline: float
+        """
+        connect_timeout = self.read_timeout if self.connect_timeout is None else self.connect_timeout
+        if deadline is not None:
+            left = utils.time_left(deadline)
+            connect_timeout = left if connect_timeout is None else min(connect_timeout, left)
+
+        self._conn = self.socket_class()
+        try:
+            self._conn.settimeout(connect_timeout)
+            self._conn.connect((self.host, self.port))
+            self._conn.set_read_timeout(self.read_timeout)
+            self._open_session(deadline=utils.deadline(connect_timeout))
+        except (socket_timeout, exceptions.RexProTimeoutException):
+            self._conn.close()
+            #the host couldn't be reached in time, which isn't the same as a request timing out
+            raise RexProConnectionException('timed out connecting to {}:{}'.format(self.host, self.port))
+        except:
+            self._conn.close()
+            raise
+
+    def _reconnect(self, deadline=None):
+        """
+        Replaces a connection that can't be used anymore with a new socket
+        and session, session variables set on the old session are lost
+
+        :param deadline: the time the new session has to have been opened by
+        :type deadline: float
+        """
+        self._conn.close()
+        self._pending = OrderedDict()
+        self._session_key = None
+        self._connect(deadline=deadline)
+        self._error = None
+
+    def _request(self, message, deadline=None):
+        """
+        Sends a message that isn't pipelined and returns rexster's response to it
+
+        :param message: the message to send
+        :type message: RexProMessage
+        :param deadline: the time the response has to have arrived by
+        :type deadline: float
+
+        :rtype: RexProMessage
+        """
+        try:
+            self._conn.send_message(message)
+            return self._conn.get_response(deadline=deadline)
+        except CONNECTION_ERRORS as ex:
+            self._abandon(ex)
+            raise
+
+    def _open_session(self, deadline=None):
+        """
+        Creates a session with rexster and creates the graph object
+
+        :param deadline: the time the session has to have been opened by
+        :type deadline: float
+        """
+        response = self._request(
             messages.SessionRequest(
                 username=self.username,
                 password=self.password,
                 graph_name=self.graph_name
-            )
+            ),
+            deadline=deadline
         )
-        response = self._conn.get_response()
         if isinstance(response, ErrorResponse):
             raise RexProConnectionException(response.message)
         self._session_key = response.session_key
+        self._in_transaction = False
+        self._procedures_version = None
 
-        self.graph_features = self.execute('g.getFeatures().toMap()')
+    @property
+    def graph_features(self):
+        """
+        The features of the connected graph, fetched on first access and
+        shared with every other connection to the same graph
+        """
+        key = (self.host, self.port, self.graph_name)
+        with _graph_features_lock:
+            cached = _graph_features.get(key)
+        if cached is not None:
+            features, fetched_at = cached
+            if self.graph_features_ttl is None or time.time() - fetched_at < self.graph_features_ttl:
+                return features
+
+        features = self.execute('g.getFeatures().toMap()')
+        with _graph_features_lock:
+            _graph_features[key] = (features, time.time())
+        return features
 
     def open_transaction(self):
         """ opens a transaction """
@@ -203,15 +1370,22 @@ class RexProConnection(object):
         )
         self._in_transaction = False
 
+        if success and self.cache is not None:
+            self.cache.invalidate(self.graph_name)
+
     def close(self):
-        self._conn.send_message(
+        if self._error is not None:
+            #rexster will drop the session when it notices the socket has closed
+            self._conn.close()
+            return
+        self.flush()
+        response = self._request(
             messages.SessionRequest(
                 session_key=self._session_key,
                 graph_name=self.graph_name,
                 kill_session=True
             )
         )
-        response = self._conn.get_response()
         if isinstance(response, ErrorResponse):
             raise RexProConnectionException(response.message)
 
@@ -222,15 +1396,174 @@ class RexProConnection(object):
         the end of it's code block, use with the 'with' statement
         """
         self.open_transaction()
-        yield
+        try:
+            yield
+        except:
+            if self._in_transaction:
+                self.close_transaction(success=False)
+            raise
         self.close_transaction()
 
-    def execute(self, script, params={}, isolate=True, transaction=True, pretty=False):
+    def prepare(self, script, isolate=True, transaction=True):
         """
-        executes the given gremlin script with the provided parameters
+        prepares a gremlin script that will be executed many times, the script
+        and request options are encoded once instead of with every request.
+        The prepared script can be passed to execute in place of a script, on
+        this or any other connection.
 
-        :param script: the gremlin script to isolate
+        :param script: the gremlin script to prepare
         :type script: string
+        :param isolate: wraps the script in a closure so any variables set aren't persisted for the next execute call
+        :type isolate: bool
+        :param transaction: query will be wrapped in a transaction if set to True (default)
+        :type transaction: bool
+
+        :rtype: PreparedScript
+        """
+        return messages.PreparedScript(script, isolate=isolate, in_transaction=transaction)
+
+    def _script_request(self, script, params, isolate, transaction):
+        if isinstance(script, messages.PreparedScript):
+            return script.request(params=params, session_key=self._session_key)
+        if self.normalizer is not None and isolate:
+            #scripts that aren't isolated can define closures and variables that outlive the request, and
+            #would look up the hoisted params on a later request, where they're gone or hold other values
+            script, params = self.normalizer.normalize(script, params)
+        return messages.ScriptRequest(
+            script=script,
+            params=params,
+            session_key=self._session_key,
+            isolate=isolate,
+            in_transaction=transaction
+        )
+
+    def _read_response(self, deadline=None):
+        """
+        Reads the next response from rexster and hands it to the pending request it answers
+
+        :param deadline: the time the response has to have arrived by
+        :type deadline: float
+        """
+        event = metrics.RequestEvent() if self.listeners else None
+        try:
+            response = self._conn.get_response(
+                event=event,
+                result_factory_for=self._result_factory_for,
+                deadline=deadline
+            )
+        except CONNECTION_ERRORS as ex:
+            self._abandon(ex)
+            raise
+        pending = self._pop_pending(response.request_id)
+
+        request_event = pending._take_event()
+        if request_event is not None and event is not None:
+            self._finish_event(request_event, response, event)
+        pending._set_response(response)
+
+    def _abandon(self, exception):
+        """
+        Stops using the connection after a request times out, or the socket
+        fails. The response being waited on is still on its way, or partly
+        read, so nothing else can be read from the socket, and every pending
+        request fails.
+        """
+        self._error = exception
+        self._session_key = None
+        self._in_transaction = False
+        pending, self._pending = list(self._pending.values()), OrderedDict()
+        for pending_result in pending:
+            event = pending_result._take_event()
+            if event is not None:
+                self._fail_event(event, exception)
+            pending_result._set_exception(exception)
+        self._conn.close()
+
+    def _check_usable(self):
+        if self._error is not None:
+            raise exceptions.RexProConnectionException('connection is no longer usable: {}'.format(self._error))
+
+    def _result_factory_for(self, body):
+        """
+        Returns the result factory of the pending request a script response answers
+        """
+        if not self._uses_factories:
+            return None
+        request_id = messages.RexProMessage.peek_request_id(body)
+        pending = self._pending.get(request_id)
+        if pending is None and request_id is None and self._pending:
+            #responses without a request id answer the oldest request
+            pending = next(iter(self._pending.values()))
+        return pending.result_factory if pending is not None else None
+
+    def _add_pending(self, request_id):
+        """
+        Registers a request that's about to be sent
+
+        :rtype: PendingResult
+        """
+        pending = PendingResult(self, request_id)
+        self._pending[request_id] = pending
+        return pending
+
+    def _pop_pending(self, request_id):
+        """
+        Removes and returns the pending request a response answers
+        """
+        pending = self._pending.pop(request_id, None)
+        if pending is None:
+            if request_id is not None or not self._pending:
+                raise exceptions.RexProConnectionException('received a response for an unknown request')
+            #responses without a request id answer the oldest request, rexster replies to a session in order
+            request_id, pending = self._pending.popitem(last=False)
+        return pending
+
+    def _discard_pending(self, request_id):
+        """
+        Removes a request that couldn't be sent
+        """
+        self._pending.pop(request_id, None)
+
+    def _finish_event(self, event, response, response_event):
+        """
+        Merges the response timings into a request's event and reports it to the listeners
+        """
+        event.timings.update(response_event.timings)
+        event.bytes_received = response_event.bytes_received
+        event.message_type = type(response).__name__
+        if isinstance(response, messages.ErrorResponse):
+            flag = (response.meta or {}).get('flag')
+            event.error_type = metrics.ERROR_FLAGS.get(flag, 'UNKNOWN_ERROR')
+        event.timings['total'] = time.time() - event.started_at
+
+        for listener in self.listeners:
+            listener.on_request(event)
+
+    def _fail_event(self, event, exception):
+        """
+        Records the exception a request failed with on its event and reports it to the listeners
+        """
+        event.error_type = type(exception).__name__
+        event.timings['total'] = time.time() - event.started_at
+
+        for listener in self.listeners:
+            listener.on_request(event)
+
+    def flush(self):
+        """ reads the responses for all pipelined requests """
+        while self._pending:
+            self._read_response(deadline=next(iter(self._pending.values())).deadline)
+
+    def execute_pipelined(self, script, params={}, isolate=True, transaction=True, pretty=False, result_factory=None,
+                          timeout=None):
+        """
+        sends the given gremlin script without waiting for the response, so
+        several requests can be in flight on this connection at once. If
+        max_in_flight requests are already waiting, responses are read until
+        there's room for another.
+
+        :param script: the gremlin script to isolate, or a prepared script, whose own isolate and transaction options are used
+        :type script: string/PreparedScript
         :param params: the parameters to execute the script with
         :type params: dictionary
         :param isolate: wraps the script in a closure so any variables set aren't persisted for the next execute call
@@ -239,21 +1572,551 @@ class RexProConnection(object):
         :type transaction: bool
         :param pretty: will dedent the script if set to True
         :type pretty: bool
+        :param result_factory: decodes the results, defaults to the connection's result_factory
+        :type result_factory: ResultFactory
+        :param timeout: the number of seconds until the response has to have arrived, defaults to the connection's request_timeout
+        :type timeout: float
+
+        :rtype: PendingResult
+        """
+        self._check_usable()
+        deadline = utils.deadline(self.request_timeout if timeout is None else timeout)
+        while len(self._pending) >= self.max_in_flight:
+            self._read_response(deadline=deadline)
+
+        return self._send_script(script, params, isolate, transaction, result_factory=result_factory, deadline=deadline)
+
+    def _send_script(self, script, params, isolate, transaction, result_factory=None, deadline=None):
+        """
+        Builds and sends a script request, registering it as pending before
+        it's sent, so its response can't arrive before it's expected
+
+        :rtype: PendingResult
+        """
+        event = None
+        if self.listeners:
+            event = metrics.RequestEvent(started_at=time.time())
+
+        try:
+            request = self._script_request(script, params, isolate, transaction)
+            if request.request_id is None:
+                request.request_id = utils.random_uuid_bytes()
+            if event is not None:
+                event.timings['build'] = time.time() - event.started_at
+
+            pending = self._add_pending(request.request_id)
+            pending.event = event
+            pending.deadline = deadline
+            pending.result_factory = result_factory or self.result_factory
+            if pending.result_factory is not None:
+                self._uses_factories = True
+            try:
+                self._conn.send_message(request, event=event)
+            except CONNECTION_ERRORS as ex:
+                #part of the request may have been sent
+                self._discard_pending(request.request_id)
+                self._abandon(ex)
+                raise
+            except:
+                self._discard_pending(request.request_id)
+                raise
+        except Exception as ex:
+            if event is not None:
+                self._fail_event(event, ex)
+            raise
+
+        return pending
+
+    def execute(self, script, params={}, isolate=True, transaction=True, pretty=False, cached=False,
+                result_factory=None, timeout=None, idempotent=False, read_only=False, retry_policy=None):
+        """
+        executes the given gremlin script with the provided parameters
+
+        :param script: the gremlin script to isolate, or a prepared script, whose own isolate and transaction options are used
+        :type script: string/PreparedScript
+        :param params: the parameters to execute the script with
+        :type params: dictionary
+        :param isolate: wraps the script in a closure so any variables set aren't persisted for the next execute call
+        :type isolate: bool
+        :param transaction: query will be wrapped in a transaction if set to True (default)
+        :type transaction: bool
+        :param pretty: will dedent the script if set to True
+        :type pretty: bool
+        :param cached: read the results through the connection's cache, only for isolated read only scripts.
+            The cache isn't used inside a transaction, where the script could see uncommitted changes.
+        :type cached: bool
+        :param result_factory: decodes the results, defaults to the connection's result_factory
+        :type result_factory: ResultFactory
+        :param timeout: the number of seconds the request can take, including any retries, defaults to the
+            connection's request_timeout
+        :type timeout: float
+        :param idempotent: the script can safely be run more than once, so it can be retried after errors that
+            leave it unknown whether it ran
+        :type idempotent: bool
+        :param read_only: the script doesn't change the graph, read only scripts are idempotent, and pools and
+            clusters with a hedge policy hedge them
+        :type read_only: bool
+        :param retry_policy: retries the request if it fails, defaults to the connection's retry_policy. Requests
+            made inside a transaction are never retried.
+        :type retry_policy: RetryPolicy
 
         :rtype: list
+        :raises RexProTimeoutException: if the request takes longer than the timeout, the connection can't be used
+            anymore after that, unless it has a retry policy, which reconnects it
         """
-        self._conn.send_message(
-            messages.ScriptRequest(
-                script=script,
+        if cached and self.cache is not None and isolate and not self._in_transaction:
+            result_factory = result_factory or self.result_factory
+            params = self.cache.encode_params(params)
+            return self.cache.get_or_execute(
+                self.cache.key(self.graph_name, script, params, result_factory),
+                lambda: self.execute(script, params, isolate=isolate, transaction=transaction, pretty=pretty,
+                                     result_factory=result_factory, timeout=timeout, idempotent=idempotent,
+                                     read_only=read_only, retry_policy=retry_policy)
+            )
+
+        retry_policy = retry_policy or self.retry_policy
+        if retry_policy is None or self._in_transaction:
+            return self.execute_pipelined(
+                script,
+                params=params,
+                isolate=isolate,
+                transaction=transaction,
+                pretty=pretty,
+                result_factory=result_factory,
+                timeout=timeout
+            ).result()
+
+        deadline = utils.deadline(self.request_timeout if timeout is None else timeout)
+
+        def attempt():
+            self._restore(deadline=deadline)
+            return self.execute_pipelined(
+                script,
                 params=params,
-                session_key=self._session_key,
                 isolate=isolate,
-                in_transaction=transaction
+                transaction=transaction,
+                pretty=pretty,
+                result_factory=result_factory,
+                timeout=utils.time_left(deadline)
+            ).result()
+
+        return retry_policy.call(attempt, idempotent=idempotent or read_only, deadline=deadline)
+
+    def _restore(self, deadline=None):
+        """
+        Makes the connection usable again before a request is retried,
+        reconnecting if it failed, or opening a new session if rexster
+        dropped its session. Stored procedures that were defined on the old
+        session are defined on the new one.
+
+        :param deadline: the time the connection has to be usable by
+        :type deadline: float
+        """
+        defined = self.procedures is not None and self._procedures_version is not None
+        if self._error is not None:
+            self._reconnect(deadline=deadline)
+        elif self._session_key is None:
+            self._open_session(deadline=deadline)
+        else:
+            return
+        if defined:
+            self._define_procedures(timeout=utils.time_left(deadline))
+
+    def execute_many(self, scripts, isolate=True, transaction=True, chunk_size=50, timeout=None):
+        """
+        executes several independent gremlin scripts, combining them into
+        one request per chunk_size scripts instead of one request each
+
+        each script's parameters are namespaced so they don't collide with
+        the parameters of the other scripts in its chunk. If a chunk fails as
+        a whole because a script in it doesn't compile, the scripts in it are
+        run one at a time so the error is reported for the right one. Other
+        errors, like results that can't be serialized, can happen after the
+        scripts have run, so they're reported for every script in the chunk
+        instead.
+
+        :param scripts: list of (script, params) tuples, or scripts without parameters
+        :type scripts: list
+        :param isolate: wraps the scripts in a closure so any variables set aren't persisted for the next execute call
+        :type isolate: bool
+        :param transaction: scripts will be wrapped in a transaction if set to True (default)
+        :type transaction: bool
+        :param chunk_size: the maximum number of scripts to send in a single request
+        :type chunk_size: int
+        :param timeout: the number of seconds all of the scripts can take, including any run again one at a time,
+            defaults to the connection's request_timeout
+        :type timeout: float
+
+        :returns: list with the result of each script, or a RexProScriptException for scripts that failed
+        """
+        scripts = [(s, {}) if isinstance(s, basestring) else (s[0], s[1] or {}) for s in scripts]
+        chunks = [scripts[i:i + chunk_size] for i in range(0, len(scripts), chunk_size)]
+        deadline = utils.deadline(self.request_timeout if timeout is None else timeout)
+
+        pending = []
+        for chunk in chunks:
+            script, params = groovy.batch_script(chunk)
+            pending.append(self.execute_pipelined(script, params, isolate=isolate, transaction=transaction,
+                                                  timeout=utils.time_left(deadline)))
+
+        results = []
+        for chunk, chunk_result in zip(chunks, pending):
+            try:
+                chunk_results = chunk_result.result()
+            except exceptions.RexProScriptException as ex:
+                #errors in a script that runs are caught by the batch script, so a script failure for the
+                #whole chunk means it didn't compile, and none of it ran
+                if ex.flag != messages.ErrorResponse.SCRIPT_FAILURE_ERROR:
+                    results.extend([ex] * len(chunk))
+                    continue
+                for script, params in chunk:
+                    try:
+                        results.append(self.execute(script, params, isolate=isolate, transaction=transaction,
+                                                    timeout=utils.time_left(deadline)))
+                    except exceptions.RexProScriptException as ex:
+                        results.append(ex)
+                continue
+
+            for succeeded, value in chunk_results:
+                results.append(value if succeeded else exceptions.RexProScriptException(value))
+
+        return results
+
+    def _define_procedures(self, timeout=None):
+        """ defines the stored procedures on the current session """
+        version, script = self.procedures.definition_script()
+        self.execute(script, isolate=False, transaction=False, timeout=timeout)
+        self._procedures_version = self.procedures, version
+
+    def call_procedure(self, name, params=None, transaction=True, timeout=None):
+        """
+        calls a stored procedure, the procedures are defined on the session
+        first if this is the first call since the session was opened or the
+        procedures were changed
+
+        :param name: the name of the procedure to call
+        :type name: str
+        :param params: the procedure's parameters, by name
+        :type params: dictionary
+        :param transaction: query will be wrapped in a transaction if set to True (default)
+        :type transaction: bool
+        :param timeout: the number of seconds the call can take, including defining the procedures,
+            defaults to the connection's request_timeout
+        :type timeout: float
+
+        :rtype: list
+        """
+        if self.procedures is None:
+            raise exceptions.RexProScriptException('no stored procedures have been set for this connection')
+
+        deadline = utils.deadline(self.request_timeout if timeout is None else timeout)
+        if self._procedures_version != (self.procedures, self.procedures.version):
+            self._define_procedures(timeout=utils.time_left(deadline))
+
+        script, params = self.procedures.call_request(name, params or {})
+        return self.execute(script, params, transaction=transaction, timeout=utils.time_left(deadline))
+
+    def execute_iter(self, script, params={}, isolate=True, transaction=True, pretty=False, skip_bindings=True,
+                     result_factory=None, timeout=None):
+        """
+        executes the given gremlin script with the provided parameters, returning
+        an iterator that decodes the results as they're read from rexster
+
+        the results have to be consumed, or the iterator closed, before this
+        connection is used again. If reading them times out, the connection
+        can't be used again.
+
+        :param script: the gremlin script to isolate, or a prepared script, whose own isolate and transaction options are used
+        :type script: string/PreparedScript
+        :param params: the parameters to execute the script with
+        :type params: dictionary
+        :param isolate: wraps the script in a closure so any variables set aren't persisted for the next execute call
+        :type isolate: bool
+        :param transaction: query will be wrapped in a transaction if set to True (default)
+        :type transaction: bool
+        :param pretty: will dedent the script if set to True
+        :type pretty: bool
+        :param skip_bindings: discard the response bindings without decoding them
+        :type skip_bindings: bool
+        :param result_factory: decodes the results, defaults to the connection's result_factory
+        :type result_factory: ResultFactory
+        :param timeout: the number of seconds until the results start arriving, defaults to the connection's
+            request_timeout, the results are then read with the read timeout
+        :type timeout: float
+
+        :rtype: iterator
+        """
+        self._check_usable()
+        deadline = utils.deadline(self.request_timeout if timeout is None else timeout)
+        self.flush()
+        try:
+            self._conn.send_message(self._script_request(script, params, isolate, transaction))
+            response = self._conn.get_response(
+                stream=True,
+                skip_bindings=skip_bindings,
+                result_factory=result_factory or self.result_factory,
+                deadline=deadline
             )
-        )
-        response = self._conn.get_response()
+        except CONNECTION_ERRORS as ex:
+            self._abandon(ex)
+            raise
 
         if isinstance(response, messages.ErrorResponse):
-            raise exceptions.RexProScriptException(response.message)
+            raise exceptions.RexProScriptException(response.message, meta=response.meta)
 
         return response.results
+
+
+class ThreadSafeRexProConnection(RexProConnection):
+    """
+    RexProConnection that can be shared between threads
+
+    Writes are serialized with a lock, and a reader thread reads every
+    response and resolves the ResponseFuture of the request it answers, so
+    any number of threads can have requests in flight on the same session.
+    Variables and transactions belong to the session, so they're shared by
+    every thread using the connection.
+
+    The reader thread waits for responses without a timeout, so read_timeout
+    only applies while connecting. A request that times out doesn't stop the
+    connection being used, its response is dropped when it arrives.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """
+        takes the same arguments as RexProConnection
+        """
+        #held while a request is built and sent, so frames aren't interleaved
+        self._write_lock = RLock()
+
+        #guards the pending requests, which the reader thread removes as their responses arrive
+        self._pending_lock = Lock()
+
+        self._reader = None
+        self._closed = False
+
+        #the exception that stopped the reader thread
+        self._error = None
+
+        super(ThreadSafeRexProConnection, self).__init__(*args, **kwargs)
+        self._conn.set_read_timeout(None)
+
+        #limits the number of requests waiting on a response, released as responses arrive
+        self._in_flight = BoundedSemaphore(self.max_in_flight)
+
+        self._reader = Thread(target=self._read_loop, name='rexpro-reader')
+        self._reader.daemon = True
+        self._reader.start()
+
+    def _read_loop(self):
+        """ reads responses until the connection is closed or fails """
+        try:
+            while True:
+                self._read_response()
+        except Exception as ex:
+            if self._closed:
+                ex = exceptions.RexProConnectionException('connection has been closed')
+            self._fail_pending(ex)
+
+    def _fail_pending(self, exception):
+        """ fails every pending request, and any made after them """
+        with self._pending_lock:
+            self._error = exception
+            pending, self._pending = self._pending.values(), OrderedDict()
+        for future in pending:
+            self._in_flight.release()
+            event = future._take_event()
+            if event is not None:
+                self._fail_event(event, exception)
+            future._set_exception(exception)
+
+    def _add_pending(self, request_id):
+        if self._reader is None:
+            #the session is opened before the reader is started
+            return super(ThreadSafeRexProConnection, self)._add_pending(request_id)
+
+        self._in_flight.acquire()
+        future = ResponseFuture(self, request_id)
+        with self._pending_lock:
+            if self._error is None:
+                self._pending[request_id] = future
+                return future
+        self._in_flight.release()
+        self._check_usable()
+
+    def _result_factory_for(self, body):
+        if not self._uses_factories:
+            return None
+        with self._pending_lock:
+            return super(ThreadSafeRexProConnection, self)._result_factory_for(body)
+
+    def _pop_pending(self, request_id):
+        with self._pending_lock:
+            pending = super(ThreadSafeRexProConnection, self)._pop_pending(request_id)
+        if self._reader is not None:
+            self._in_flight.release()
+        return pending
+
+    def _discard_pending(self, request_id):
+        with self._pending_lock:
+            pending = self._pending.pop(request_id, None)
+        if pending is not None:
+            self._in_flight.release()
+
+    def _send_failed(self, exception):
+        """
+        the socket may have been left with part of a message written to it,
+        so it can't be used anymore
+        """
+        self._error = self._error or exception
+        try:
+            #wakes the reader thread up, closing the socket alone doesn't
+            self._conn.shutdown(SHUT_RDWR)
+        except socket_error:
+            pass
+        self._conn.close()
+
+    def _restore(self, deadline=None):
+        #so only one thread replaces the session
+        with self._write_lock:
+            super(ThreadSafeRexProConnection, self)._restore(deadline=deadline)
+
+    def _reconnect(self, deadline=None):
+        """
+        Replaces a connection that failed with a new socket, session and
+        reader thread, once the old reader thread has stopped
+        """
+        with self._write_lock:
+            if self._error is None:
+                #another thread reconnected first
+                return
+            if self._closed:
+                self._check_usable()
+
+            self._send_failed(self._error)
+            if self._reader is not None and self._reader is not current_thread():
+                self._reader.join()
+            self._reader = None
+
+            super(ThreadSafeRexProConnection, self)._reconnect(deadline=deadline)
+            self._conn.set_read_timeout(None)
+
+            self._in_flight = BoundedSemaphore(self.max_in_flight)
+            self._reader = Thread(target=self._read_loop, name='rexpro-reader')
+            self._reader.daemon = True
+            self._reader.start()
+
+    def _abandon(self, exception):
+        if self._reader is None:
+            super(ThreadSafeRexProConnection, self)._abandon(exception)
+        else:
+            self._send_failed(exception)
+
+    def _request(self, message, deadline=None):
+        if self._reader is None:
+            return super(ThreadSafeRexProConnection, self)._request(message, deadline=deadline)
+
+        if message.request_id is None:
+            message.request_id = utils.random_uuid_bytes()
+        with self._write_lock:
+            self._check_usable()
+            future = self._add_pending(message.request_id)
+            try:
+                self._conn.send_message(message)
+            except socket_error as ex:
+                self._discard_pending(message.request_id)
+                self._send_failed(ex)
+                raise exceptions.RexProConnectionException('failed to send a request: {}'.format(ex))
+            except:
+                self._discard_pending(message.request_id)
+                raise
+        future.deadline = deadline
+        return future.response()
+
+    def _send_script(self, script, params, isolate, transaction, result_factory=None, deadline=None):
+        try:
+            return super(ThreadSafeRexProConnection, self)._send_script(
+                script, params, isolate, transaction, result_factory=result_factory, deadline=deadline
+            )
+        except socket_error as ex:
+            self._send_failed(ex)
+            raise exceptions.RexProConnectionException('failed to send a request: {}'.format(ex))
+
+    def execute_pipelined(self, script, params={}, isolate=True, transaction=True, pretty=False, result_factory=None,
+                          timeout=None):
+        """
+        sends the given gremlin script without waiting for the response, waits
+        if max_in_flight requests are already waiting on a response
+
+        takes the same arguments as RexProConnection.execute_pipelined
+
+        :rtype: ResponseFuture
+        """
+        deadline = utils.deadline(self.request_timeout if timeout is None else timeout)
+        with self._write_lock:
+            self._check_usable()
+            if self._session_key is None:
+                #rexster dropped the session, every thread is affected so open a new one
+                self._open_session(deadline=deadline)
+            return self._send_script(script, params, isolate, transaction, result_factory=result_factory,
+                                     deadline=deadline)
+
+    def execute_async(self, script, params={}, isolate=True, transaction=True, pretty=False, result_factory=None,
+                      timeout=None):
+        """
+        sends the given gremlin script, returning a future for its results
+
+        :param script: the gremlin script to isolate, or a prepared script, whose own isolate and transaction options are used
+        :type script: string/PreparedScript
+        :param params: the parameters to execute the script with
+        :type params: dictionary
+        :param isolate: wraps the script in a closure so any variables set aren't persisted for the next execute call
+        :type isolate: bool
+        :param transaction: query will be wrapped in a transaction if set to True (default)
+        :type transaction: bool
+        :param pretty: will dedent the script if set to True
+        :type pretty: bool
+        :param result_factory: decodes the results, defaults to the connection's result_factory
+        :type result_factory: ResultFactory
+        :param timeout: the number of seconds until the response has to have arrived, defaults to the connection's request_timeout
+        :type timeout: float
+
+        :rtype: ResponseFuture
+        """
+        return self.execute_pipelined(script, params, isolate=isolate, transaction=transaction, pretty=pretty,
+                                      result_factory=result_factory, timeout=timeout)
+
+    def flush(self):
+        """ waits for the responses of all of the requests sent so far """
+        with self._pending_lock:
+            pending = list(self._pending.values())
+        for future in pending:
+            if isinstance(future, ResponseFuture):
+                future._done.wait()
+
+    def execute_iter(self, script, params={}, isolate=True, transaction=True, pretty=False, skip_bindings=True,
+                     result_factory=None, timeout=None):
+        """
+        executes the given gremlin script and returns an iterator over its results
+
+        responses are read by the reader thread, so the results aren't streamed
+        """
+        return iter(self.execute(script, params, isolate=isolate, transaction=transaction, pretty=pretty,
+                                 result_factory=result_factory, timeout=timeout))
+
+    def close(self):
+        """
+        closes the session, and stops the reader thread
+        """
+        try:
+            if self._error is None:
+                super(ThreadSafeRexProConnection, self).close()
+        finally:
+            self._closed = True
+            try:
+                self._conn.shutdown(SHUT_RDWR)
+            except socket_error:
+                pass
+            self._conn.close()
+            if self._reader is not None and self._reader is not current_thread():
+                self._reader.join()
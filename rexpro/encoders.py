@@ -0,0 +1,127 @@
+"""
+Encoding of script parameters
+
+Types msgpack can't serialize are converted by encoders registered by type.
+Encoders are looked up through the type's mro and the result is cached per
+type, and they're only called by msgpack as it reaches a value it can't
+pack itself, so parameters don't have to be walked or converted up front.
+"""
+__author__ = 'bdeggleston'
+
+from datetime import date, datetime, time
+from decimal import Decimal
+import threading
+import types
+from uuid import UUID
+
+import msgpack
+
+from rexpro import exceptions
+
+#types msgpack serializes without an encoder
+NATIVE_TYPES = (type(None), bool, int, long, float, str, unicode, dict, list, tuple)
+
+class ParamEncoderRegistry(object):
+    """
+    Registry of functions that convert parameter values msgpack can't
+    serialize into ones it can
+    """
+
+    def __init__(self):
+        self._encoders = {}
+        self._lock = threading.Lock()
+
+        #type -> encoder (or None if there isn't one), filled in as types are seen
+        self._dispatch = {}
+
+        #packers call back into python for unknown types, so they can't be shared between threads
+        self._local = threading.local()
+
+    def register(self, type_, encoder):
+        """
+        Registers an encoder for a type and its subclasses
+
+        :param type_: the type to encode
+        :type type_: type
+        :param encoder: callable that takes a value and returns something msgpack can serialize
+        :type encoder: callable
+        """
+        with self._lock:
+            self._encoders[type_] = encoder
+            self._dispatch = {}
+
+    def encoder_for(self, type_):
+        """
+        Returns the encoder for a type, or None if it doesn't have one
+
+        :param type_: the type of the value to encode
+        :type type_: type
+
+        :rtype: callable
+        """
+        try:
+            return self._dispatch[type_]
+        except KeyError:
+            pass
+
+        encoder = None
+        for klass in getattr(type_, '__mro__', (type_,)):
+            if klass in self._encoders:
+                encoder = self._encoders[klass]
+                break
+        self._dispatch[type_] = encoder
+        return encoder
+
+    def is_supported(self, type_):
+        """
+        Returns True if values of the given type can be encoded
+
+        :param type_: the type of the value to encode
+        :type type_: type
+
+        :rtype: bool
+        """
+        return issubclass(type_, NATIVE_TYPES) or self.encoder_for(type_) is not None
+
+    def default(self, value):
+        """
+        Encodes a value msgpack can't serialize, used as the packer's default hook
+        """
+        encoder = self.encoder_for(type(value))
+        if encoder is None:
+            raise exceptions.RexProScriptException("{} is an unsupported type".format(type(value)))
+        return encoder(value)
+
+    def pack(self, value):
+        """
+        Serializes a value with msgpack, encoding unsupported types with the registered encoders
+
+        :rtype: str
+        """
+        packer = getattr(self._local, 'packer', None)
+        if packer is None:
+            packer = self._local.packer = msgpack.Packer(default=self.default)
+        try:
+            return packer.pack(value)
+        except:
+            #the packer keeps whatever it packed before the error in its buffer
+            self._local.packer = None
+            raise
+
+
+def _encode_iterable(value):
+    return list(value)
+
+#registry used by script requests
+default_registry = ParamEncoderRegistry()
+default_registry.register(datetime, datetime.isoformat)
+default_registry.register(date, date.isoformat)
+default_registry.register(time, time.isoformat)
+default_registry.register(UUID, str)
+default_registry.register(Decimal, float)
+default_registry.register(set, _encode_iterable)
+default_registry.register(frozenset, _encode_iterable)
+default_registry.register(types.GeneratorType, _encode_iterable)
+default_registry.register(xrange, _encode_iterable)
+
+register = default_registry.register
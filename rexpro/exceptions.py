@@ -8,7 +8,26 @@ class RexProConnectionException(RexProException):
     """ Raised when there are problems with the rexster connection """
     pass
 
+class RexProTimeoutException(RexProConnectionException):
+    """ Raised when waiting on rexster, or on a free connection, takes too long """
+    pass
+
 class RexProScriptException(RexProException):
     """
     Raised when there's an error with a script request
     """
+
+    def __init__(self, message, meta=None):
+        """
+        :param message: the error message
+        :type message: str
+        :param meta: the meta of the error response from rexster, if there was one
+        :type meta: dict
+        """
+        super(RexProScriptException, self).__init__(message)
+        self.meta = meta or {}
+
+    @property
+    def flag(self):
+        """ the ErrorResponse error flag, if rexster sent one """
+        return self.meta.get('flag')
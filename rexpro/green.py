@@ -0,0 +1,240 @@
+"""
+Cooperative RexPro client for gevent
+
+The green classes speak the same protocol as the ones in rexpro.connection,
+but do their socket io through gevent, so a single process can keep
+thousands of graph queries in flight from greenlets instead of threads.
+Requires gevent.
+"""
+__author__ = 'bdeggleston'
+
+from contextlib import contextmanager
+import time
+
+from gevent import socket as gsocket
+from gevent.queue import LifoQueue, Empty
+
+from rexpro import exceptions, utils
+from rexpro.connection import RexProSocketMixin, RexProConnection
+
+
+class GreenRexProSocket(RexProSocketMixin, gsocket.socket):
+    """ gevent socket that sends and receives rexpro messages """
+
+
+class GreenRexProConnection(RexProConnection):
+    """ RexProConnection that yields to other greenlets while waiting on rexster """
+
+    socket_class = GreenRexProSocket
+
+
+class GreenRexProConnectionPool(object):
+
+    def __init__(self, host, port, graph_name, size=10, graph_obj_name='g', username='', password='', timeout=None,
+                 procedures=None, normalizer=None, listeners=None, cache=None, result_factory=None, connect_timeout=None,
+                 read_timeout=None, request_timeout=None, retry_policy=None):
+        """
+        Pool of green rexpro sessions, connections are opened as they're needed, up to size
+
+        :param host: the rexpro server to connect to
+        :type host: str (ip address)
+        :param port: the rexpro server port to connect to
+        :type port: int
+        :param graph_name: the graph to connect to
+        :type graph_name: str
+        :param size: the maximum number of connections
+        :type size: int
+        :param username: the username to use for authentication (optional)
+        :type username: str
+        :param password: the password to use for authentication (optional)
+        :type password: str
+        :param timeout: the default number of seconds to wait for a free connection, None waits forever
+        :type timeout: float
+        :param procedures: stored procedures to define on the pooled sessions
+        :type procedures: StoredProcedures
+        :param normalizer: hoists literals out of scripts into params, shared by the pooled connections
+        :type normalizer: ScriptNormalizer
+        :param listeners: RequestListeners told about the requests of every pooled connection
+        :type listeners: list
+        :param cache: result cache shared by the pooled connections
+        :type cache: ResultCache
+        :param result_factory: decodes the script results of the pooled connections
+        :type result_factory: ResultFactory
+        :param connect_timeout: the number of seconds opening a connection can take, defaults to read_timeout
+        :type connect_timeout: float
+        :param read_timeout: the number of seconds a single read or write on a connection can wait, None waits forever
+        :type read_timeout: float
+        :param request_timeout: the default number of seconds a script request on a pooled connection can take
+        :type request_timeout: float
+        :param retry_policy: retries failed executes on the pooled connections, which reconnect if they have to
+        :type retry_policy: RetryPolicy
+        """
+        self.host = host
+        self.port = port
+        self.graph_name = graph_name
+        self.graph_obj_name = graph_obj_name
+        self.username = username
+        self.password = password
+        self.size = size
+        self.timeout = timeout
+        self.procedures = procedures
+        self.normalizer = normalizer
+        self.listeners = list(listeners or [])
+        self.cache = cache
+        self.result_factory = result_factory
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.request_timeout = request_timeout
+        self.retry_policy = retry_policy
+
+        #idle connections, and None for each connection that was discarded, which
+        #wakes up a greenlet waiting for a connection so it can open a new one
+        self.pool = LifoQueue()
+
+        #number of connections that are open, in or out of the pool
+        self._num_connections = 0
+
+    def _new_conn(self):
+        """
+        Creates and returns a new connection
+        """
+        return GreenRexProConnection(
+            self.host,
+            self.port,
+            self.graph_name,
+            graph_obj_name=self.graph_obj_name,
+            username=self.username,
+            password=self.password,
+            procedures=self.procedures,
+            normalizer=self.normalizer,
+            listeners=self.listeners,
+            cache=self.cache,
+            result_factory=self.result_factory,
+            connect_timeout=self.connect_timeout,
+            read_timeout=self.read_timeout,
+            request_timeout=self.request_timeout,
+            retry_policy=self.retry_policy
+        )
+
+    def get(self, timeout=None):
+        """
+        Returns a connection, opening a new one if none are free and the pool
+        isn't full, otherwise waiting for one to be returned
+
+        :param timeout: the number of seconds to wait for a free connection, defaults to the pool timeout
+        :type timeout: float
+        """
+        timeout = self.timeout if timeout is None else timeout
+        deadline = utils.deadline(timeout)
+
+        while True:
+            try:
+                conn = self.pool.get_nowait()
+            except Empty:
+                if self._num_connections < self.size:
+                    return self._create_conn()
+                try:
+                    conn = self.pool.get(timeout=None if deadline is None else max(deadline - time.time(), 0))
+                except Empty:
+                    raise exceptions.RexProTimeoutException('timed out waiting for a free connection')
+
+            if conn is not None:
+                return conn
+            #a connection was discarded, so there may be room to open a new one
+
+    def _create_conn(self):
+        #count the connection before connecting, other greenlets can run while we do
+        self._num_connections += 1
+        try:
+            return self._new_conn()
+        except:
+            self._num_connections -= 1
+            self.pool.put(None)
+            raise
+
+    def put(self, conn):
+        """
+        returns a connection to the pool, rolling back any transaction left open on it
+
+        connections that failed, or whose session rexster has killed, are discarded
+        """
+        if conn._error is not None or conn._session_key is None:
+            self.discard(conn)
+            return
+        if conn._in_transaction:
+            try:
+                conn.close_transaction(success=False)
+            except exceptions.RexProException:
+                self.discard(conn)
+                return
+        self.pool.put(conn)
+
+    def discard(self, conn):
+        """
+        closes a connection that shouldn't be returned to the pool
+        """
+        self._num_connections -= 1
+        self.pool.put(None)
+        try:
+            conn._conn.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def contextual_connection(self, timeout=None):
+        """
+        context manager that will check out, yield, and return a connection
+
+        connections are discarded instead of returned if the block raises
+        anything other than a script error
+        """
+        conn = self.get(timeout=timeout)
+        try:
+            yield conn
+        except exceptions.RexProScriptException:
+            self.put(conn)
+            raise
+        except:
+            self.discard(conn)
+            raise
+        else:
+            self.put(conn)
+
+    def execute(self, script, params={}, timeout=None, **kwargs):
+        """
+        executes the given gremlin script on a pooled connection, takes
+        the same arguments as RexProConnection.execute
+
+        if rexster has killed the connection's session, a new session is
+        opened and the script is run again
+
+        :param timeout: the number of seconds waiting for a connection, the request, and running it again on a new
+            session can take altogether, defaults to the pool's request_timeout
+        :type timeout: float
+
+        :rtype: list
+        """
+        deadline = utils.deadline(self.request_timeout if timeout is None else timeout)
+        with self.contextual_connection(timeout=utils.time_left(deadline)) as conn:
+            try:
+                return conn.execute(script, params, timeout=utils.time_left(deadline), **kwargs)
+            except exceptions.RexProScriptException:
+                if conn._session_key is not None:
+                    raise
+
+            conn._open_session(deadline=deadline)
+            return conn.execute(script, params, timeout=utils.time_left(deadline), **kwargs)
+
+    def close_all(self):
+        """
+        closes the sessions of all of the connections in the pool
+        """
+        while True:
+            try:
+                conn = self.pool.get_nowait()
+            except Empty:
+                return
+            if conn is None:
+                continue
+            self._num_connections -= 1
+            conn.close()
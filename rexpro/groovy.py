@@ -0,0 +1,77 @@
+"""
+Helpers for generating the groovy scripts sent to rexster
+"""
+__author__ = 'bdeggleston'
+
+#converts pipelines and other iterators to lists, rexster only unrolls the top level result
+UNROLL = 'def _unroll = { v -> v instanceof Iterator ? v.toList() : v }'
+
+def closure_call(script, param_names, arg_names):
+    """
+    Wraps a script in a closure and calls it, binding the arguments to the
+    parameter names the script expects
+
+    :param script: the groovy script to wrap
+    :type script: str
+    :param param_names: the names the script uses for its parameters
+    :type param_names: list
+    :param arg_names: the names of the variables to call the closure with, in the same order
+    :type arg_names: list
+
+    :rtype: str
+    """
+    return '{{ {params} ->\n{script}\n}}.call({args})'.format(
+        params=', '.join(param_names),
+        script=script,
+        args=', '.join(arg_names)
+    )
+
+def batch_script(scripts):
+    """
+    Combines several scripts into a single script that runs each of them and
+    returns a list of [succeeded, result or error message] pairs, one per script
+
+    each script's parameters are renamed into their own namespace so they
+    don't collide, and the script sees them under their original names
+
+    :param scripts: list of (script, params) tuples
+    :type scripts: list
+
+    :returns: tuple of (script, params)
+    """
+    lines = [UNROLL, 'def _results = []']
+    batch_params = {}
+    for i, (script, params) in enumerate(scripts):
+        param_names = sorted(params)
+        arg_names = ['s{}_{}'.format(i, name) for name in param_names]
+        for name, arg_name in zip(param_names, arg_names):
+            batch_params[arg_name] = params[name]
+
+        lines.append(
+            'try {{ _results << [true, _unroll({call})] }} '
+            'catch (Throwable _e) {{ _results << [false, _e.toString()] }}'.format(
+                call=closure_call(script, param_names, arg_names)
+            )
+        )
+    lines.append('_results')
+    return '\n'.join(lines), batch_params
+
+def closure_definition(name, param_names, script):
+    """
+    Assigns a script wrapped in a closure to a session variable, the
+    script has to be executed without isolation for the variable to persist
+
+    :param name: the name of the variable to assign the closure to
+    :type name: str
+    :param script: the groovy script to wrap
+    :type script: str
+    :param param_names: the names the script uses for its parameters
+    :type param_names: list
+
+    :rtype: str
+    """
+    return '{name} = {{ {params} ->\n{script}\n}}'.format(
+        name=name,
+        params=', '.join(param_names),
+        script=script
+    )
@@ -3,13 +3,33 @@ __author__ = 'bdeggleston'
 import json
 import re
 import struct
-from uuid import uuid1, uuid4
 
 import msgpack
 
+from rexpro import encoders as encoders_module
 from rexpro import exceptions
 from rexpro import utils
 
+_INVALID_PARAM_NAME = re.compile(r'^[0-9]|[\s\.]')
+
+#parameter names that have already been validated
+_valid_param_names = set()
+
+def _validate_param_name(name):
+    """
+    Checks that a parameter name can be bound as a groovy variable, and
+    remembers it if it can
+    """
+    match = _INVALID_PARAM_NAME.search(name)
+    if match:
+        if match.start() == 0 and match.group().isdigit():
+            raise exceptions.RexProScriptException("parameter names can't begin with a number")
+        raise exceptions.RexProScriptException("parameter names can't contain whitespace or dots")
+
+    if len(_valid_param_names) > 10000:
+        _valid_param_names.clear()
+    _valid_param_names.add(name)
+
 class MessageTypes(object):
     """
     Enumeration of RexPro send message types
@@ -26,6 +46,16 @@ class RexProMessage(object):
 
     MESSAGE_TYPE = None
 
+    #protocol version, serializer type, 4 bytes of padding, message type, message length
+    HEADER = struct.Struct('!BB4xBI')
+
+    def __init__(self, request_id=None):
+        """
+        :param request_id: the unique id of the request, a random uuid is generated when the message is first serialized if not given
+        :type request_id: str (uuid bytes)
+        """
+        self.request_id = request_id
+
     def get_meta(self):
         """
         Returns a dictionary of message meta
@@ -37,53 +67,54 @@ class RexProMessage(object):
         """
         Creates and returns the list containing the data to be serialized into a message
         """
+        if self.request_id is None:
+            self.request_id = utils.random_uuid_bytes()
+
         return [
             #session
             self.session,
 
             #unique request id
-            uuid1().bytes,
+            self.request_id,
 
             #meta
             self.get_meta()
         ]
 
-    def serialize(self):
+    def get_payload(self):
         """
-        Serializes this message to send to rexster
+        Returns the msgpack serialized message body
+        """
+        return msgpack.dumps(self.get_message_list())
+
+    def serialize_parts(self):
+        """
+        Serializes this message into separate header and body strings, so
+        they can be written to the socket without being concatenated
 
         The format as far as I can tell is this:
 
+        1B: Protocol version
+        1B: Serializer type
+        4B: padding
         1B: Message type
         4B: message length
         nB: msgpack serialized message
 
         the actual message is just a list of values, all seem to start with version, session, and a unique request id
         the session and unique request id are uuid bytes, and the version and are each 1 byte unsigned integers
-        """
-        #msgpack list
-        msg = self.get_message_list()
-        bytes = msgpack.dumps(msg)
-
-        #add protocol version
-        message = bytearray([1])
-
-        #add serializer type
-        message += bytearray([0])
 
-        #add padding
-        message += bytearray([0, 0, 0, 0])
-
-        #add message type
-        message += bytearray([self.MESSAGE_TYPE])
-
-        #add message length
-        message += struct.pack('!I', len(bytes))
-
-        #add message
-        message += bytes
+        :returns: tuple of (header, body)
+        """
+        payload = self.get_payload()
+        return self.HEADER.pack(1, 0, self.MESSAGE_TYPE, len(payload)), payload
 
-        return message
+    def serialize(self):
+        """
+        Serializes this message to send to rexster
+        """
+        header, payload = self.serialize_parts()
+        return header + payload
 
     @classmethod
     def deserialize(cls, data):
@@ -98,6 +129,26 @@ class RexProMessage(object):
         #redefine in subclasses
         raise NotImplementedError
 
+    @staticmethod
+    def peek_request_id(data):
+        """
+        Reads the request id of a message without decoding the rest of it
+
+        :param data: the raw data, minus the type and size info, from rexster
+        :type data: str/buffer
+
+        :returns: the request id, None if the message doesn't have one
+        """
+        #the session and request id are the first two fields, and are uuid bytes or nil
+        head = bytearray(data[:64])
+        try:
+            num_fields, offset = utils.msgpack_array_header(head)
+            offset = utils.msgpack_skip(head, offset)
+            end = utils.msgpack_skip(head, offset)
+        except IndexError:
+            return msgpack.loads(data)[1]
+        return msgpack.loads(str(head[offset:end]))
+
     @staticmethod
     def interpret_response(response):
         """
@@ -106,6 +157,8 @@ class RexProMessage(object):
 
 class ErrorResponse(RexProMessage):
 
+    MESSAGE_TYPE = MessageTypes.ERROR
+
     #meta flags
     INVALID_MESSAGE_ERROR = 0
     INVALID_SESSION_ERROR = 1
@@ -115,16 +168,23 @@ class ErrorResponse(RexProMessage):
     CHANNEL_CONFIG_ERROR = 5
     RESULT_SERIALIZATION_ERROR = 6
 
-    def __init__(self, meta, message, **kwargs):
+    def __init__(self, meta, message, session_key=None, **kwargs):
         super(ErrorResponse, self).__init__(**kwargs)
         self.meta = meta
         self.message = message
+        self.session = session_key
 
     @classmethod
     def deserialize(cls, data):
         message = msgpack.loads(data)
         session, request, meta, msg = message
-        return cls(message=msg, meta=meta)
+        return cls(message=msg, meta=meta, session_key=session, request_id=request)
+
+    def get_meta(self):
+        return self.meta
+
+    def get_message_list(self):
+        return super(ErrorResponse, self).get_message_list() + [self.message]
 
 class SessionRequest(RexProMessage):
     """
@@ -174,9 +234,24 @@ class SessionRequest(RexProMessage):
             self.password
         ]
 
+    @classmethod
+    def deserialize(cls, data):
+        session, request, meta, username, password = msgpack.loads(data)
+        return cls(
+            graph_name=meta.get('graphName'),
+            graph_obj_name=meta.get('graphObjName'),
+            username=username,
+            password=password,
+            session_key=session,
+            kill_session=meta.get('killSession', False),
+            request_id=request
+        )
+
 
 class SessionResponse(RexProMessage):
 
+    MESSAGE_TYPE = MessageTypes.SESSION_RESPONSE
+
     def __init__(self, session_key, meta, languages, **kwargs):
         """
         """
@@ -185,6 +260,16 @@ class SessionResponse(RexProMessage):
         self.meta = meta
         self.languages = languages
 
+    @property
+    def session(self):
+        return self.session_key
+
+    def get_meta(self):
+        return self.meta
+
+    def get_message_list(self):
+        return super(SessionResponse, self).get_message_list() + [self.languages]
+
     @classmethod
     def deserialize(cls, data):
         message = msgpack.loads(data)
@@ -192,7 +277,8 @@ class SessionResponse(RexProMessage):
         return cls(
             session_key=session,
             meta=meta,
-            languages=languages
+            languages=languages,
+            request_id=request
         )
 
 class ScriptRequest(RexProMessage):
@@ -208,7 +294,7 @@ class ScriptRequest(RexProMessage):
     MESSAGE_TYPE = MessageTypes.SCRIPT_REQUEST
 
     def __init__(self, script, params=None, session_key=None, graph_name=None, graph_obj_name=None, in_session=True,
-                 isolate=True, in_transaction=True, language=Language.GROOVY, **kwargs):
+                 isolate=True, in_transaction=True, language=Language.GROOVY, encoders=None, **kwargs):
         """
         :param script: script to execute
         :type script: str/unicode
@@ -228,6 +314,8 @@ class ScriptRequest(RexProMessage):
         :type in_transaction:bool
         :param language: the language used by the script (only groovy has been tested)
         :type language: ScriptRequest.Language
+        :param encoders: the encoders for parameter types msgpack doesn't support, defaults to encoders.default_registry
+        :type encoders: ParamEncoderRegistry
         """
         super(ScriptRequest, self).__init__(**kwargs)
         self.script = script
@@ -239,6 +327,7 @@ class ScriptRequest(RexProMessage):
         self.isolate = isolate
         self.in_transaction = in_transaction
         self.language = language
+        self.encoders = encoders or encoders_module.default_registry
 
     def get_meta(self):
         meta = {}
@@ -266,26 +355,15 @@ class ScriptRequest(RexProMessage):
         """
         Checks that the parameters are ok
         (no invalid types, no weird key names)
-        """
-        for k,v in self.params.items():
 
-            if re.findall(r'^[0-9]', k):
-                raise exceptions.RexProScriptException(
-                    "parameter names can't begin with a number")
-            if re.findall(r'[\s\.]', k):
-                raise exceptions.RexProException(
-                    "parameter names can't contain {}".format(
-                        re.findall(r'^[0-9]', k)[0]
-                    )
-                )
+        only the top level values are checked here, nested values
+        are checked by the encoders as they're serialized
+        """
+        for k, v in self.params.items():
+            if k not in _valid_param_names:
+                _validate_param_name(k)
 
-            if not isinstance(v, (int,
-                                  long,
-                                  float,
-                                  basestring,
-                                  dict,
-                                  list,
-                                  tuple)):
+            if not self.encoders.is_supported(type(v)):
                 raise exceptions.RexProScriptException(
                     "{} is an unsupported type".format(type(v))
                 )
@@ -297,13 +375,17 @@ class ScriptRequest(RexProMessage):
         data = bytearray()
         for k, v in self.params.items():
             key = k.encode('utf-8')
-            val = json.dumps(v).encode('utf-8')
+            val = json.dumps(v, default=self.encoders.default).encode('utf-8')
             data += utils.int_to_32bit_array(len(key))
             data += key
             data += utils.int_to_32bit_array(len(val))
             data += val
         return str(data)
 
+    def get_payload(self):
+        self._validate_params()
+        return self.encoders.pack(self.get_message_list())
+
     def get_message_list(self):
         return super(ScriptRequest, self).get_message_list() + [
             self.language,
@@ -311,20 +393,304 @@ class ScriptRequest(RexProMessage):
             self.params
         ]
 
+    @classmethod
+    def deserialize(cls, data):
+        session, request, meta, language, script, params = msgpack.loads(data)
+        return cls(
+            script=script.decode('utf-8'),
+            params=params,
+            session_key=session,
+            graph_name=meta.get('graphName'),
+            graph_obj_name=meta.get('graphObjName'),
+            in_session=meta.get('inSession', False),
+            isolate=meta.get('isolate', True),
+            in_transaction=meta.get('transaction', True),
+            language=language,
+            request_id=request
+        )
+
+
+class PreparedScript(object):
+    """
+    A script request template. The script, language and meta are msgpack
+    encoded once, so requests made from it only need to encode the session
+    key, request id and params.
+    """
+
+    def __init__(self, script, graph_name=None, graph_obj_name=None, in_session=True, isolate=True,
+                 in_transaction=True, language=ScriptRequest.Language.GROOVY, encoders=None):
+        """
+        :param script: script to execute
+        :type script: str/unicode
+        :param graph_name: the name of the rexster graph to connect to
+        :type graph_name: str
+        :param graph_obj_name: the name of the variable to bind the graph object to (defaults to 'g')
+        :type graph_obj_name: str
+        :param in_session: indicates requests should be executed in the context of their session
+        :type in_session:bool
+        :param isolate: indicates variables defined in requests should not be available to subsequent messages
+        :type isolate:bool
+        :param in_transaction: indicates requests should be wrapped in a transaction
+        :type in_transaction:bool
+        :param language: the language used by the script (only groovy has been tested)
+        :type language: ScriptRequest.Language
+        :param encoders: the encoders for parameter types msgpack doesn't support, defaults to encoders.default_registry
+        :type encoders: ParamEncoderRegistry
+        """
+        self.script = script
+        self.graph_name = graph_name
+        self.graph_obj_name = graph_obj_name
+        self.in_session = in_session
+        self.isolate = isolate
+        self.in_transaction = in_transaction
+        self.language = language
+        self.encoders = encoders or encoders_module.default_registry
+
+        template = self.request()
+        meta, language, script = template.get_message_list()[2:5]
+        self.encoded = msgpack.dumps(meta) + msgpack.dumps(language) + msgpack.dumps(script)
+
+    def request(self, params=None, session_key=None):
+        """
+        Creates a request to execute this script
+
+        :param params: parameter values to bind to request
+        :type params: dict (json serializable)
+        :param session_key: the session key to execute the script with
+        :type session_key: str
+
+        :rtype: PreparedScriptRequest
+        """
+        return PreparedScriptRequest(self, params=params, session_key=session_key)
+
+
+class PreparedScriptRequest(ScriptRequest):
+    """
+    ScriptRequest made from a PreparedScript, reusing its encoded script and meta
+    """
+
+    #msgpack header of the 6 item message list
+    LIST_HEADER = msgpack.dumps([None] * 6)[:1]
+
+    def __init__(self, prepared, params=None, session_key=None, request_id=None):
+        """
+        :param prepared: the prepared script to execute
+        :type prepared: PreparedScript
+        :param params: parameter values to bind to request
+        :type params: dict (json serializable)
+        :param session_key: the session key to execute the script with
+        :type session_key: str
+        :param request_id: the unique id of the request
+        :type request_id: str (uuid bytes)
+        """
+        #the rest of the request's attributes are read through from the prepared script,
+        #so creating one stays as cheap as possible
+        self.prepared = prepared
+        self.encoders = prepared.encoders
+        self.params = params or {}
+        self.session = session_key
+        self.request_id = request_id
+
+    def __getattr__(self, name):
+        return getattr(self.prepared, name)
+
+    def get_payload(self):
+        if self.request_id is None:
+            self.request_id = utils.random_uuid_bytes()
+
+        self._validate_params()
+        pack = self.encoders.pack
+        return ''.join([
+            self.LIST_HEADER,
+            pack(self.session),
+            pack(self.request_id),
+            self.prepared.encoded,
+            pack(self.params)
+        ])
+
 
 class MsgPackScriptResponse(RexProMessage):
 
-    def __init__(self, results, bindings, **kwargs):
+    MESSAGE_TYPE = MessageTypes.SCRIPT_RESPONSE
+
+    def __init__(self, results, bindings, session_key=None, **kwargs):
         super(MsgPackScriptResponse, self).__init__(**kwargs)
         self.results = results
         self.bindings = bindings
+        self.session = session_key
 
     @classmethod
-    def deserialize(cls, data):
-        message = msgpack.loads(data)
+    def deserialize(cls, data, result_factory=None):
+        """
+        :param data: the msgpack message body
+        :type data: str/buffer
+        :param result_factory: decodes the message instead of msgpack.loads
+        :type result_factory: ResultFactory
+        """
+        if result_factory is None:
+            message = msgpack.loads(data)
+        else:
+            message = result_factory.loads(data)
         session, request, meta, results, bindings = message
 
         return cls(
             results=results,
-            bindings=bindings
+            bindings=bindings,
+            session_key=session,
+            request_id=request
+        )
+
+    def get_message_list(self):
+        return super(MsgPackScriptResponse, self).get_message_list() + [
+            self.results,
+            self.bindings
+        ]
+
+    @classmethod
+    def deserialize_stream(cls, read, msg_len, skip_bindings=True, chunk_size=64 * 1024, result_factory=None):
+        """
+        Constructs a message instance whose results are decoded incrementally
+        as they're read from rexster
+
+        results is a ScriptResultStream, the bindings (if they aren't skipped)
+        are available on it once the results have been exhausted
+
+        :param read: callable that reads up to n bytes from the stream
+        :type read: callable
+        :param msg_len: the length of the message body
+        :type msg_len: int
+        :param skip_bindings: if True the bindings map is discarded without being decoded
+        :type skip_bindings: bool
+        :param chunk_size: the maximum number of bytes to read at a time
+        :type chunk_size: int
+        :param result_factory: decodes the results instead of msgpack
+        :type result_factory: ResultFactory
+
+        :rtype: MsgPackScriptResponse
+        """
+        return cls(
+            results=ScriptResultStream(read, msg_len, skip_bindings=skip_bindings, chunk_size=chunk_size,
+                                       result_factory=result_factory),
+            bindings=None
         )
+
+
+class ScriptResultStream(object):
+    """
+    Iterator over the results of a script response, decoding them one
+    at a time as they're read from rexster. Scalar results are yielded
+    as a single item.
+
+    The rest of the message is consumed from the stream once the
+    iterator is exhausted or closed, so it has to be finished with
+    before the stream is read again.
+    """
+
+    def __init__(self, read, msg_len, skip_bindings=True, chunk_size=64 * 1024, result_factory=None):
+        """
+        :param read: callable that reads up to n bytes from the stream
+        :type read: callable
+        :param msg_len: the length of the message body
+        :type msg_len: int
+        :param skip_bindings: if True the bindings map is discarded without being decoded
+        :type skip_bindings: bool
+        :param chunk_size: the maximum number of bytes to read at a time
+        :type chunk_size: int
+        :param result_factory: decodes the results instead of msgpack
+        :type result_factory: ResultFactory
+        """
+        self._read = read
+        self._remaining = msg_len
+        self.skip_bindings = skip_bindings
+        self.chunk_size = chunk_size
+        self.result_factory = result_factory
+
+        self.bindings = None
+
+        self._unpacker = None
+        self._items_left = None
+        self._done = False
+
+    def _read_chunk(self):
+        if not self._remaining:
+            raise exceptions.RexProConnectionException('script response ended unexpectedly')
+        chunk = self._read(min(self.chunk_size, self._remaining))
+        if not chunk:
+            raise exceptions.RexProConnectionException('socket connection has been closed')
+        self._remaining -= len(chunk)
+        return chunk
+
+    def _start(self):
+        """
+        Finds the results by skipping over the session, request id and meta
+        """
+        data = bytearray()
+        while True:
+            try:
+                num_fields, offset = utils.msgpack_array_header(data)
+                for i in range(3):
+                    offset = utils.msgpack_skip(data, offset)
+                num_results, offset = utils.msgpack_array_header(data, offset)
+                break
+            except IndexError:
+                data += self._read_chunk()
+
+        if self.result_factory is None:
+            self._unpacker = msgpack.Unpacker()
+        else:
+            self._unpacker = self.result_factory.unpacker()
+        self._unpacker.feed(buffer(data, offset))
+        self._items_left = 1 if num_results is None else num_results
+
+    def _unpack(self):
+        while True:
+            try:
+                return self._unpacker.unpack()
+            except StopIteration:
+                self._unpacker.feed(self._read_chunk())
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self._done:
+            raise StopIteration
+        try:
+            if self._unpacker is None:
+                self._start()
+
+            if not self._items_left:
+                if not self.skip_bindings:
+                    self.bindings = self._unpack()
+                self.close()
+                raise StopIteration
+
+            self._items_left -= 1
+            return self._unpack()
+        except (StopIteration, exceptions.RexProConnectionException):
+            self._done = True
+            raise
+        except Exception:
+            try:
+                self.close()
+            except exceptions.RexProException:
+                pass
+            raise
+
+    __next__ = next
+
+    def close(self):
+        """
+        Consumes whatever is left of the message without decoding it
+        """
+        self._done = True
+        self._unpacker = None
+        while self._remaining:
+            self._read_chunk()
+
+    def __del__(self):
+        if not self._done:
+            try:
+                self.close()
+            except Exception:
+                pass
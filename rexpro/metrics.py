@@ -0,0 +1,279 @@
+"""
+Per request instrumentation
+
+Connections report a RequestEvent for every script request to their
+listeners, with the time spent in each phase of the request and the bytes
+sent and received. MetricsCollector is a listener that aggregates them
+into counters and histograms, and can export them in the prometheus text
+format.
+"""
+__author__ = 'bdeggleston'
+
+from bisect import bisect_left
+from threading import Lock
+
+#the phases of a request, in order
+PHASES = (
+    'build',        #creating the ScriptRequest
+    'serialize',    #msgpack encoding the request
+    'send',         #writing the request to the socket
+    'wait',         #waiting for the response header, mostly rexster's execution time
+    'read',         #reading the response body
+    'decode',       #msgpack decoding the response
+)
+
+#names of the ErrorResponse meta flags
+ERROR_FLAGS = {
+    0: 'INVALID_MESSAGE_ERROR',
+    1: 'INVALID_SESSION_ERROR',
+    2: 'SCRIPT_FAILURE_ERROR',
+    3: 'AUTH_FAILURE_ERROR',
+    4: 'GRAPH_CONFIG_ERROR',
+    5: 'CHANNEL_CONFIG_ERROR',
+    6: 'RESULT_SERIALIZATION_ERROR',
+}
+
+class RequestEvent(object):
+    """
+    The timings (in seconds) and sizes of a single request
+    """
+
+    __slots__ = ('timings', 'bytes_sent', 'bytes_received', 'message_type', 'error_type', 'started_at')
+
+    def __init__(self, started_at=None):
+        self.timings = {}
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+        #the class name of the response message
+        self.message_type = None
+
+        #the ErrorResponse flag name, or exception class name, of a failed request
+        self.error_type = None
+
+        self.started_at = started_at
+
+    @property
+    def total(self):
+        """ the total time of the request """
+        return self.timings.get('total', 0.0)
+
+
+class RequestListener(object):
+    """
+    Base class for objects that want to be told about every request a connection makes
+    """
+
+    def on_request(self, event):
+        """
+        Called when a request has finished
+
+        :param event: the request's timings and sizes
+        :type event: RequestEvent
+        """
+        raise NotImplementedError
+
+
+class Counter(object):
+    """ thread safe monotonically increasing count """
+
+    def __init__(self):
+        self.value = 0
+        self._lock = Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Histogram(object):
+    """
+    Fixed bucket histogram, with the count and sum of the observed values
+    """
+
+    #default bucket upper bounds, in seconds
+    DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        :param buckets: the upper bounds of the buckets, in increasing order
+        :type buckets: tuple
+        """
+        self.buckets = tuple(buckets)
+
+        #the last count is for values above the largest bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def percentile(self, percent):
+        """
+        Estimates a percentile of the observed values, as the upper bound of
+        the bucket it falls in
+
+        :param percent: the percentile to estimate, between 0 and 100
+        :type percent: float
+
+        :rtype: float
+        """
+        with self._lock:
+            counts = list(self.counts)
+            total = self.count
+        if not total:
+            return 0.0
+
+        rank = total * percent / 100.0
+        seen = 0
+        for index, count in enumerate(counts):
+            seen += count
+            if seen >= rank and count:
+                return self.buckets[index] if index < len(self.buckets) else float('inf')
+        return float('inf')
+
+
+class MetricsCollector(RequestListener):
+    """
+    Aggregates the requests of any number of connections into histograms
+    of the time spent in each phase, and counters of requests, errors and
+    bytes transferred
+    """
+
+    def __init__(self, buckets=Histogram.DEFAULT_BUCKETS):
+        """
+        :param buckets: the upper bounds of the timing histogram buckets, in seconds
+        :type buckets: tuple
+        """
+        self.phases = dict((phase, Histogram(buckets)) for phase in PHASES + ('total',))
+        self.requests = Counter()
+        self.bytes_sent = Counter()
+        self.bytes_received = Counter()
+
+        #error type -> Counter
+        self.errors = {}
+        self._lock = Lock()
+
+    def on_request(self, event):
+        self.requests.inc()
+        self.bytes_sent.inc(event.bytes_sent)
+        self.bytes_received.inc(event.bytes_received)
+        for phase, duration in event.timings.items():
+            histogram = self.phases.get(phase)
+            if histogram is not None:
+                histogram.observe(duration)
+
+        if event.error_type is not None:
+            with self._lock:
+                counter = self.errors.get(event.error_type)
+                if counter is None:
+                    counter = self.errors[event.error_type] = Counter()
+            counter.inc()
+
+    def get_stats(self):
+        """
+        Returns a summary of the collected metrics, times are in seconds
+
+        :rtype: dict
+        """
+        return {
+            'requests': self.requests.value,
+            'bytes_sent': self.bytes_sent.value,
+            'bytes_received': self.bytes_received.value,
+            'errors': dict((error_type, counter.value) for error_type, counter in self.errors.items()),
+            'phases': dict(
+                (phase, {
+                    'count': histogram.count,
+                    'sum': histogram.sum,
+                    'p50': histogram.percentile(50),
+                    'p99': histogram.percentile(99),
+                })
+                for phase, histogram in self.phases.items()
+            ),
+        }
+
+    def prometheus_text(self, prefix='rexpro', labels=None):
+        """
+        Exports the collected metrics in the prometheus text exposition format
+
+        :param prefix: the prefix of the metric names
+        :type prefix: str
+        :param labels: labels to add to every metric
+        :type labels: dict
+
+        :rtype: str
+        """
+        base_labels = sorted((labels or {}).items())
+
+        def format_labels(extra=()):
+            pairs = base_labels + list(extra)
+            if not pairs:
+                return ''
+            return '{' + ','.join('{}="{}"'.format(k, str(v).replace('"', '\\"')) for k, v in pairs) + '}'
+
+        lines = []
+
+        for name, counter, description in [
+            ('requests_total', self.requests, 'Script requests made'),
+            ('sent_bytes_total', self.bytes_sent, 'Bytes sent to rexster'),
+            ('received_bytes_total', self.bytes_received, 'Bytes received from rexster'),
+        ]:
+            lines.append('# HELP {}_{} {}'.format(prefix, name, description))
+            lines.append('# TYPE {}_{} counter'.format(prefix, name))
+            lines.append('{}_{}{} {}'.format(prefix, name, format_labels(), counter.value))
+
+        lines.append('# HELP {}_errors_total Failed script requests by error type'.format(prefix))
+        lines.append('# TYPE {}_errors_total counter'.format(prefix))
+        for error_type, counter in sorted(self.errors.items()):
+            lines.append('{}_errors_total{} {}'.format(prefix, format_labels([('type', error_type)]), counter.value))
+
+        name = '{}_request_phase_seconds'.format(prefix)
+        lines.append('# HELP {} Time spent in each phase of a script request'.format(name))
+        lines.append('# TYPE {} histogram'.format(name))
+        for phase in PHASES + ('total',):
+            histogram = self.phases[phase]
+            with histogram._lock:
+                counts = list(histogram.counts)
+                total, total_sum = histogram.count, histogram.sum
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append('{}_bucket{} {}'.format(name, format_labels([('phase', phase), ('le', le)]), cumulative))
+            lines.append('{}_sum{} {}'.format(name, format_labels([('phase', phase)]), repr(total_sum)))
+            lines.append('{}_count{} {}'.format(name, format_labels([('phase', phase)]), total))
+
+        return '\n'.join(lines) + '\n'
+
+
+def prometheus_gauges(prefix, stats, labels=None):
+    """
+    Formats the numeric values of a stats dictionary, like the one returned by
+    RexProConnectionPool.get_stats, as prometheus gauges
+
+    :param prefix: the prefix of the metric names
+    :type prefix: str
+    :param stats: the stats to export
+    :type stats: dict
+    :param labels: labels to add to every metric
+    :type labels: dict
+
+    :rtype: str
+    """
+    label_text = ''
+    if labels:
+        label_text = '{' + ','.join('{}="{}"'.format(k, v) for k, v in sorted(labels.items())) + '}'
+
+    lines = []
+    for key, value in sorted(stats.items()):
+        if isinstance(value, bool) or not isinstance(value, (int, long, float)):
+            continue
+        lines.append('# TYPE {}_{} gauge'.format(prefix, key))
+        lines.append('{}_{}{} {}'.format(prefix, key, label_text, repr(value) if isinstance(value, float) else value))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,250 @@
+"""
+Literal to parameter hoisting
+
+Scripts with ids and strings formatted into them are unique per call, so
+rexster compiles and caches every one of them. The normalizer rewrites
+string and integer literals into bound parameters, so every call from the
+same call site sends the same script.
+"""
+__author__ = 'bdeggleston'
+
+from hashlib import md5
+import re
+from threading import Lock
+
+_IDENTIFIER_CHARS = re.compile(r'[A-Za-z0-9_$]')
+_IDENTIFIER = re.compile(r'[A-Za-z0-9_$]+')
+
+_NUMBER = re.compile(r'(0[xXbB][0-9a-fA-F_]+|\d[\d_]*(\.\d+)?([eE][+-]?\d+)?)([A-Za-z]?)')
+
+_ESCAPES = {
+    'b': '\b', 't': '\t', 'n': '\n', 'f': '\f', 'r': '\r',
+    '"': '"', "'": "'", '\\': '\\', '$': '$',
+}
+
+#characters after which a / starts a slashy string rather than being a division
+_SLASHY_PRECEDERS = set('(=,:[!&|?{};~+-*%<>') | set([''])
+
+#keywords that can be followed by an expression, treated like the start of the script
+_EXPRESSION_KEYWORDS = set(['return', 'in', 'case', 'assert', 'else', 'throw'])
+
+class ScriptNormalizer(object):
+    """
+    Rewrites the string and integer literals in scripts into bound params,
+    and tracks how often each normalized script (its fingerprint) is reused
+
+    Literals that can't safely be replaced by a variable are left alone: map
+    keys, property names after a dot, GStrings, triple quoted and slashy
+    strings, decimals (which groovy reads as BigDecimal) and numbers with a
+    type suffix.
+    """
+
+    def __init__(self, prefix='hoisted_', max_fingerprints=10000):
+        """
+        :param prefix: the prefix of the generated parameter names
+        :type prefix: str
+        :param max_fingerprints: the maximum number of fingerprints to keep stats for
+        :type max_fingerprints: int
+        """
+        self.prefix = prefix
+        self.max_fingerprints = max_fingerprints
+
+        #fingerprint -> [normalized script, hits, misses]
+        self._stats = {}
+        self._untracked = 0
+        self._lock = Lock()
+
+    def _parse_string(self, script, start):
+        """
+        Parses the quoted string starting at start
+
+        :returns: tuple of (end offset, value), value is None if the string can't be hoisted
+        """
+        quote = script[start]
+        value = []
+        hoistable = True
+        i = start + 1
+        while i < len(script):
+            char = script[i]
+            if char == quote:
+                return i + 1, (script[:0].join(value) if hoistable else None)
+            if char == '\\':
+                escaped = script[i + 1:i + 2]
+                if escaped in _ESCAPES:
+                    value.append(_ESCAPES[escaped])
+                    i += 2
+                    continue
+                if escaped == 'u' and isinstance(script, unicode) and re.match(r'[0-9a-fA-F]{4}$', script[i + 2:i + 6]):
+                    value.append(unichr(int(script[i + 2:i + 6], 16)))
+                    i += 6
+                    continue
+                hoistable = False
+                i += 2
+                continue
+            if char == '$' and quote == '"':
+                #GString interpolation
+                hoistable = False
+            elif char == '\n':
+                hoistable = False
+            value.append(char)
+            i += 1
+        return len(script), None
+
+    def _followed_by_colon(self, script, end):
+        """ map keys, ternaries and case labels are followed by a colon """
+        rest = script[end:end + 64].lstrip(' \t')
+        return rest.startswith(':') and not rest.startswith('::')
+
+    def normalize(self, script, params=None):
+        """
+        Hoists the literals in a script into params
+
+        :param script: the gremlin script
+        :type script: str/unicode
+        :param params: the parameters the script is being executed with
+        :type params: dict
+
+        :returns: tuple of (script, params)
+        """
+        params = params or {}
+        if self.prefix in script or any(k.startswith(self.prefix) for k in params):
+            #the generated names could collide with the script's own
+            return script, params
+
+        hoisted = {}
+        output = []
+        last_significant = ''
+        copied_to = 0
+        i = 0
+        length = len(script)
+
+        def hoist(start, end, value):
+            name = '{}{}'.format(self.prefix, len(hoisted))
+            hoisted[name] = value
+            output.append(script[copied_to:start])
+            output.append(name)
+            return end
+
+        while i < length:
+            char = script[i]
+
+            if char in ' \t\r\n':
+                i += 1
+                continue
+
+            if script.startswith('//', i):
+                newline = script.find('\n', i)
+                i = length if newline == -1 else newline
+                continue
+
+            if script.startswith('/*', i):
+                close = script.find('*/', i + 2)
+                i = length if close == -1 else close + 2
+                continue
+
+            if script.startswith("'''", i) or script.startswith('"""', i):
+                close = script.find(script[i:i + 3], i + 3)
+                i = length if close == -1 else close + 3
+                last_significant = "'"
+                continue
+
+            if char in '\'"':
+                end, value = self._parse_string(script, i)
+                if value is not None and last_significant != '.' and not self._followed_by_colon(script, end):
+                    copied_to = hoist(i, end, value)
+                i = end
+                last_significant = "'"
+                continue
+
+            if char == '/' and last_significant in _SLASHY_PRECEDERS:
+                #slashy string, skip to the closing slash
+                j = i + 1
+                while j < length and script[j] != '/':
+                    j += 2 if script[j] == '\\' else 1
+                i = j + 1
+                last_significant = "'"
+                continue
+
+            if char.isdigit() and not _IDENTIFIER_CHARS.match(last_significant) and last_significant != '.':
+                match = _NUMBER.match(script, i)
+                end = match.end()
+                number, decimal, exponent, suffix = match.group(1), match.group(2), match.group(3), match.group(4)
+                is_plain_int = not (decimal or exponent or suffix or number[:2].lower() in ('0x', '0b') or '_' in number)
+                if is_plain_int and not (len(number) > 1 and number[0] == '0') and not self._followed_by_colon(script, end):
+                    copied_to = hoist(i, end, int(number))
+                i = end
+                last_significant = '0'
+                continue
+
+            if script.startswith('..', i):
+                #ranges, unlike property access
+                last_significant = '..'
+                i += 2
+                continue
+
+            if _IDENTIFIER_CHARS.match(char):
+                end = _IDENTIFIER.match(script, i).end()
+                last_significant = '' if script[i:end] in _EXPRESSION_KEYWORDS else 'a'
+                i = end
+                continue
+
+            last_significant = char
+            i += 1
+
+        if not hoisted:
+            normalized = script
+        else:
+            output.append(script[copied_to:])
+            normalized = ''.join(output)
+            hoisted.update(params)
+            params = hoisted
+
+        self._record(normalized)
+        return normalized, params
+
+    def _record(self, normalized):
+        fingerprint = md5(normalized.encode('utf-8') if isinstance(normalized, unicode) else normalized).hexdigest()
+        with self._lock:
+            stats = self._stats.get(fingerprint)
+            if stats is not None:
+                stats[1] += 1
+            elif len(self._stats) < self.max_fingerprints:
+                self._stats[fingerprint] = [normalized, 0, 1]
+            else:
+                self._untracked += 1
+
+    def get_stats(self):
+        """
+        Returns the hit and miss counts of every normalized script, a miss is
+        the first time a script was seen (and compiled by rexster), every
+        other execution of it is a hit
+
+        :returns: dict of fingerprint -> dict of script, hits, misses and hit_ratio
+        """
+        with self._lock:
+            return dict(
+                (fingerprint, {
+                    'script': script,
+                    'hits': hits,
+                    'misses': misses,
+                    'hit_ratio': hits / float(hits + misses),
+                })
+                for fingerprint, (script, hits, misses) in self._stats.items()
+            )
+
+    def get_totals(self):
+        """
+        Returns the total number of hits and misses across all scripts, scripts
+        seen after max_fingerprints distinct scripts are counted as misses
+
+        :rtype: dict
+        """
+        with self._lock:
+            hits = sum(stats[1] for stats in self._stats.values())
+            misses = sum(stats[2] for stats in self._stats.values()) + self._untracked
+        total = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': hits / float(total) if total else 0.0,
+        }
@@ -0,0 +1,89 @@
+"""
+Session scoped stored procedures
+
+Groovy closures are defined once per session as session variables, so
+calling one only sends, and has rexster compile, a tiny stable script.
+"""
+__author__ = 'bdeggleston'
+
+from collections import OrderedDict
+import re
+from threading import Lock
+
+from rexpro import exceptions
+from rexpro import groovy
+
+class StoredProcedures(object):
+    """
+    Registry of named groovy procedures, connections given a registry define
+    its procedures on every session they open
+    """
+
+    #procedure names become session variables, so they have to be groovy identifiers
+    NAME_PATTERN = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+    def __init__(self):
+        self._procedures = OrderedDict()
+        self._lock = Lock()
+
+        #incremented every time a procedure is defined, so connections know when theirs are out of date
+        self.version = 0
+
+    def define(self, name, script, param_names=()):
+        """
+        Defines (or redefines) a procedure
+
+        :param name: the name of the procedure, it's assigned to a session variable of the same name
+        :type name: str
+        :param script: the groovy script to run when the procedure is called
+        :type script: str
+        :param param_names: the names the script uses for its parameters
+        :type param_names: list
+        """
+        for identifier in [name] + list(param_names):
+            if not self.NAME_PATTERN.match(identifier):
+                raise exceptions.RexProScriptException('{} is not a valid procedure or parameter name'.format(identifier))
+
+        with self._lock:
+            self._procedures[name] = (
+                tuple(param_names),
+                groovy.closure_definition(name, param_names, script),
+                '{}.call({})'.format(name, ', '.join(param_names))
+            )
+            self.version += 1
+
+    def definition_script(self):
+        """
+        Returns the version of the registry and a script defining all of its procedures
+
+        :returns: tuple of (version, script)
+        """
+        with self._lock:
+            script = '\n'.join(definition for param_names, definition, call in self._procedures.values())
+            return self.version, script + '\nnull'
+
+    def call_request(self, name, params):
+        """
+        Returns the script calling a procedure, and the params to call it with
+
+        :param name: the name of the procedure
+        :type name: str
+        :param params: the procedure's parameters, by name
+        :type params: dict
+
+        :returns: tuple of (script, params)
+        """
+        try:
+            param_names, definition, call = self._procedures[name]
+        except KeyError:
+            raise exceptions.RexProScriptException('procedure {} is not defined'.format(name))
+
+        missing = set(param_names) - set(params)
+        if missing:
+            raise exceptions.RexProScriptException(
+                'missing parameters for procedure {}: {}'.format(name, ', '.join(sorted(missing)))
+            )
+        return call, dict((k, params[k]) for k in param_names)
+
+    def __contains__(self, name):
+        return name in self._procedures
@@ -0,0 +1,400 @@
+"""
+Result factories, which decode script responses into something other than
+the plain nested dicts msgpack produces
+
+A factory is passed to RexProConnection as its default, or to a single
+execute call, and is used in place of msgpack.loads when the response is
+decoded.
+"""
+__author__ = 'bdeggleston'
+
+from array import array
+
+import msgpack
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from rexpro import utils
+
+class ResultFactory(object):
+    """
+    Decodes the msgpack body of a response, the default factory returns what
+    msgpack.loads would
+    """
+
+    def object_hook(self):
+        """
+        Returns the msgpack object_hook used for a single response, None if
+        maps are left as dicts. A new hook is made for each response, so
+        hooks can keep state for the duration of a decode.
+
+        :rtype: callable
+        """
+        return None
+
+    def loads(self, data):
+        """
+        Decodes the whole body of a script response
+
+        :param data: the msgpack data
+        :type data: str/buffer
+        """
+        object_hook = self.object_hook()
+        if object_hook is None:
+            return msgpack.loads(data)
+        return msgpack.loads(data, object_hook=object_hook)
+
+    def unpacker(self):
+        """
+        Returns an Unpacker for decoding a response incrementally
+
+        :rtype: msgpack.Unpacker
+        """
+        object_hook = self.object_hook()
+        if object_hook is None:
+            return msgpack.Unpacker()
+        return _HookedUnpacker(object_hook)
+
+
+def _apply_hook(obj, object_hook):
+    """ calls object_hook on every map in obj, innermost first, like msgpack.loads does """
+    if isinstance(obj, dict):
+        return object_hook(dict((k, _apply_hook(v, object_hook)) for k, v in obj.iteritems()))
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_apply_hook(v, object_hook) for v in obj)
+    return obj
+
+class _HookedUnpacker(object):
+    """
+    Unpacker that calls an object_hook on the maps it decodes
+
+    msgpack 0.2's Unpacker fails when it's given a hook, so objects are
+    decoded without one, and the hook is applied to them afterwards
+    """
+
+    def __init__(self, object_hook):
+        self._unpacker = msgpack.Unpacker()
+        self._object_hook = object_hook
+
+    def feed(self, data):
+        self._unpacker.feed(data)
+
+    def unpack(self):
+        return _apply_hook(self._unpacker.unpack(), self._object_hook)
+
+
+class Element(object):
+    """
+    A graph element decoded from a script result
+
+    Elements can also be read like the dicts rexster returns for them, so
+    code written against dict results keeps working:
+
+        vertex['_id'] == vertex.id
+        vertex['_properties']['name'] == vertex.properties['name'] == vertex['name']
+    """
+    __slots__ = ('id', 'properties')
+
+    ELEMENT_TYPE = None
+
+    #dict keys of the element fields, mapped to their attributes
+    _FIELDS = {'_id': 'id', '_properties': 'properties'}
+
+    def __init__(self, id, properties):
+        """
+        :param id: the element id
+        :param properties: the element's properties
+        :type properties: dict
+        """
+        self.id = id
+        self.properties = properties
+
+    def __getitem__(self, key):
+        if key == '_type':
+            return self.ELEMENT_TYPE
+        attr = self._FIELDS.get(key)
+        if attr is not None:
+            return getattr(self, attr)
+        return self.properties[key]
+
+    def __contains__(self, key):
+        return key == '_type' or key in self._FIELDS or key in self.properties
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def to_dict(self):
+        """
+        Returns the element as the dict rexster returned for it
+
+        :rtype: dict
+        """
+        element = dict((key, getattr(self, attr)) for key, attr in self._FIELDS.items())
+        element['_type'] = self.ELEMENT_TYPE
+        return element
+
+    def __eq__(self, other):
+        if isinstance(other, Element):
+            return self.ELEMENT_TYPE == other.ELEMENT_TYPE and self.to_dict() == other.to_dict()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+    def __getstate__(self):
+        return dict((attr, getattr(self, attr)) for attr in self._FIELDS.values())
+
+    def __setstate__(self, state):
+        for attr, value in state.items():
+            setattr(self, attr, value)
+
+    def __repr__(self):
+        return '{}({!r}, {!r})'.format(type(self).__name__, self.id, self.properties)
+
+
+class Vertex(Element):
+    __slots__ = ()
+
+    ELEMENT_TYPE = 'vertex'
+
+
+class Edge(Element):
+    __slots__ = ('label', 'out_v', 'in_v')
+
+    ELEMENT_TYPE = 'edge'
+
+    _FIELDS = {'_id': 'id', '_properties': 'properties', '_label': 'label', '_outV': 'out_v', '_inV': 'in_v'}
+
+    def __init__(self, id, properties, label, out_v, in_v):
+        """
+        :param id: the edge id
+        :param properties: the edge's properties
+        :type properties: dict
+        :param label: the edge label
+        :type label: str
+        :param out_v: the id of the vertex the edge goes out of
+        :param in_v: the id of the vertex the edge goes into
+        """
+        super(Edge, self).__init__(id, properties)
+        self.label = label
+        self.out_v = out_v
+        self.in_v = in_v
+
+    def __repr__(self):
+        return 'Edge({!r}, {!r}, {!r}, {!r}, {!r})'.format(self.id, self.label, self.out_v, self.in_v, self.properties)
+
+
+class ElementFactory(ResultFactory):
+    """
+    Decodes vertex and edge maps into Vertex and Edge objects, other maps
+    are left as dicts
+
+    ids, labels and property keys are interned for the duration of a
+    response, so elements that share them share a single string instead of
+    each holding its own copy.
+    """
+
+    def __init__(self, vertex_class=Vertex, edge_class=Edge, intern_values=True):
+        """
+        :param vertex_class: the class vertices are decoded into
+        :type vertex_class: type
+        :param edge_class: the class edges are decoded into
+        :type edge_class: type
+        :param intern_values: share equal ids, labels and property keys within a response
+        :type intern_values: bool
+        """
+        self.vertex_class = vertex_class
+        self.edge_class = edge_class
+        self.intern_values = intern_values
+
+    def object_hook(self):
+        vertex_class = self.vertex_class
+        edge_class = self.edge_class
+
+        if self.intern_values:
+            memo = {}
+            share = memo.setdefault
+
+            def share_keys(properties):
+                if not properties:
+                    return properties or {}
+                return dict((share(k, k), v) for k, v in properties.iteritems())
+        else:
+            share = lambda value, default: value
+            share_keys = lambda properties: properties or {}
+
+        #msgpack calls the hook on the innermost maps first, so an element's property map
+        #has already been decoded, and went through the hook, by the time the element gets here
+        def object_hook(obj):
+            element_type = obj.get('_type')
+            if element_type == 'vertex':
+                element_id = obj.get('_id')
+                return vertex_class(share(element_id, element_id), share_keys(obj.get('_properties')))
+            if element_type == 'edge':
+                element_id, label = obj.get('_id'), obj.get('_label')
+                out_v, in_v = obj.get('_outV'), obj.get('_inV')
+                return edge_class(
+                    share(element_id, element_id),
+                    share_keys(obj.get('_properties')),
+                    share(label, label),
+                    share(out_v, out_v),
+                    share(in_v, in_v)
+                )
+            return obj
+
+        return object_hook
+
+#msgpack float type bytes, mapped to the big endian dtype of the value that follows them
+_MSGPACK_FLOATS = {0xca: '>f4', 0xcb: '>f8'}
+
+class ColumnarFactory(ResultFactory):
+    """
+    Decodes lists of numbers into arrays, and lists of maps that all have the
+    same keys into a dict of columns, mapping each key to the values it has in
+    every map. Columns of numbers are arrays, other columns are lists. Results
+    that aren't lists of numbers or of uniform maps are left as they are.
+
+    Arrays are array.arrays, or numpy arrays if numpy is used. With numpy,
+    results that are all doubles (or all floats) are read straight out of the
+    message, without decoding each of them into a python float first.
+
+    Streamed results (execute_iter) are decoded one at a time, so they aren't
+    made into columns.
+    """
+
+    def __init__(self, typecode=None, use_numpy=None):
+        """
+        :param typecode: the array.array typecode, or numpy dtype, of numeric columns, None uses 'l' for
+            columns of integers and 'd' for columns with floats in them
+        :type typecode: str
+        :param use_numpy: make numpy arrays instead of array.arrays, None uses numpy if it's installed
+        :type use_numpy: bool
+        """
+        if use_numpy is None:
+            use_numpy = numpy is not None
+        elif use_numpy and numpy is None:
+            raise ImportError('numpy is not installed')
+        self.typecode = typecode
+        self.use_numpy = use_numpy
+
+    def _array(self, values, typecode):
+        if self.use_numpy:
+            return numpy.array(values, dtype=typecode)
+        return array(typecode, values)
+
+    def column(self, values):
+        """
+        Returns values as an array if they're all numbers, or as a list if they aren't
+
+        :param values: the values of the column
+        :type values: list/tuple
+
+        :rtype: array/list
+        """
+        #building the array checks the values' types, rather than checking them first and then copying them
+        if self.use_numpy:
+            column = numpy.array(values)
+            if column.ndim != 1 or column.dtype.kind not in 'biuf':
+                #strings, nested lists, or integers too big for any numeric dtype
+                return list(values)
+            if self.typecode is not None:
+                return column.astype(self.typecode)
+            return column.astype('l') if column.dtype.kind == 'b' else column
+
+        typecode = self.typecode
+        try:
+            if typecode is None:
+                try:
+                    return array('l', values)
+                except TypeError:
+                    #there are floats in the column, or it isn't numeric
+                    typecode = 'd'
+            return array(typecode, values)
+        except (TypeError, OverflowError):
+            #values that aren't numbers, or integers too big for the column's type
+            return list(values)
+
+    def columns(self, results):
+        """
+        Makes results into an array or a dict of columns, if they're a list of
+        numbers or of maps with the same keys
+
+        :param results: the decoded results
+        """
+        if not isinstance(results, (list, tuple)):
+            return results
+        if not results:
+            return self._array([], self.typecode or 'd')
+
+        first = results[0]
+        if isinstance(first, dict):
+            keys = first.viewkeys()
+            if not all(isinstance(r, dict) and r.viewkeys() == keys for r in results):
+                return results
+            return dict((key, self.column([r[key] for r in results])) for key in keys)
+
+        column = self.column(results)
+        return results if isinstance(column, list) else column
+
+    def _read_floats(self, data):
+        """
+        Reads a response whose results are all doubles, or all floats, with
+        numpy views of the message body, instead of decoding each value
+
+        :returns: the message list, or None if the results aren't all doubles or all floats
+        """
+        #the session, request id and meta come before the results, and are small
+        head = bytearray(data[:4096])
+        try:
+            num_fields, start = utils.msgpack_array_header(head)
+            offset = start
+            for i in range(3):
+                offset = utils.msgpack_skip(head, offset)
+            fields_end = offset
+            count, offset = utils.msgpack_array_header(head, offset)
+            type_byte = head[offset] if count else None
+        except IndexError:
+            return None
+        if num_fields != 5 or type_byte not in _MSGPACK_FLOATS:
+            return None
+
+        dtype = _MSGPACK_FLOATS[type_byte]
+        stride = numpy.dtype(dtype).itemsize + 1
+        end = offset + count * stride
+        if end > len(data):
+            return None
+
+        #every value has to have the same type byte, or they aren't all the same width
+        type_bytes = numpy.ndarray((count,), dtype='u1', buffer=data, offset=offset, strides=(stride,))
+        if not (type_bytes == type_byte).all():
+            return None
+        values = numpy.ndarray((count,), dtype=dtype, buffer=data, offset=offset + 1, strides=(stride,))
+
+        #a fixarray header in front of the session, request id and meta decodes them as a list
+        session, request_id, meta = msgpack.loads(chr(0x93) + str(head[start:fields_end]))
+        bindings = msgpack.loads(data[end:])
+        return [session, request_id, meta, values.astype(self.typecode or 'd'), bindings]
+
+    def loads(self, data):
+        if self.use_numpy:
+            message = self._read_floats(data)
+            if message is not None:
+                return message
+
+        message = list(msgpack.loads(data))
+        message[3] = self.columns(message[3])
+        return message
+
+#the factory used by connections that don't have one
+default_factory = ResultFactory()
@@ -0,0 +1,208 @@
+"""
+Retry and hedging policies for script requests
+
+A RetryPolicy decides which failed requests are run again, and how long to
+back off between attempts. Errors that mean the script never ran, like
+rexster not knowing the session, are safe to retry for any script. Errors
+that leave it unknown whether the script ran, like the connection dropping
+while waiting on its response, are only retried for requests marked
+idempotent.
+
+A HedgePolicy decides how long to wait on a read only request before
+sending a copy of it on a second session, from a histogram of how long
+responses have taken.
+"""
+__author__ = 'bdeggleston'
+
+import random
+from socket import error as socket_error
+import time
+
+from rexpro import exceptions, metrics
+from rexpro.messages import ErrorResponse
+
+#errors that mean a host can't be reached, or a connection broke, rather than that a script failed
+CONNECTION_ERRORS = (exceptions.RexProConnectionException, socket_error)
+
+class RetryPolicy(object):
+    """
+    Retries failed requests with exponential backoff
+
+    The timeout of a request covers every attempt and the backoff between
+    them, so a request that runs out of time isn't retried. Requests made
+    inside a transaction opened with open_transaction are never retried,
+    since the transaction belongs to the session that failed.
+    """
+
+    def __init__(self, max_attempts=3, backoff=0.05, max_backoff=1.0, multiplier=2.0, jitter=0.5,
+                 flags=(ErrorResponse.INVALID_SESSION_ERROR,), idempotent_flags=(), connection_errors=True):
+        """
+        :param max_attempts: the maximum number of times a request is sent, including the first
+        :type max_attempts: int
+        :param backoff: the number of seconds to wait before the first retry
+        :type backoff: float
+        :param max_backoff: the maximum number of seconds to wait between attempts
+        :type max_backoff: float
+        :param multiplier: the backoff is multiplied by this after each retry
+        :type multiplier: float
+        :param jitter: the fraction of each backoff that's randomized, so clients that failed together
+            don't all retry together
+        :type jitter: float
+        :param flags: ErrorResponse flags that are retried for any request, these should only be errors
+            rexster returns without running the script
+        :type flags: tuple
+        :param idempotent_flags: ErrorResponse flags that are only retried for idempotent requests,
+            like SCRIPT_FAILURE_ERROR for graphs whose transactions fail on lock contention
+        :type idempotent_flags: tuple
+        :param connection_errors: retry idempotent requests that failed with a connection error or timed out
+        :type connection_errors: bool
+        """
+        if max_attempts < 1:
+            raise ValueError('max_attempts has to be at least 1')
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.flags = frozenset(flags)
+        self.idempotent_flags = frozenset(idempotent_flags)
+        self.connection_errors = connection_errors
+
+    def should_retry(self, exception, idempotent=False):
+        """
+        Returns True if a request that failed with the given exception can be sent again
+
+        :param exception: the exception the request failed with
+        :type exception: Exception
+        :param idempotent: the request can safely be run more than once
+        :type idempotent: bool
+
+        :rtype: bool
+        """
+        if isinstance(exception, exceptions.RexProScriptException):
+            if exception.flag in self.flags:
+                return True
+            return idempotent and exception.flag in self.idempotent_flags
+        if isinstance(exception, CONNECTION_ERRORS):
+            #the script may or may not have run
+            return idempotent and self.connection_errors
+        return False
+
+    def backoff_for(self, attempt):
+        """
+        Returns the number of seconds to wait after the given attempt failed
+
+        :param attempt: the number of the attempt that failed, starting at 1
+        :type attempt: int
+
+        :rtype: float
+        """
+        backoff = min(self.backoff * self.multiplier ** (attempt - 1), self.max_backoff)
+        return backoff * (1 - self.jitter * random.random())
+
+    def call(self, fn, idempotent=False, deadline=None):
+        """
+        Calls fn until it succeeds, or fails with an error that shouldn't be
+        retried, or max_attempts calls have been made
+
+        :param fn: the request, called without arguments
+        :type fn: callable
+        :param idempotent: the request can safely be run more than once
+        :type idempotent: bool
+        :param deadline: the time every attempt has to have finished by, an error is raised instead of
+            retrying if the backoff would run past it
+        :type deadline: float
+        """
+        attempt = 1
+        while True:
+            try:
+                return fn()
+            except Exception as ex:
+                if attempt >= self.max_attempts or not self.should_retry(ex, idempotent):
+                    raise
+                backoff = self.backoff_for(attempt)
+                if deadline is not None and time.time() + backoff >= deadline:
+                    raise
+            time.sleep(backoff)
+            attempt += 1
+
+
+class HedgePolicy(object):
+    """
+    Sends a copy of a read only request on a second session when the first
+    hasn't been answered within a percentile of recent response times, and
+    uses whichever response arrives first
+
+    Only requests made with read_only=True are hedged, since the copy runs
+    the script a second time. Until min_samples responses have been
+    observed, requests aren't hedged unless a fixed delay is given.
+    """
+
+    def __init__(self, delay=None, percentile=95, min_delay=0.001, max_delay=1.0, min_samples=100,
+                 buckets=metrics.Histogram.DEFAULT_BUCKETS):
+        """
+        :param delay: a fixed number of seconds to wait before hedging, None uses the percentile
+        :type delay: float
+        :param percentile: the percentile of response times to wait for before hedging
+        :type percentile: float
+        :param min_delay: the minimum number of seconds to wait before hedging
+        :type min_delay: float
+        :param max_delay: the maximum number of seconds to wait before hedging
+        :type max_delay: float
+        :param min_samples: the number of responses to observe before the percentile is used
+        :type min_samples: int
+        :param buckets: the upper bounds of the response time histogram buckets, the percentile is the
+            upper bound of the bucket it falls in
+        :type buckets: tuple
+        """
+        self.fixed_delay = delay
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.min_samples = min_samples
+        self.latencies = metrics.Histogram(buckets)
+        self.hedged = metrics.Counter()
+        self.hedges_won = metrics.Counter()
+
+    def delay(self):
+        """
+        Returns the number of seconds to wait before hedging a request, or
+        None if it shouldn't be hedged yet
+
+        :rtype: float
+        """
+        if self.fixed_delay is not None:
+            return self.fixed_delay
+        if self.latencies.count < self.min_samples:
+            return None
+        return min(max(self.latencies.percentile(self.percentile), self.min_delay), self.max_delay)
+
+    def observe(self, latency, hedged=False, hedge_won=False):
+        """
+        Records how long a request took to be answered
+
+        :param latency: the number of seconds until the first response arrived
+        :type latency: float
+        :param hedged: a copy of the request was sent
+        :type hedged: bool
+        :param hedge_won: the copy was answered first
+        :type hedge_won: bool
+        """
+        self.latencies.observe(latency)
+        if hedged:
+            self.hedged.inc()
+        if hedge_won:
+            self.hedges_won.inc()
+
+    def get_stats(self):
+        """
+        Returns the number of requests observed and hedged, and the current delay
+
+        :rtype: dict
+        """
+        return {
+            'requests': self.latencies.count,
+            'hedged': self.hedged.value,
+            'hedges_won': self.hedges_won.value,
+            'delay': self.delay(),
+        }
@@ -0,0 +1,293 @@
+"""
+In process stand-in for a rexster server
+
+StandInServer speaks the rexpro framing and answers session and script
+requests without evaluating them. Scripts are answered from a table of
+scripted responses, anything else gets a generated result of a configurable
+size, after a configurable latency. It's meant for measuring the client
+(see rexpro.bench) and for tests that shouldn't need a live rexster.
+"""
+__author__ = 'bdeggleston'
+
+import random
+from socket import socket, error as socket_error, SOL_SOCKET, SO_REUSEADDR, SHUT_RDWR
+from threading import Lock, Thread
+import time
+
+from rexpro import exceptions, messages, utils
+from rexpro.connection import RexProSocket
+
+MessageTypes = messages.MessageTypes
+
+#answer to the connection's graph features query
+DEFAULT_FEATURES = {
+    'supportsTransactions': False,
+    'supportsIndices': True,
+    'supportsKeyIndices': True,
+}
+
+def make_results(size, property_size=16):
+    """
+    Generates a list of vertex maps, like the ones rexster returns for g.V
+
+    :param size: the number of vertices
+    :type size: int
+    :param property_size: the length of each vertex's name property
+    :type property_size: int
+
+    :rtype: list
+    """
+    padding = 'x' * property_size
+    return [
+        {'_id': i, '_type': 'vertex', '_properties': {'name': '{}{}'.format(i, padding)[:property_size]}}
+        for i in xrange(size)
+    ]
+
+
+class StandInServer(object):
+    """
+    Threaded rexpro server that answers requests from scripted responses
+
+    Scripted responses are looked up by the stripped script text, and can be
+    a value to return, an exception (returned as a script failure) or a
+    callable that takes the ScriptRequest and returns either.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, result_size=1, property_size=16,
+                 responses=None, graphs=None, username=None, password=None):
+        """
+        :param host: the address to listen on
+        :type host: str
+        :param port: the port to listen on, 0 picks a free one
+        :type port: int
+        :param latency: the number of seconds to wait before answering each script request
+        :type latency: float
+        :param jitter: the maximum number of seconds added to or removed from the latency, at random
+        :type jitter: float
+        :param result_size: the number of vertices returned for scripts without a scripted response
+        :type result_size: int
+        :param property_size: the length of the generated vertices' name property
+        :type property_size: int
+        :param responses: script -> scripted response
+        :type responses: dict
+        :param graphs: the graph names sessions can be opened on, None allows any
+        :type graphs: list
+        :param username: the username sessions must authenticate with, None doesn't check credentials
+        :type username: str
+        :param password: the password sessions must authenticate with
+        :type password: str
+        """
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.graphs = graphs
+        self.username = username
+        self.password = password
+
+        self.responses = {'g.getFeatures().toMap()': DEFAULT_FEATURES}
+        self.responses.update(responses or {})
+        self.default_results = make_results(result_size, property_size)
+
+        self._sessions = set()
+
+        #client socket -> the thread serving it
+        self._clients = {}
+        self._lock = Lock()
+        self._listener = None
+        self._accept_thread = None
+        self._running = False
+
+        #number of script requests answered
+        self.requests_served = 0
+
+    @property
+    def address(self):
+        """ the (host, port) the server is listening on """
+        return self.host, self.port
+
+    def set_response(self, script, response):
+        """
+        Sets the scripted response to a script
+
+        :param script: the script, leading and trailing whitespace is ignored
+        :type script: str
+        :param response: the value to return, an exception to fail with, or a callable that takes the request and returns either,
+            a RexProScriptException with a flag in its meta fails with that flag instead of SCRIPT_FAILURE_ERROR
+        """
+        self.responses[script.strip()] = response
+
+    def start(self):
+        """
+        Starts listening and answering requests in background threads
+        """
+        listener = socket()
+        listener.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+        listener.bind((self.host, self.port))
+        listener.listen(128)
+        self.port = listener.getsockname()[1]
+        self._listener = listener
+        self._running = True
+
+        self._accept_thread = Thread(target=self._accept_loop, name='rexpro-standin')
+        self._accept_thread.daemon = True
+        self._accept_thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops listening and closes every client connection
+        """
+        self._running = False
+        if self._listener is not None:
+            try:
+                self._listener.shutdown(SHUT_RDWR)
+            except socket_error:
+                pass
+            self._listener.close()
+
+        if self._accept_thread is not None:
+            self._accept_thread.join()
+            self._accept_thread = None
+
+        with self._lock:
+            clients = self._clients.items()
+        for client, thread in clients:
+            try:
+                client.shutdown(SHUT_RDWR)
+            except socket_error:
+                pass
+            thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _accept_loop(self):
+        listener = self._listener
+        while self._running:
+            try:
+                client, address = listener.accept()
+            except socket_error:
+                return
+            client = RexProSocket(_sock=client)
+            thread = Thread(target=self._serve, args=(client,), name='rexpro-standin-client')
+            thread.daemon = True
+            with self._lock:
+                self._clients[client] = thread
+            thread.start()
+
+    def _serve(self, client):
+        """
+        Answers the requests of a single client, in order, until it disconnects
+        """
+        try:
+            while self._running:
+                msg_type, msg_len = client.read_header()
+                body = str(client.read_body(msg_len))
+                if msg_type == MessageTypes.SESSION_REQUEST:
+                    response = self.handle_session(messages.SessionRequest.deserialize(body))
+                elif msg_type == MessageTypes.SCRIPT_REQUEST:
+                    response = self.handle_script(messages.ScriptRequest.deserialize(body))
+                else:
+                    response = messages.ErrorResponse(
+                        meta={'flag': messages.ErrorResponse.INVALID_MESSAGE_ERROR},
+                        message='unsupported message type {}'.format(msg_type)
+                    )
+                client.send_message(response)
+        except Exception:
+            #disconnected, or a message we couldn't parse
+            pass
+        finally:
+            with self._lock:
+                self._clients.pop(client, None)
+            client.close()
+
+    def handle_session(self, request):
+        """
+        Opens or kills a session
+
+        :param request: the session request
+        :type request: SessionRequest
+
+        :rtype: RexProMessage
+        """
+        if request.kill_session:
+            with self._lock:
+                self._sessions.discard(request.session)
+            return messages.SessionResponse(session_key=None, meta={}, languages=[], request_id=request.request_id)
+
+        if self.graphs is not None and request.graph_name not in self.graphs:
+            return messages.ErrorResponse(
+                meta={'flag': messages.ErrorResponse.GRAPH_CONFIG_ERROR},
+                message='Graph [{}] could not be found'.format(request.graph_name),
+                request_id=request.request_id
+            )
+
+        if self.username is not None and (request.username, request.password) != (self.username, self.password):
+            return messages.ErrorResponse(
+                meta={'flag': messages.ErrorResponse.AUTH_FAILURE_ERROR},
+                message='Invalid username or password',
+                request_id=request.request_id
+            )
+
+        session_key = utils.random_uuid_bytes()
+        with self._lock:
+            self._sessions.add(session_key)
+        return messages.SessionResponse(
+            session_key=session_key,
+            meta={},
+            languages=[messages.ScriptRequest.Language.GROOVY],
+            request_id=request.request_id
+        )
+
+    def handle_script(self, request):
+        """
+        Answers a script request with its scripted response, or the default results
+
+        :param request: the script request
+        :type request: ScriptRequest
+
+        :rtype: RexProMessage
+        """
+        if request.in_session:
+            with self._lock:
+                valid_session = request.session in self._sessions
+            if not valid_session:
+                return messages.ErrorResponse(
+                    meta={'flag': messages.ErrorResponse.INVALID_SESSION_ERROR},
+                    message='There was no session with the specified ID',
+                    request_id=request.request_id
+                )
+
+        if self.latency or self.jitter:
+            time.sleep(max(self.latency + random.uniform(-self.jitter, self.jitter), 0))
+
+        response = self.responses.get(request.script.strip(), self.default_results)
+        if callable(response):
+            try:
+                response = response(request)
+            except Exception as ex:
+                response = ex
+
+        with self._lock:
+            self.requests_served += 1
+
+        if isinstance(response, Exception):
+            flag = messages.ErrorResponse.SCRIPT_FAILURE_ERROR
+            if isinstance(response, exceptions.RexProScriptException) and response.flag is not None:
+                flag = response.flag
+            return messages.ErrorResponse(
+                meta={'flag': flag},
+                message=str(response),
+                session_key=request.session,
+                request_id=request.request_id
+            )
+        return messages.MsgPackScriptResponse(
+            results=response,
+            bindings={},
+            session_key=request.session,
+            request_id=request.request_id
+        )
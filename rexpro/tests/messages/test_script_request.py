@@ -2,9 +2,39 @@ from unittest import skip
 
 __author__ = 'bdeggleston'
 
-from rexpro.messages import ScriptRequest, MsgPackScriptResponse, ErrorResponse, SessionRequest, SessionResponse
+from unittest import TestCase
+
+import msgpack
+
+from rexpro.messages import ScriptRequest, MsgPackScriptResponse, ErrorResponse, SessionRequest, SessionResponse, PreparedScript
 from rexpro.tests.base import BaseRexProTestCase, multi_graph
 
+class TestPreparedScript(TestCase):
+
+    def test_prepared_requests_serialize_like_script_requests(self):
+        prepared = PreparedScript(u'g.v(eid).out("knows")', isolate=False, in_transaction=False)
+        request = prepared.request(params={'eid':5}, session_key='k' * 16)
+        expected = ScriptRequest(
+            u'g.v(eid).out("knows")',
+            params={'eid':5},
+            session_key='k' * 16,
+            isolate=False,
+            in_transaction=False
+        )
+
+        payload = request.get_payload()
+        expected.request_id = request.request_id
+        self.assertEqual(payload, msgpack.dumps(expected.get_message_list()))
+        self.assertEqual(request.serialize(), expected.serialize())
+
+    def test_requests_get_unique_ids(self):
+        prepared = PreparedScript('1')
+        first, second = prepared.request(), prepared.request()
+        first.serialize()
+        second.serialize()
+        self.assertNotEqual(first.request_id, second.request_id)
+
+
 class TestRexProScriptRequestMessage(BaseRexProTestCase):
 
     @multi_graph
@@ -0,0 +1,74 @@
+__author__ = 'bdeggleston'
+
+from unittest import TestCase
+
+from rexpro.bulk import BulkLoader, ADD_VERTICES, ADD_EDGES, edge_params
+from rexpro.connection import RexProSessionPool
+from rexpro.server import StandInServer
+
+class TestBulkLoader(TestCase):
+
+    def setUp(self):
+        self.loaded = []
+        self.failures = [0]
+
+        def add(request):
+            elements = request.params['elements']
+            if self.failures[0]:
+                self.failures[0] -= 1
+                raise ValueError('deadlock')
+            self.loaded.extend(elements)
+            return [len(self.loaded) - len(elements) + i for i in range(len(elements))]
+
+        self.server = StandInServer(responses={ADD_VERTICES: add, ADD_EDGES: add}).start()
+        self.pool = RexProSessionPool(self.server.host, self.server.port, 'emptygraph', 0, max_size=4)
+
+    def tearDown(self):
+        self.pool.close_all()
+        self.server.stop()
+
+    def test_load_vertices(self):
+        progress = []
+        loader = BulkLoader(self.pool, batch_size=10, commit_every=30, concurrency=3, progress=progress.append)
+        report = loader.load_vertices(({'name': str(i)} for i in range(95)), collect_ids=True)
+
+        self.assertEqual(report.loaded, 95)
+        self.assertEqual(report.failed, 0)
+        self.assertEqual(report.commits, 4)
+        self.assertEqual(report.chunks, 10)
+        self.assertEqual(len(self.loaded), 95)
+        self.assertEqual(len(report.ids), 95)
+        self.assertTrue(progress)
+
+    def test_failed_groups_are_retried(self):
+        self.failures[0] = 2
+        loader = BulkLoader(self.pool, batch_size=10, commit_every=10, concurrency=1, retry_delay=0)
+        report = loader.load_edges([(1, 2, 'knows')] * 20)
+        self.assertEqual(report.loaded, 20)
+        self.assertEqual(report.retries, 2)
+
+    def test_groups_that_keep_failing_are_reported(self):
+        self.failures[0] = 100
+        loader = BulkLoader(self.pool, batch_size=10, concurrency=1, max_retries=1, retry_delay=0)
+        report = loader.load_vertices([{'name': 'a'}] * 5, collect_ids=True)
+        self.assertEqual(report.failed, 5)
+        self.assertEqual(len(report.errors), 1)
+        self.assertEqual(report.ids, [None] * 5)
+
+    def test_edge_params(self):
+        self.assertEqual(edge_params((1, 2, 'knows')), [1, 2, 'knows', {}])
+        self.assertEqual(
+            edge_params({'_outV': 1, '_inV': 2, '_label': 'knows', 'weight': 0.5}),
+            [1, 2, 'knows', {'weight': 0.5}]
+        )
+
+    def test_only_failed_chunks_are_retried_without_transactions(self):
+        self.failures[0] = 1
+        loader = BulkLoader(self.pool, batch_size=10, commit_every=30, concurrency=1, retry_delay=0,
+                            transactions=False)
+        report = loader.load_vertices(({'name': str(i)} for i in range(30)), collect_ids=True)
+        self.assertEqual(len(self.loaded), 30)
+        self.assertEqual(report.loaded, 30)
+        self.assertEqual(report.chunks, 3)
+        self.assertEqual(report.retries, 1)
+        self.assertEqual(sorted(report.ids), range(30))
@@ -0,0 +1,117 @@
+__author__ = 'bdeggleston'
+
+from threading import Thread
+import time
+from unittest import TestCase
+
+from rexpro.cache import ResultCache
+from rexpro.connection import RexProConnection, RexProSessionPool
+from rexpro.server import StandInServer
+
+class TestResultCache(TestCase):
+
+    def test_keys_are_canonical(self):
+        cache = ResultCache()
+        self.assertEqual(
+            cache.key('g', 'g.v(id)', {'id': 1, 'label': 'knows'}),
+            cache.key('g', 'g.v(id)', {'label': 'knows', 'id': 1})
+        )
+        self.assertNotEqual(cache.key('g', 'g.v(id)', {'id': 1}), cache.key('other', 'g.v(id)', {'id': 1}))
+
+    def test_lru_eviction(self):
+        cache = ResultCache(max_entries=2)
+        for key in ['a', 'b', 'a', 'c']:
+            cache.get_or_execute(key, lambda: key)
+        #b was the least recently used
+        self.assertEqual(cache.get_or_execute('a', lambda: 'miss'), 'a')
+        self.assertEqual(cache.get_or_execute('b', lambda: 'miss'), 'miss')
+        self.assertEqual(cache.get_stats()['evictions'], 2)
+
+    def test_memory_budget(self):
+        cache = ResultCache(max_bytes=100)
+        cache.get_or_execute('small', lambda: 'x' * 10)
+        cache.get_or_execute('large', lambda: 'x' * 200)
+        stats = cache.get_stats()
+        self.assertEqual(stats['entries'], 1)
+        self.assertTrue(stats['bytes'] <= 100)
+
+    def test_ttl(self):
+        cache = ResultCache(ttl=0.01)
+        cache.get_or_execute('a', lambda: 1)
+        time.sleep(0.02)
+        self.assertEqual(cache.get_or_execute('a', lambda: 2), 2)
+        self.assertEqual(cache.get_stats()['expirations'], 1)
+
+    def test_single_flight(self):
+        cache = ResultCache()
+        calls = []
+
+        def slow():
+            calls.append(1)
+            time.sleep(0.05)
+            return 'result'
+
+        results = []
+        threads = [Thread(target=lambda: results.append(cache.get_or_execute('a', slow))) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['result'] * 5)
+        self.assertEqual(cache.get_stats()['collapsed'], 4)
+
+    def test_unsizable_results_arent_cached(self):
+        cache = ResultCache()
+        result = object()
+
+        def slow():
+            time.sleep(0.05)
+            return result
+
+        results = []
+        threads = [Thread(target=lambda: results.append(cache.get_or_execute('a', slow))) for i in range(3)]
+        for thread in threads:
+            #waiters on a flight that's never resolved would block forever
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(results, [result] * 3)
+        self.assertEqual(cache.get_stats()['entries'], 0)
+        self.assertEqual(cache._flights, {})
+
+    def test_invalidated_on_commit(self):
+        server = StandInServer().start()
+        try:
+            conn = RexProConnection(server.host, server.port, 'emptygraph', cache=ResultCache())
+            conn.execute('g.V', cached=True)
+            conn.execute('g.V', cached=True)
+            self.assertEqual(server.requests_served, 1)
+
+            conn.open_transaction()
+            conn.close_transaction(success=True)
+            served = server.requests_served
+            conn.execute('g.V', cached=True)
+            self.assertEqual(server.requests_served, served + 1)
+            self.assertEqual(conn.cache.get_stats()['hits'], 1)
+            conn.close()
+        finally:
+            server.stop()
+
+    def test_generator_params_are_sent(self):
+        server = StandInServer().start()
+        server.set_response('ids', lambda request: request.params['ids'])
+        cache = ResultCache()
+        try:
+            conn = RexProConnection(server.host, server.port, 'emptygraph', cache=cache)
+            self.assertEqual(list(conn.execute('ids', {'ids': (i for i in range(3))}, cached=True)), [0, 1, 2])
+            self.assertEqual(list(conn.execute('ids', {'ids': [0, 1, 2]}, cached=True)), [0, 1, 2])
+            self.assertEqual(cache.get_stats()['hits'], 1)
+            conn.close()
+
+            pool = RexProSessionPool(server.host, server.port, 'emptygraph', 1, cache=ResultCache())
+            self.assertEqual(list(pool.execute('ids', {'ids': (i for i in range(3))}, cached=True)), [0, 1, 2])
+            pool.close_all()
+        finally:
+            server.stop()
@@ -0,0 +1,93 @@
+__author__ = 'bdeggleston'
+
+from socket import socket
+from unittest import TestCase
+
+from rexpro import exceptions
+from rexpro.cluster import RexProCluster, EWMA
+from rexpro.server import StandInServer
+
+def unused_port():
+    sock = socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+class TestCluster(TestCase):
+
+    def setUp(self):
+        self.servers = [StandInServer().start(), StandInServer(latency=0.02).start()]
+
+    def tearDown(self):
+        for server in self.servers:
+            server.stop()
+
+    def test_least_outstanding_spreads_sessions(self):
+        cluster = RexProCluster([s.address for s in self.servers], 'emptygraph')
+        with cluster.contextual_connection() as first:
+            with cluster.contextual_connection() as second:
+                self.assertNotEqual(first.port, second.port)
+        cluster.close_all()
+
+    def test_ewma_prefers_the_faster_host(self):
+        cluster = RexProCluster([s.address for s in self.servers], 'emptygraph', policy=EWMA)
+        for i in range(20):
+            cluster.execute('g.V')
+        self.assertTrue(self.servers[0].requests_served > self.servers[1].requests_served)
+        cluster.close_all()
+
+    def test_down_hosts_are_skipped_and_probed(self):
+        dead = ('127.0.0.1', unused_port())
+        cluster = RexProCluster([dead, self.servers[0].address], 'emptygraph', retry_interval=60)
+        for i in range(4):
+            cluster.execute('g.V')
+        self.assertEqual(self.servers[0].requests_served, 4)
+
+        #down hosts are probed once their retry interval has passed
+        cluster.retry_interval = 0
+        cluster.mark_down(dead)
+        cluster.execute('g.V')
+        stats = cluster.get_stats()['{}:{}'.format(*dead)]
+        self.assertFalse(stats['up'])
+        self.assertEqual(stats['failures'], 2)
+        self.assertEqual(self.servers[0].requests_served, 5)
+
+        #when every host is down they're tried anyway
+        cluster.retry_interval = 60
+        cluster.mark_down(dead)
+        cluster.mark_down(self.servers[0].address)
+        cluster.execute('g.V')
+        self.assertTrue(cluster.get_stats()['{}:{}'.format(*self.servers[0].address)]['up'])
+        cluster.close_all()
+
+    def test_only_the_probe_ends_probing(self):
+        cluster = RexProCluster([s.address for s in self.servers], 'emptygraph', retry_interval=0)
+        host, other = cluster.hosts
+        self.assertEqual(cluster._choose(exclude=[other]), (host, False))
+
+        cluster.mark_down(host)
+        self.assertEqual(cluster._choose(), (host, True))
+
+        #a session checked out before the host went down doesn't let a second probe through
+        cluster._release(host, failed=True)
+        self.assertTrue(host.probing)
+        self.assertEqual(cluster._choose(), (other, False))
+
+        cluster._release(host, failed=True, probe=True)
+        self.assertFalse(host.probing)
+        cluster.close_all()
+
+    def test_no_hosts_available(self):
+        cluster = RexProCluster([('127.0.0.1', unused_port())], 'emptygraph')
+        with self.assertRaises(exceptions.RexProConnectionException):
+            cluster.execute('g.V')
+
+    def test_transactions_are_pinned(self):
+        cluster = RexProCluster([s.address for s in self.servers], 'emptygraph')
+        with cluster.transaction() as conn:
+            served = [s.requests_served for s in self.servers]
+            for i in range(3):
+                conn.execute('g.V')
+            self.assertIn(3, [s.requests_served - n for s, n in zip(self.servers, served)])
+        cluster.close_all()
@@ -0,0 +1,25 @@
+__author__ = 'bdeggleston'
+
+from unittest import TestCase
+
+from rexpro import codecbench
+
+class TestCodecBenchmarks(TestCase):
+
+    def test_benchmarks_run(self):
+        results = codecbench.run_all(names=['serialize_tiny_request', 'deserialize_single_vertex'], min_time=0.001, repeat=1)
+        self.assertEqual(sorted(results), ['deserialize_single_vertex', 'serialize_tiny_request'])
+        for result in results.values():
+            self.assertTrue(result['ops_per_sec'] > 0)
+
+    def test_peak_memory_of_each_benchmark(self):
+        allocate = codecbench.Benchmark('allocate', lambda: 32 * 1024 * 1024, bytearray)
+        for i in range(2):
+            result = codecbench.run_benchmark(allocate, min_time=0.001, repeat=1)
+            #the second run is measured on its own, not against the peak of the first
+            self.assertGreaterEqual(result['peak_memory'], 32 * 1024 * 1024)
+
+    def test_find_regressions(self):
+        baseline = {'fast': {'ops_per_sec': 100.0}, 'slow': {'ops_per_sec': 100.0}}
+        results = {'fast': {'ops_per_sec': 95.0}, 'slow': {'ops_per_sec': 80.0}, 'new': {'ops_per_sec': 1.0}}
+        self.assertEqual(codecbench.find_regressions(results, baseline, threshold=0.1), [('slow', 100.0, 80.0)])
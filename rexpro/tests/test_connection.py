@@ -1,10 +1,14 @@
 __author__ = 'bdeggleston'
 
+import time
 from unittest import skip
 
 from rexpro.tests.base import BaseRexProTestCase, multi_graph
 
 from rexpro import exceptions
+from rexpro.connection import RexProConnectionPool, RexProSessionPool
+from rexpro.messages import SessionRequest, SessionResponse
+from rexpro.procedures import StoredProcedures
 
 class TestConnection(BaseRexProTestCase):
 
@@ -17,6 +21,13 @@ class TestConnection(BaseRexProTestCase):
         with self.assertRaises(exceptions.RexProConnectionException):
             self.get_connection(graphname='nothing')
 
+    def test_graph_features_are_shared(self):
+        """ Tests that graph features are only fetched once per graph """
+        conn1 = self.get_connection()
+        conn2 = self.get_connection()
+        assert isinstance(conn1.graph_features, dict)
+        assert conn2.graph_features is conn1.graph_features
+
     @skip
     def test_invalid_connection_info_raises_exception(self):
         pass
@@ -30,6 +41,58 @@ class TestConnection(BaseRexProTestCase):
         pass
 
 
+class TestConnectionPool(BaseRexProTestCase):
+
+    def test_pool_is_bounded(self):
+        """ Tests that checking out more than max_size connections times out """
+        pool = RexProConnectionPool(self.host, self.port, 1, max_size=2, timeout=0.1)
+        pool.get()
+        pool.get()
+        with self.assertRaises(exceptions.RexProConnectionException):
+            pool.get()
+        assert pool.get_stats()['timeouts'] == 1
+
+    def test_connections_are_discarded_when_the_block_fails(self):
+        pool = RexProConnectionPool(self.host, self.port, 1)
+        with self.assertRaises(ValueError):
+            with pool.contextual_connection() as conn:
+                raise ValueError
+        stats = pool.get_stats()
+        assert stats['discarded'] == 1
+        assert stats['size'] == 0
+
+    def test_out_of_sync_connections_are_not_reused(self):
+        """ Tests that a connection with an unread response is replaced on checkout """
+        pool = RexProConnectionPool(self.host, self.port, 1)
+        conn = pool.get()
+        conn.send_message(SessionRequest())
+        pool.put(conn)
+
+        time.sleep(0.1)
+
+        with pool.contextual_connection() as new_conn:
+            assert new_conn is not conn
+            new_conn.send_message(SessionRequest())
+            assert isinstance(new_conn.get_response(), SessionResponse)
+
+
+class TestSessionPool(BaseRexProTestCase):
+
+    def test_sessions_are_reused(self):
+        pool = RexProSessionPool(self.host, self.port, self.default_graphname, 1)
+        with pool.contextual_connection() as conn:
+            session_key = conn._session_key
+        with pool.contextual_connection() as conn:
+            assert conn._session_key == session_key
+
+    def test_open_transactions_are_rolled_back_on_return(self):
+        pool = RexProSessionPool(self.host, self.port, self.default_graphname, 1)
+        with pool.contextual_connection() as conn:
+            conn.open_transaction()
+        with pool.contextual_connection() as conn:
+            assert not conn._in_transaction
+
+
 class TestQueries(BaseRexProTestCase):
 
     @multi_graph
@@ -108,6 +171,74 @@ class TestQueries(BaseRexProTestCase):
         assert e['_outV'] == v1['_id']
         assert e['_inV'] == v2['_id']
 
+    def test_streaming_results(self):
+        """ Tests that execute_iter yields the same results as execute """
+        conn = self.get_connection()
+
+        script = "(1..1000).collect { [id:it, name:'v' + it] }"
+        results = list(conn.execute_iter(script))
+        assert len(results) == 1000
+        assert results == list(conn.execute(script))
+
+        #abandoning an iterator part way through shouldn't break the connection
+        results = conn.execute_iter(script)
+        results.next()
+        results.close()
+        assert conn.execute('values', params={'values':5}) == 5
+
+    def test_pipelined_requests(self):
+        """ Tests that pipelined responses are matched to the requests they answer """
+        conn = self.get_connection()
+        conn.max_in_flight = 4
+
+        pending = [conn.execute_pipelined('values', params={'values':i}) for i in range(20)]
+        failed = conn.execute_pipelined('undefined_variable')
+
+        assert conn.execute('values', params={'values':'last'}) == 'last'
+        assert [p.result() for p in pending] == range(20)
+        with self.assertRaises(exceptions.RexProScriptException):
+            failed.result()
+
+    def test_execute_many(self):
+        """ Tests that batched scripts return their own results and errors """
+        conn = self.get_connection()
+
+        results = conn.execute_many(
+            [
+                ('values', {'values':1}),
+                ('values + 1', {'values':1}),
+                'undefined_variable',
+                ('values', {'values':'last'}),
+            ],
+            chunk_size=3
+        )
+        assert results[:2] == [1, 2]
+        assert isinstance(results[2], exceptions.RexProScriptException)
+        assert results[3] == 'last'
+
+class TestStoredProcedures(BaseRexProTestCase):
+
+    def test_calling_procedures(self):
+        procedures = StoredProcedures()
+        procedures.define('add', 'x + y', ['x', 'y'])
+
+        conn = self.get_connection()
+        conn.procedures = procedures
+        assert conn.call_procedure('add', {'x':1, 'y':2}) == 3
+
+        #procedures defined after the session has been opened are picked up too
+        procedures.define('double', 'x * 2', ['x'])
+        assert conn.call_procedure('double', {'x':4}) == 8
+
+    def test_missing_parameters_raise_exception(self):
+        procedures = StoredProcedures()
+        procedures.define('add', 'x + y', ['x', 'y'])
+
+        conn = self.get_connection()
+        conn.procedures = procedures
+        with self.assertRaises(exceptions.RexProScriptException):
+            conn.call_procedure('add', {'x':1})
+
 class TestTransactions(BaseRexProTestCase):
 
     def test_transaction_isolation(self):
@@ -0,0 +1,57 @@
+__author__ = 'bdeggleston'
+
+from datetime import datetime
+from decimal import Decimal
+from unittest import TestCase
+from uuid import UUID
+
+import msgpack
+
+from rexpro import exceptions
+from rexpro.encoders import ParamEncoderRegistry, default_registry
+from rexpro.messages import ScriptRequest
+
+class Point(object):
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+class TestParamEncoders(TestCase):
+
+    def test_default_encoders(self):
+        params = {
+            'when': datetime(2013, 5, 1, 12, 30),
+            'id': UUID(int=1),
+            'amount': Decimal('1.5'),
+            'tags': set(['a']),
+            'nested': [{'ids': (i for i in range(3))}],
+        }
+        self.assertEqual(msgpack.loads(default_registry.pack(params)), {
+            'when': '2013-05-01T12:30:00',
+            'id': '00000000-0000-0000-0000-000000000001',
+            'amount': 1.5,
+            'tags': ('a',),
+            'nested': ({'ids': (0, 1, 2)},),
+        })
+
+    def test_registered_encoders_apply_to_subclasses(self):
+        class Point3D(Point):
+            pass
+
+        registry = ParamEncoderRegistry()
+        registry.register(Point, lambda p: [p.x, p.y])
+        self.assertEqual(msgpack.loads(registry.pack([Point3D(1, 2)])), ((1, 2),))
+
+    def test_unsupported_types_raise_exception(self):
+        with self.assertRaises(exceptions.RexProScriptException):
+            ScriptRequest('x', params={'x': Point(1, 2)}).serialize()
+
+        #nested values are caught while they're encoded, and don't corrupt the next message
+        with self.assertRaises(exceptions.RexProScriptException):
+            default_registry.pack({'x': [Point(1, 2)]})
+        self.assertEqual(msgpack.loads(default_registry.pack([1])), (1,))
+
+    def test_invalid_param_names_raise_exception(self):
+        for name in ['1x', 'x y', 'x.y']:
+            with self.assertRaises(exceptions.RexProScriptException):
+                ScriptRequest('x', params={name: 1}).serialize()
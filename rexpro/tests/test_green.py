@@ -0,0 +1,57 @@
+__author__ = 'bdeggleston'
+
+from unittest import TestCase
+
+import gevent
+
+from rexpro import exceptions
+from rexpro.green import GreenRexProConnectionPool
+from rexpro.server import StandInServer
+
+class TestGreenRexProConnectionPool(TestCase):
+
+    def setUp(self):
+        self.server = StandInServer().start()
+        self.server.set_response('fast', 'fast')
+        self.pool = GreenRexProConnectionPool(self.server.host, self.server.port, 'emptygraph', size=1)
+
+    def tearDown(self):
+        self.pool.close_all()
+        self.server.stop()
+
+    def test_concurrent_executes(self):
+        jobs = [gevent.spawn(self.pool.execute, 'fast') for i in range(10)]
+        gevent.joinall(jobs, timeout=5)
+        self.assertEqual([job.value for job in jobs], ['fast'] * 10)
+        self.assertEqual(self.pool._num_connections, 1)
+
+    def test_discarding_wakes_up_waiters(self):
+        def fail():
+            with self.pool.contextual_connection():
+                gevent.sleep(0.05)
+                raise ValueError('failed')
+
+        def wait():
+            with self.pool.contextual_connection(timeout=2) as conn:
+                return conn.execute('fast')
+
+        failing = gevent.spawn(fail)
+        waiting = gevent.spawn(wait)
+        gevent.joinall([failing, waiting], timeout=5)
+        self.assertIsInstance(failing.exception, ValueError)
+        self.assertEqual(waiting.value, 'fast')
+        self.assertEqual(self.pool._num_connections, 1)
+
+    def test_killed_sessions_arent_reused(self):
+        conn = self.pool.get()
+        self.server._sessions.clear()
+        with self.assertRaises(exceptions.RexProScriptException):
+            conn.execute('fast')
+        self.pool.put(conn)
+        self.assertEqual(self.pool._num_connections, 0)
+        self.assertEqual(self.pool.execute('fast'), 'fast')
+
+    def test_execute_replaces_killed_sessions(self):
+        self.assertEqual(self.pool.execute('fast'), 'fast')
+        self.server._sessions.clear()
+        self.assertEqual(self.pool.execute('fast'), 'fast')
@@ -0,0 +1,98 @@
+__author__ = 'bdeggleston'
+
+from socket import SHUT_RDWR
+import time
+from unittest import TestCase
+
+from rexpro import exceptions
+from rexpro.connection import RexProConnection, ThreadSafeRexProConnection
+from rexpro.metrics import Histogram, MetricsCollector, RequestEvent, prometheus_gauges
+from rexpro.server import StandInServer
+
+class TestHistogram(TestCase):
+
+    def test_percentiles(self):
+        histogram = Histogram(buckets=(1, 2, 3))
+        for value in [0.5] * 90 + [2.5] * 9 + [10]:
+            histogram.observe(value)
+        self.assertEqual(histogram.count, 100)
+        self.assertEqual(histogram.percentile(50), 1)
+        self.assertEqual(histogram.percentile(95), 3)
+        self.assertEqual(histogram.percentile(100), float('inf'))
+
+    def test_empty_percentile(self):
+        self.assertEqual(Histogram().percentile(99), 0.0)
+
+
+class TestMetricsCollector(TestCase):
+
+    def _event(self, total, error_type=None):
+        event = RequestEvent(started_at=0)
+        event.timings.update({'serialize': 0.0001, 'wait': total / 2, 'total': total})
+        event.bytes_sent = 100
+        event.bytes_received = 1000
+        event.error_type = error_type
+        return event
+
+    def test_aggregation(self):
+        collector = MetricsCollector()
+        collector.on_request(self._event(0.002))
+        collector.on_request(self._event(0.2, error_type='SCRIPT_FAILURE_ERROR'))
+
+        stats = collector.get_stats()
+        self.assertEqual(stats['requests'], 2)
+        self.assertEqual(stats['bytes_sent'], 200)
+        self.assertEqual(stats['bytes_received'], 2000)
+        self.assertEqual(stats['errors'], {'SCRIPT_FAILURE_ERROR': 1})
+        self.assertEqual(stats['phases']['total']['count'], 2)
+        self.assertEqual(stats['phases']['wait']['count'], 2)
+        self.assertEqual(stats['phases']['decode']['count'], 0)
+
+    def test_prometheus_text(self):
+        collector = MetricsCollector(buckets=(0.01, 1))
+        collector.on_request(self._event(0.002, error_type='SCRIPT_FAILURE_ERROR'))
+        text = collector.prometheus_text(labels={'graph': 'emptygraph'})
+
+        self.assertIn('rexpro_requests_total{graph="emptygraph"} 1\n', text)
+        self.assertIn('rexpro_errors_total{graph="emptygraph",type="SCRIPT_FAILURE_ERROR"} 1\n', text)
+        self.assertIn('rexpro_request_phase_seconds_bucket{graph="emptygraph",phase="total",le="0.01"} 1\n', text)
+        self.assertIn('rexpro_request_phase_seconds_bucket{graph="emptygraph",phase="total",le="+Inf"} 1\n', text)
+        self.assertIn('rexpro_request_phase_seconds_count{graph="emptygraph",phase="total"} 1\n', text)
+
+    def test_prometheus_gauges(self):
+        text = prometheus_gauges('rexpro_pool', {'idle': 2, 'utilization': 0.5, 'host': 'localhost'})
+        self.assertIn('rexpro_pool_idle 2\n', text)
+        self.assertIn('rexpro_pool_utilization 0.5\n', text)
+        self.assertNotIn('host', text)
+
+
+class TestConnectionMetrics(TestCase):
+
+    def setUp(self):
+        self.server = StandInServer().start()
+        self.server.set_response('slow', lambda request: time.sleep(0.2) or 'slow')
+        self.server.set_response('drop', self.drop)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def drop(self, request):
+        for client in list(self.server._clients):
+            client.shutdown(SHUT_RDWR)
+
+    def test_failed_requests_are_reported(self):
+        for conn_class in (RexProConnection, ThreadSafeRexProConnection):
+            collector = MetricsCollector()
+            conn = conn_class(self.server.host, self.server.port, 'emptygraph', listeners=[collector])
+            with self.assertRaises(exceptions.RexProConnectionException):
+                conn.execute('drop')
+            conn.close()
+
+            conn = conn_class(self.server.host, self.server.port, 'emptygraph', listeners=[collector])
+            with self.assertRaises(exceptions.RexProTimeoutException):
+                conn.execute('slow', timeout=0.05)
+            conn.close()
+
+            stats = collector.get_stats()
+            self.assertEqual(stats['requests'], 2)
+            self.assertEqual(stats['errors'], {'RexProConnectionException': 1, 'RexProTimeoutException': 1})
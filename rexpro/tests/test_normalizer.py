@@ -0,0 +1,85 @@
+__author__ = 'bdeggleston'
+
+from unittest import TestCase
+
+from rexpro.connection import RexProConnection
+from rexpro.normalizer import ScriptNormalizer
+from rexpro.procedures import StoredProcedures
+from rexpro.server import StandInServer
+
+class TestScriptNormalizer(TestCase):
+
+    def test_literals_are_hoisted(self):
+        normalizer = ScriptNormalizer()
+        script, params = normalizer.normalize("g.v(12).out('knows').has('name', \"bob\")[0..10]")
+        self.assertEqual(script, 'g.v(hoisted_0).out(hoisted_1).has(hoisted_2, hoisted_3)[hoisted_4..hoisted_5]')
+        self.assertEqual(params, {
+            'hoisted_0': 12,
+            'hoisted_1': 'knows',
+            'hoisted_2': 'name',
+            'hoisted_3': 'bob',
+            'hoisted_4': 0,
+            'hoisted_5': 10,
+        })
+
+    def test_existing_params_are_kept(self):
+        normalizer = ScriptNormalizer()
+        script, params = normalizer.normalize("g.v(eid).out('knows')", {'eid':5})
+        self.assertEqual(script, 'g.v(eid).out(hoisted_0)')
+        self.assertEqual(params, {'eid':5, 'hoisted_0':'knows'})
+
+    def test_unsafe_literals_are_left_alone(self):
+        normalizer = ScriptNormalizer()
+        scripts = [
+            "['a':b]",                      #map keys
+            "x ? 'a' : b",                  #ternaries
+            "v.'prop name'",                #property names
+            '"hello ${name}"',              #GStrings
+            "'''triple'''",
+            "1.5 + 10L + 0x1f + 017",       #decimals, suffixes, hex and octal
+            "x ==~ /\\d{3}/",               #slashy strings
+            "// 5\n/* 'x' */ y",            #comments
+            "a1 + b2",
+        ]
+        for script in scripts:
+            self.assertEqual(normalizer.normalize(script), (script, {}))
+
+    def test_hit_ratio(self):
+        normalizer = ScriptNormalizer()
+        for i in range(4):
+            normalizer.normalize('g.v({})'.format(i))
+        stats = normalizer.get_stats().values()
+        self.assertEqual(len(stats), 1)
+        self.assertEqual(stats[0]['hits'], 3)
+        self.assertEqual(stats[0]['misses'], 1)
+        self.assertEqual(normalizer.get_totals()['hit_ratio'], 0.75)
+
+
+class TestConnectionNormalization(TestCase):
+
+    def setUp(self):
+        self.server = StandInServer().start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_only_isolated_scripts_are_normalized(self):
+        echo_params = lambda request: request.params
+        self.server.set_response('g.v(hoisted_0)', echo_params)
+        self.server.set_response('x = 5', echo_params)
+
+        conn = RexProConnection(self.server.host, self.server.port, 'emptygraph', normalizer=ScriptNormalizer())
+        self.assertEqual(conn.execute('g.v(5)'), {'hoisted_0': 5})
+        self.assertEqual(conn.execute('x = 5', isolate=False), {})
+
+    def test_procedure_definitions_keep_their_literals(self):
+        procedures = StoredProcedures()
+        procedures.define('by_name', "g.V('name', n)", ['n'])
+        version, definition = procedures.definition_script()
+        received = []
+        self.server.set_response(definition, lambda request: received.append(request.params))
+
+        conn = RexProConnection(self.server.host, self.server.port, 'emptygraph', procedures=procedures,
+                                normalizer=ScriptNormalizer())
+        conn.call_procedure('by_name', {'n': 'bob'})
+        self.assertEqual(received, [{}])
@@ -0,0 +1,73 @@
+__author__ = 'bdeggleston'
+
+import random
+from threading import Thread
+import time
+from unittest import TestCase
+
+from rexpro import exceptions
+from rexpro.connection import RexProSessionPool, ERRORS_RETURN, ERRORS_SKIP
+from rexpro.server import StandInServer
+
+def echo(request):
+    time.sleep(random.random() * 0.002)
+    value = request.params['value']
+    if value % 5 == 3:
+        raise ValueError('bad value')
+    return value
+
+class TestExecuteParallel(TestCase):
+
+    def setUp(self):
+        self.server = StandInServer(responses={'echo': echo}).start()
+        self.pool = RexProSessionPool(self.server.host, self.server.port, 'emptygraph', 0, max_size=4)
+
+    def tearDown(self):
+        self.pool.close_all()
+        self.server.stop()
+
+    def params(self, n):
+        return ({'value': i} for i in range(n))
+
+    def test_ordered_results(self):
+        results = list(self.pool.execute_parallel('echo', self.params(50), errors=ERRORS_SKIP))
+        self.assertEqual(results, [i for i in range(50) if i % 5 != 3])
+
+    def test_unordered_results(self):
+        results = list(self.pool.execute_parallel('echo', self.params(20), ordered=False, errors=ERRORS_RETURN))
+        self.assertEqual(sorted(index for index, value in results), range(20))
+        for index, value in results:
+            if index % 5 == 3:
+                self.assertIsInstance(value, exceptions.RexProScriptException)
+            else:
+                self.assertEqual(value, index)
+
+    def test_errors_raise(self):
+        with self.assertRaises(exceptions.RexProScriptException):
+            list(self.pool.execute_parallel('echo', self.params(20)))
+
+    def test_concurrency_above_max_size(self):
+        results = []
+        def run():
+            results.extend(self.pool.execute_parallel('echo', self.params(20), concurrency=8, errors=ERRORS_SKIP))
+
+        #workers waiting on sessions held by other workers would never finish
+        thread = Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        thread.join(5)
+        self.assertEqual(results, [i for i in range(20) if i % 5 != 3])
+        self.assertEqual(self.pool.get_stats()['in_use'], 0)
+
+    def test_input_is_read_lazily(self):
+        read = []
+
+        def params():
+            for i in range(10 ** 6):
+                read.append(i)
+                yield {'value': i}
+
+        results = self.pool.execute_parallel('echo', params(), concurrency=2, buffer_size=8, errors=ERRORS_SKIP)
+        self.assertEqual([next(results) for i in range(3)], [0, 1, 2])
+        self.assertTrue(len(read) <= 8 + 4)
+        results.close()
@@ -0,0 +1,174 @@
+__author__ = 'bdeggleston'
+
+from array import array
+import pickle
+from unittest import TestCase, skipIf
+
+import msgpack
+
+from rexpro import messages
+from rexpro.cache import ResultCache
+from rexpro.connection import RexProConnection, ThreadSafeRexProConnection
+from rexpro.results import ColumnarFactory, ElementFactory, Vertex, Edge, numpy
+from rexpro.server import StandInServer, make_results
+
+def _edge(i):
+    return {'_id': 'e{}'.format(i), '_type': 'edge', '_label': 'knows', '_outV': i, '_inV': i + 1,
+            '_properties': {'weight': 0.5}}
+
+class TestElementFactory(TestCase):
+
+    def setUp(self):
+        self.factory = ElementFactory()
+
+    def test_vertices_and_edges(self):
+        results = self.factory.loads(msgpack.dumps([make_results(1)[0], _edge(1), {'other': 1}]))
+        vertex, edge, other = results
+
+        self.assertIsInstance(vertex, Vertex)
+        self.assertEqual(vertex.id, 0)
+        self.assertEqual(vertex['_type'], 'vertex')
+        self.assertEqual(vertex['_properties'], vertex.properties)
+        self.assertEqual(vertex.to_dict(), make_results(1)[0])
+        self.assertEqual(vertex, make_results(1)[0])
+
+        self.assertIsInstance(edge, Edge)
+        self.assertEqual((edge.label, edge.out_v, edge.in_v), ('knows', 1, 2))
+        self.assertEqual(edge['_label'], 'knows')
+        self.assertEqual(edge['weight'], 0.5)
+        self.assertEqual(edge, _edge(1))
+
+        self.assertEqual(other, {'other': 1})
+
+    def test_slots(self):
+        vertex = Vertex(1, {})
+        with self.assertRaises(AttributeError):
+            vertex.__dict__
+        self.assertEqual(pickle.loads(pickle.dumps(vertex, 2)), vertex)
+
+    def test_values_are_interned(self):
+        data = msgpack.dumps([_edge(1), _edge(2)])
+        first, second = self.factory.loads(data)
+        self.assertIs(first.label, second.label)
+        self.assertIs(first.properties.keys()[0], second.properties.keys()[0])
+
+    def test_response_deserialization(self):
+        payload = messages.MsgPackScriptResponse(
+            results=make_results(3),
+            bindings={},
+            request_id='1' * 16
+        ).get_payload()
+        self.assertEqual(messages.RexProMessage.peek_request_id(payload), '1' * 16)
+
+        response = messages.MsgPackScriptResponse.deserialize(payload, result_factory=self.factory)
+        self.assertTrue(all(isinstance(v, Vertex) for v in response.results))
+        self.assertEqual(list(response.results), make_results(3))
+
+
+def _response(results):
+    return messages.MsgPackScriptResponse(results=results, bindings={'b': 1}, request_id='1' * 16).get_payload()
+
+class TestColumnarFactory(TestCase):
+
+    def setUp(self):
+        self.factory = ColumnarFactory(use_numpy=False)
+
+    def deserialize(self, results, factory=None):
+        return messages.MsgPackScriptResponse.deserialize(_response(results), result_factory=factory or self.factory)
+
+    def test_numbers(self):
+        ints = self.deserialize([1, 2, 3 ** 30]).results
+        self.assertEqual(ints, array('l', [1, 2, 3 ** 30]))
+
+        floats = self.deserialize([1, 2.5]).results
+        self.assertEqual(floats, array('d', [1.0, 2.5]))
+
+        self.assertEqual(self.deserialize([]).results, array('d'))
+        self.assertEqual(self.deserialize([1], ColumnarFactory(typecode='d', use_numpy=False)).results, array('d', [1]))
+
+    def test_uniform_maps(self):
+        results = self.deserialize([{'name': 'a', 'age': 1}, {'name': 'b', 'age': 2}]).results
+        self.assertEqual(results, {'name': ['a', 'b'], 'age': array('l', [1, 2])})
+
+    def test_other_results_are_left_alone(self):
+        self.assertEqual(self.deserialize([{'a': 1}, {'b': 2}]).results, ({'a': 1}, {'b': 2}))
+        self.assertEqual(self.deserialize([1, 'a']).results, (1, 'a'))
+        self.assertEqual(self.deserialize([2 ** 63]).results, (2 ** 63,))
+        self.assertEqual(self.deserialize('scalar').results, 'scalar')
+
+    @skipIf(numpy is None, 'numpy is not installed')
+    def test_numpy_doubles(self):
+        factory = ColumnarFactory(use_numpy=True)
+        response = self.deserialize([0.5 * i for i in range(1000)], factory)
+        self.assertIsInstance(response.results, numpy.ndarray)
+        self.assertEqual(response.results.tolist(), [0.5 * i for i in range(1000)])
+        self.assertEqual(response.request_id, '1' * 16)
+        self.assertEqual(response.bindings, {'b': 1})
+
+        mixed = self.deserialize([0.5, 1, 2.5], factory).results
+        self.assertEqual(mixed.tolist(), [0.5, 1.0, 2.5])
+
+    @skipIf(numpy is None, 'numpy is not installed')
+    def test_numpy_columns(self):
+        results = self.deserialize([{'id': 1, 'score': 0.5}, {'id': 2, 'score': 1.5}], ColumnarFactory()).results
+        self.assertEqual(results['id'].tolist(), [1, 2])
+        self.assertEqual(results['score'].dtype, numpy.dtype('d'))
+
+
+class TestConnectionResultFactory(TestCase):
+
+    def setUp(self):
+        self.server = StandInServer(result_size=5).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_connection_default(self):
+        conn = RexProConnection(self.server.host, self.server.port, 'emptygraph', result_factory=ElementFactory())
+        try:
+            results = conn.execute('g.V')
+            self.assertTrue(all(isinstance(v, Vertex) for v in results))
+            self.assertTrue(all(isinstance(v, Vertex) for v in conn.execute_iter('g.V')))
+        finally:
+            conn.close()
+
+    def test_per_request(self):
+        conn = RexProConnection(self.server.host, self.server.port, 'emptygraph')
+        try:
+            factory = ElementFactory()
+            plain = conn.execute_pipelined('g.V')
+            compact = conn.execute_pipelined('g.V', result_factory=factory)
+            self.assertIsInstance(plain.result()[0], dict)
+            self.assertIsInstance(compact.result()[0], Vertex)
+            self.assertIsInstance(conn.execute('g.V')[0], dict)
+        finally:
+            conn.close()
+
+    def test_thread_safe_connection(self):
+        conn = ThreadSafeRexProConnection(self.server.host, self.server.port, 'emptygraph')
+        try:
+            futures = [conn.execute_async('g.V', result_factory=ElementFactory() if i % 2 else None) for i in range(6)]
+            for i, future in enumerate(futures):
+                self.assertIsInstance(future.result(timeout=5)[0], Vertex if i % 2 else dict)
+        finally:
+            conn.close()
+
+    def test_cached_results_are_kept_per_factory(self):
+        conn = RexProConnection(self.server.host, self.server.port, 'emptygraph', cache=ResultCache())
+        try:
+            factory = ElementFactory()
+            self.assertIsInstance(conn.execute('g.V', cached=True)[0], dict)
+            self.assertIsInstance(conn.execute('g.V', cached=True, result_factory=factory)[0], Vertex)
+            self.assertIsInstance(conn.execute('g.V', cached=True, result_factory=factory)[0], Vertex)
+            self.assertEqual(conn.cache.get_stats()['hits'], 1)
+        finally:
+            conn.close()
+
+    def test_columnar_execute(self):
+        self.server.set_response('degrees', [3, 1, 2])
+        conn = RexProConnection(self.server.host, self.server.port, 'emptygraph')
+        try:
+            degrees = conn.execute('degrees', result_factory=ColumnarFactory(use_numpy=False))
+            self.assertEqual(degrees, array('l', [3, 1, 2]))
+        finally:
+            conn.close()
@@ -0,0 +1,224 @@
+__author__ = 'bdeggleston'
+
+from socket import SHUT_RDWR
+import time
+from unittest import TestCase
+
+from rexpro import exceptions
+from rexpro.cluster import RexProCluster
+from rexpro.connection import RexProConnection, RexProSessionPool, ThreadSafeRexProConnection
+from rexpro.messages import ErrorResponse
+from rexpro.procedures import StoredProcedures
+from rexpro.retry import HedgePolicy, RetryPolicy
+from rexpro.server import StandInServer
+
+def script_error(flag):
+    return exceptions.RexProScriptException('failed', meta={'flag': flag})
+
+class TestRetryPolicy(TestCase):
+
+    def test_should_retry(self):
+        policy = RetryPolicy(idempotent_flags=(ErrorResponse.SCRIPT_FAILURE_ERROR,))
+        self.assertTrue(policy.should_retry(script_error(ErrorResponse.INVALID_SESSION_ERROR)))
+        self.assertFalse(policy.should_retry(script_error(ErrorResponse.SCRIPT_FAILURE_ERROR)))
+        self.assertTrue(policy.should_retry(script_error(ErrorResponse.SCRIPT_FAILURE_ERROR), idempotent=True))
+        self.assertFalse(policy.should_retry(script_error(ErrorResponse.AUTH_FAILURE_ERROR), idempotent=True))
+
+        connection_error = exceptions.RexProConnectionException('closed')
+        self.assertFalse(policy.should_retry(connection_error))
+        self.assertTrue(policy.should_retry(connection_error, idempotent=True))
+        self.assertFalse(RetryPolicy(connection_errors=False).should_retry(connection_error, idempotent=True))
+        self.assertFalse(policy.should_retry(ValueError(), idempotent=True))
+
+    def test_backoff(self):
+        policy = RetryPolicy(backoff=0.1, max_backoff=0.3, jitter=0)
+        self.assertEqual([policy.backoff_for(attempt) for attempt in range(1, 5)], [0.1, 0.2, 0.3, 0.3])
+
+    def test_call(self):
+        calls = []
+        def flaky():
+            calls.append(1)
+            if len(calls) < 3:
+                raise script_error(ErrorResponse.INVALID_SESSION_ERROR)
+            return 'done'
+
+        self.assertEqual(RetryPolicy(backoff=0).call(flaky), 'done')
+        self.assertEqual(len(calls), 3)
+
+        del calls[:]
+        with self.assertRaises(exceptions.RexProScriptException):
+            RetryPolicy(max_attempts=2, backoff=0).call(flaky)
+        self.assertEqual(len(calls), 2)
+
+        #there's no time left for the backoff
+        del calls[:]
+        with self.assertRaises(exceptions.RexProScriptException):
+            RetryPolicy(backoff=1).call(flaky, deadline=time.time() + 0.5)
+        self.assertEqual(len(calls), 1)
+
+
+class TestHedgePolicy(TestCase):
+
+    def test_delay(self):
+        policy = HedgePolicy(min_samples=10, max_delay=0.02)
+        self.assertIsNone(policy.delay())
+        for i in range(10):
+            policy.observe(0.004)
+        self.assertEqual(policy.delay(), 0.005)
+
+        policy.observe(5.0, hedged=True, hedge_won=True)
+        self.assertEqual(policy.get_stats(), {'requests': 11, 'hedged': 1, 'hedges_won': 1, 'delay': 0.02})
+
+        self.assertEqual(HedgePolicy(delay=0.1).delay(), 0.1)
+
+
+class TestConnectionRetries(TestCase):
+
+    def setUp(self):
+        self.server = StandInServer().start()
+        self.server.set_response('fast', 'fast')
+        self.calls = 0
+
+    def tearDown(self):
+        self.server.stop()
+
+    def drop_first_call(self, request):
+        """ disconnects every client the first time it's called """
+        self.calls += 1
+        if self.calls == 1:
+            for client in list(self.server._clients):
+                client.shutdown(SHUT_RDWR)
+        return 'dropped once'
+
+    def test_invalid_sessions_are_retried(self):
+        conn = RexProConnection(self.server.host, self.server.port, 'emptygraph')
+        self.server._sessions.clear()
+        with self.assertRaises(exceptions.RexProScriptException) as context:
+            conn.execute('fast')
+        self.assertEqual(context.exception.flag, ErrorResponse.INVALID_SESSION_ERROR)
+
+        conn = RexProConnection(self.server.host, self.server.port, 'emptygraph', retry_policy=RetryPolicy(backoff=0))
+        self.server._sessions.clear()
+        self.assertEqual(conn.execute('fast'), 'fast')
+
+    def test_idempotent_requests_reconnect(self):
+        self.server.set_response('drop', self.drop_first_call)
+        conn = RexProConnection(self.server.host, self.server.port, 'emptygraph', retry_policy=RetryPolicy(backoff=0))
+        with self.assertRaises(exceptions.RexProConnectionException):
+            conn.execute('drop')
+
+        #the connection is reconnected when it's next used
+        self.calls = 0
+        self.assertEqual(conn.execute('drop', idempotent=True), 'dropped once')
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(conn.execute('fast'), 'fast')
+
+    def test_procedures_are_redefined_on_new_sessions(self):
+        procedures = StoredProcedures()
+        procedures.define('double', 'x * 2', ['x'])
+        version, definition = procedures.definition_script()
+        call_script, call_params = procedures.call_request('double', {'x': 2})
+        definitions = []
+        self.server.set_response(definition, lambda request: definitions.append(request.session))
+        self.server.set_response(call_script, 4)
+
+        for conn_class in (RexProConnection, ThreadSafeRexProConnection):
+            del definitions[:]
+            conn = conn_class(self.server.host, self.server.port, 'emptygraph', procedures=procedures,
+                              retry_policy=RetryPolicy(backoff=0))
+            try:
+                self.assertEqual(conn.call_procedure('double', {'x': 2}), 4)
+                self.server._sessions.clear()
+                self.assertEqual(conn.call_procedure('double', {'x': 2}), 4)
+                self.assertEqual(len(definitions), 2)
+                self.assertEqual(definitions[-1], conn._session_key)
+            finally:
+                conn.close()
+
+    def test_transactions_arent_retried(self):
+        conn = RexProConnection(self.server.host, self.server.port, 'emptygraph', retry_policy=RetryPolicy(backoff=0))
+        conn.open_transaction()
+        self.server._sessions.clear()
+        with self.assertRaises(exceptions.RexProScriptException):
+            conn.execute('fast', read_only=True)
+
+    def test_thread_safe_connection_reconnects(self):
+        self.server.set_response('drop', self.drop_first_call)
+        conn = ThreadSafeRexProConnection(self.server.host, self.server.port, 'emptygraph',
+                                          retry_policy=RetryPolicy(backoff=0))
+        try:
+            self.assertEqual(conn.execute('drop', read_only=True), 'dropped once')
+            self.assertEqual(conn.execute_async('fast').result(timeout=5), 'fast')
+        finally:
+            conn.close()
+
+    def test_pool_retries_on_another_session(self):
+        self.server.set_response('drop', self.drop_first_call)
+        pool = RexProSessionPool(self.server.host, self.server.port, 'emptygraph', 1, retry_policy=RetryPolicy(backoff=0))
+        self.assertEqual(pool.execute('drop', idempotent=True), 'dropped once')
+        self.assertEqual(pool.get_stats()['discarded'], 1)
+        pool.close_all()
+
+
+def slow_first_call(delay):
+    """ a response that takes delay seconds the first time it's asked for """
+    calls = []
+    def respond(request):
+        calls.append(1)
+        if len(calls) == 1:
+            time.sleep(delay)
+        return len(calls)
+    return respond
+
+class TestHedgedReads(TestCase):
+
+    def setUp(self):
+        self.servers = [StandInServer().start(), StandInServer().start()]
+
+    def tearDown(self):
+        for server in self.servers:
+            server.stop()
+
+    def test_pool_hedges_read_only_requests(self):
+        self.servers[0].set_response('read', slow_first_call(0.3))
+        policy = HedgePolicy(delay=0.02)
+        pool = RexProSessionPool(self.servers[0].host, self.servers[0].port, 'emptygraph', 2, hedge_policy=policy)
+
+        started_at = time.time()
+        self.assertEqual(pool.execute('read', read_only=True), 2)
+        self.assertLess(time.time() - started_at, 0.2)
+        self.assertEqual(policy.get_stats()['hedges_won'], 1)
+
+        #the slower session is returned once its response has been read
+        time.sleep(0.4)
+        self.assertEqual(pool.get_stats()['idle'], 2)
+        self.assertEqual(pool.get_stats()['discarded'], 0)
+
+        #requests that aren't read only aren't hedged
+        self.assertEqual(pool.execute('read'), 3)
+        self.assertEqual(policy.get_stats()['hedged'], 1)
+        pool.close_all()
+
+    def test_pool_without_a_free_session_doesnt_hedge(self):
+        self.servers[0].set_response('read', slow_first_call(0.1))
+        policy = HedgePolicy(delay=0.02)
+        pool = RexProSessionPool(self.servers[0].host, self.servers[0].port, 'emptygraph', 1, hedge_policy=policy)
+        self.assertEqual(pool.execute('read', read_only=True), 1)
+        self.assertEqual(policy.get_stats()['hedged'], 0)
+        pool.close_all()
+
+    def test_cluster_hedges_on_another_host(self):
+        self.servers[0].set_response('read', lambda request: time.sleep(0.3) or 'slow')
+        self.servers[1].set_response('read', 'fast')
+        policy = HedgePolicy(delay=0.02)
+        cluster = RexProCluster([s.address for s in self.servers], 'emptygraph', hedge_policy=policy)
+
+        for i in range(4):
+            started_at = time.time()
+            self.assertEqual(cluster.execute('read', read_only=True), 'fast')
+            self.assertLess(time.time() - started_at, 0.2)
+
+        stats = policy.get_stats()
+        self.assertEqual(stats['hedged'], stats['hedges_won'])
+        self.assertTrue(all(host['up'] for host in cluster.get_stats().values()))
+        cluster.close_all()
@@ -0,0 +1,92 @@
+__author__ = 'bdeggleston'
+
+from unittest import TestCase
+
+from rexpro import exceptions, groovy
+from rexpro.bench import run_benchmark
+from rexpro.connection import RexProConnection, RexProSessionPool
+from rexpro.messages import ErrorResponse
+from rexpro.procedures import StoredProcedures
+from rexpro.server import StandInServer
+
+class TestStandInServer(TestCase):
+
+    def setUp(self):
+        self.server = StandInServer(graphs=['emptygraph'], result_size=3).start()
+        self.host, self.port = self.server.address
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_default_results(self):
+        conn = RexProConnection(self.host, self.port, 'emptygraph')
+        results = conn.execute('g.V')
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[0]['_type'], 'vertex')
+        conn.close()
+
+    def test_scripted_responses(self):
+        self.server.set_response('echo', lambda request: request.params['value'])
+        self.server.set_response('fail', ValueError('boom'))
+        conn = RexProConnection(self.host, self.port, 'emptygraph')
+        self.assertEqual(conn.execute('echo', {'value': 'hello'}), 'hello')
+        with self.assertRaises(exceptions.RexProScriptException) as cm:
+            conn.execute('fail')
+        self.assertIn('boom', str(cm.exception))
+        self.assertEqual(self.server.requests_served, 2)
+
+    def test_execute_many_falls_back_on_chunks_that_didnt_compile(self):
+        chunk = [('ok', {}), ('broken', {})]
+        self.server.set_response('ok', 'ok')
+        self.server.set_response('broken', ValueError('unexpected token'))
+        self.server.set_response(groovy.batch_script(chunk)[0], ValueError('unexpected token'))
+        conn = RexProConnection(self.host, self.port, 'emptygraph')
+        results = conn.execute_many(['ok', 'broken'])
+        self.assertEqual(results[0], 'ok')
+        self.assertIsInstance(results[1], exceptions.RexProScriptException)
+        self.assertEqual(self.server.requests_served, 3)
+
+        #the scripts ran before their results failed to serialize, so they aren't run again
+        flag = ErrorResponse.RESULT_SERIALIZATION_ERROR
+        self.server.set_response(groovy.batch_script(chunk)[0], exceptions.RexProScriptException('failed', meta={'flag': flag}))
+        results = conn.execute_many(['ok', 'broken'])
+        self.assertEqual([r.flag for r in results], [flag] * 2)
+        self.assertEqual(self.server.requests_served, 4)
+        conn.close()
+
+    def test_replaced_procedures_are_defined(self):
+        definitions = []
+        conn = RexProConnection(self.host, self.port, 'emptygraph')
+        for body in ('x * 2', 'x * 3'):
+            procedures = StoredProcedures()
+            procedures.define('scale', body, ['x'])
+            self.server.set_response(procedures.definition_script()[1], lambda request: definitions.append(request))
+
+            #both registries are at the same version
+            conn.procedures = procedures
+            conn.call_procedure('scale', {'x': 2})
+        self.assertEqual(len(definitions), 2)
+        conn.close()
+
+    def test_unknown_graph(self):
+        with self.assertRaises(exceptions.RexProConnectionException):
+            RexProConnection(self.host, self.port, 'not_a_real_graph')
+
+    def test_killed_sessions_are_invalid(self):
+        conn = RexProConnection(self.host, self.port, 'emptygraph')
+        session_key = conn._session_key
+        conn.close()
+        conn._session_key = session_key
+        with self.assertRaises(exceptions.RexProScriptException):
+            conn.execute('g.V')
+
+    def test_pool(self):
+        pool = RexProSessionPool(self.host, self.port, 'emptygraph', 2)
+        self.assertEqual(len(pool.execute('g.V')), 3)
+        pool.close_all()
+
+    def test_benchmark(self):
+        results = run_benchmark(self.host, self.port, mode='pool', concurrency=2, requests=20)
+        self.assertEqual(results['requests'], 20)
+        self.assertEqual(results['errors'], 0)
+        self.assertTrue(results['p50'] <= results['p99'])
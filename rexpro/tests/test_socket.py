@@ -0,0 +1,51 @@
+__author__ = 'bdeggleston'
+
+from socket import socket
+from threading import Thread
+from unittest import TestCase
+
+from rexpro.connection import RexProSocket
+
+def connected_pair():
+    """ returns a RexProSocket, and the plain socket on the other end of it """
+    listener = socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    sock = RexProSocket()
+    sock.connect(listener.getsockname())
+    other, address = listener.accept()
+    listener.close()
+    return sock, other
+
+class TestRexProSocket(TestCase):
+
+    def setUp(self):
+        self.sock, self.other = connected_pair()
+
+    def tearDown(self):
+        self.sock.close()
+        self.other.close()
+
+    def send(self, data):
+        sender = Thread(target=self.other.sendall, args=(data,))
+        sender.start()
+        return sender
+
+    def test_small_bodies_use_the_receive_buffer(self):
+        body = 'x' * (RexProSocket.DEFAULT_BUFFER_SIZE * 2)
+        self.send(body).join()
+        self.assertEqual(str(self.sock.read_body(len(body))), body)
+        self.assertEqual(len(self.sock._buffer), RexProSocket.DEFAULT_BUFFER_SIZE * 2)
+
+    def test_oversized_bodies_get_their_own_buffer(self):
+        body = ''.join(chr(i % 256) for i in range(RexProSocket.MAX_BUFFER_SIZE + 1))
+        sender = self.send(body)
+        received = self.sock.read_body(len(body))
+        sender.join()
+        self.assertEqual(str(received), body)
+        self.assertEqual(len(self.sock._buffer), RexProSocket.DEFAULT_BUFFER_SIZE)
+
+        #the body isn't overwritten by the next read
+        self.send('next').join()
+        self.sock.read_body(4)
+        self.assertEqual(str(received), body)
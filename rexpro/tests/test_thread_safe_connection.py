@@ -0,0 +1,58 @@
+__author__ = 'bdeggleston'
+
+from threading import Thread
+from unittest import TestCase
+
+from rexpro import exceptions
+from rexpro.connection import ThreadSafeRexProConnection
+from rexpro.server import StandInServer
+
+class TestThreadSafeConnection(TestCase):
+
+    def setUp(self):
+        self.server = StandInServer().start()
+        self.server.set_response('echo', lambda request: request.params['value'])
+        self.server.set_response('fail', ValueError('boom'))
+        self.conn = ThreadSafeRexProConnection(self.server.host, self.server.port, 'emptygraph', max_in_flight=4)
+
+    def tearDown(self):
+        self.conn.close()
+        self.server.stop()
+
+    def test_concurrent_execute(self):
+        mismatches = []
+
+        def worker(n):
+            for i in range(50):
+                value = '{}-{}'.format(n, i)
+                result = self.conn.execute('echo', {'value': value})
+                if result != value:
+                    mismatches.append((value, result))
+
+        threads = [Thread(target=worker, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(mismatches, [])
+
+    def test_execute_async(self):
+        futures = [self.conn.execute_async('echo', {'value': i}) for i in range(10)]
+        self.assertEqual([f.result(timeout=5) for f in futures], range(10))
+
+        failed = self.conn.execute_async('fail')
+        self.assertIsInstance(failed.exception(timeout=5), exceptions.RexProScriptException)
+
+        callback_results = []
+        future = self.conn.execute_async('echo', {'value': 'done'})
+        future.result(timeout=5)
+        future.add_done_callback(lambda f: callback_results.append(f.result()))
+        self.assertEqual(callback_results, ['done'])
+
+    def test_pending_requests_fail_when_the_server_goes_away(self):
+        self.server.latency = 0.1
+        future = self.conn.execute_async('echo', {'value': 1})
+        self.server.stop()
+        self.assertIsInstance(future.exception(timeout=5), exceptions.RexProConnectionException)
+        with self.assertRaises(exceptions.RexProConnectionException):
+            self.conn.execute('echo', {'value': 1})
@@ -0,0 +1,135 @@
+__author__ = 'bdeggleston'
+
+from socket import socket
+import time
+from unittest import TestCase
+
+from rexpro import exceptions, groovy
+from rexpro.cluster import RexProCluster
+from rexpro.connection import RexProConnection, RexProSessionPool, ThreadSafeRexProConnection
+from rexpro.server import StandInServer
+
+class TestConnectionTimeouts(TestCase):
+
+    def setUp(self):
+        self.server = StandInServer().start()
+        self.server.set_response('slow', lambda request: time.sleep(0.3) or 'slow')
+        self.server.set_response('fast', 'fast')
+
+    def tearDown(self):
+        self.server.stop()
+
+    def connect(self, **kwargs):
+        return RexProConnection(self.server.host, self.server.port, 'emptygraph', **kwargs)
+
+    def test_execute_timeout(self):
+        conn = self.connect()
+        self.assertEqual(conn.execute('slow', timeout=1), 'slow')
+
+        started_at = time.time()
+        with self.assertRaises(exceptions.RexProTimeoutException):
+            conn.execute('slow', timeout=0.05)
+        self.assertLess(time.time() - started_at, 0.25)
+
+        #the response is still on its way, so the connection can't be used anymore
+        with self.assertRaises(exceptions.RexProConnectionException):
+            conn.execute('fast')
+        conn.close()
+
+    def test_read_and_request_timeouts(self):
+        conn = self.connect(read_timeout=0.05)
+        with self.assertRaises(exceptions.RexProTimeoutException):
+            conn.execute('slow')
+
+        conn = self.connect(request_timeout=0.05)
+        self.assertEqual(conn.execute('fast'), 'fast')
+        with self.assertRaises(exceptions.RexProTimeoutException):
+            conn.execute('slow')
+
+    def test_pipelined_requests_fail_with_the_one_that_timed_out(self):
+        conn = self.connect()
+        slow = conn.execute_pipelined('slow', timeout=0.05)
+        fast = conn.execute_pipelined('fast')
+        with self.assertRaises(exceptions.RexProTimeoutException):
+            slow.result()
+        self.assertTrue(fast.done())
+        with self.assertRaises(exceptions.RexProTimeoutException):
+            fast.result()
+
+    def test_execute_many_deadline(self):
+        #execute_many sends each chunk as a batch script, which answers with (succeeded, value) pairs
+        slow_batch, _ = groovy.batch_script([('slow', {})])
+        fast_batch, _ = groovy.batch_script([('fast', {})])
+        self.server.set_response(slow_batch, lambda request: time.sleep(0.3) or [(True, 'slow')])
+        self.server.set_response(fast_batch, [(True, 'fast')])
+
+        conn = self.connect()
+        self.assertEqual(conn.execute_many(['fast', 'slow'], chunk_size=1, timeout=1), ['fast', 'slow'])
+
+        started_at = time.time()
+        with self.assertRaises(exceptions.RexProTimeoutException):
+            conn.execute_many(['fast', 'slow', 'fast'], chunk_size=1, timeout=0.05)
+        self.assertLess(time.time() - started_at, 0.25)
+
+    def test_connect_timeout(self):
+        #a socket that accepts connections, but never answers the session request
+        listener = socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        try:
+            started_at = time.time()
+            with self.assertRaises(exceptions.RexProConnectionException) as context:
+                RexProConnection('127.0.0.1', listener.getsockname()[1], 'emptygraph', connect_timeout=0.05)
+            self.assertNotIsInstance(context.exception, exceptions.RexProTimeoutException)
+            self.assertLess(time.time() - started_at, 0.25)
+        finally:
+            listener.close()
+
+    def test_thread_safe_connection_stays_usable(self):
+        conn = ThreadSafeRexProConnection(self.server.host, self.server.port, 'emptygraph')
+        try:
+            with self.assertRaises(exceptions.RexProTimeoutException):
+                conn.execute('slow', timeout=0.05)
+            self.assertEqual(conn.execute('fast', timeout=1), 'fast')
+        finally:
+            conn.close()
+
+
+class TestPoolTimeouts(TestCase):
+
+    def setUp(self):
+        self.server = StandInServer().start()
+        self.server.set_response('slow', lambda request: time.sleep(0.3) or 'slow')
+        self.server.set_response('fast', 'fast')
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_timed_out_connections_are_discarded(self):
+        pool = RexProSessionPool(self.server.host, self.server.port, 'emptygraph', 1, request_timeout=0.05)
+        with self.assertRaises(exceptions.RexProTimeoutException):
+            pool.execute('slow')
+        self.assertEqual(pool.get_stats()['discarded'], 1)
+        self.assertEqual(pool.execute('fast'), 'fast')
+        self.assertEqual(pool.execute('slow', timeout=1), 'slow')
+        pool.close_all()
+
+    def test_timeout_covers_checkout(self):
+        pool = RexProSessionPool(self.server.host, self.server.port, 'emptygraph', 1)
+        conn = pool.get()
+        started_at = time.time()
+        with self.assertRaises(exceptions.RexProTimeoutException):
+            pool.execute('fast', timeout=0.05)
+        self.assertLess(time.time() - started_at, 0.25)
+        pool.put(conn)
+        pool.close_all()
+
+    def test_cluster_timeouts_dont_mark_hosts_down(self):
+        cluster = RexProCluster([self.server.address], 'emptygraph', pool_size=1)
+        with self.assertRaises(exceptions.RexProTimeoutException):
+            cluster.execute('slow', timeout=0.05)
+        stats = cluster.get_stats().values()[0]
+        self.assertTrue(stats['up'])
+        self.assertEqual(stats['discarded'], 1)
+        self.assertEqual(cluster.execute('fast'), 'fast')
+        cluster.close_all()
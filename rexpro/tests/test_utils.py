@@ -0,0 +1,38 @@
+__author__ = 'bdeggleston'
+
+from unittest import TestCase
+
+import msgpack
+
+from rexpro import utils
+
+class TestMsgPackHeaders(TestCase):
+
+    def test_skipping_objects(self):
+        """ Tests that msgpack_skip finds the end of every kind of msgpack object """
+        values = [
+            None, True, False, 5, -5, 300, -300, 2**40, -2**40, 1.5,
+            'abc', 'x' * 300, 'x' * 70000,
+            [1, 2, 3], range(300), range(70000),
+            {'a': 1}, dict((str(i), i) for i in range(300)),
+            {'nested': [{'a': ['b', {'c': None}]}]},
+        ]
+        for value in values:
+            data = bytearray(msgpack.dumps(value) + 'trailing')
+            assert utils.msgpack_skip(data) == len(data) - len('trailing')
+
+    def test_skipping_incomplete_data_raises_index_error(self):
+        data = bytearray(msgpack.dumps({'a': range(100)}))
+        with self.assertRaises(IndexError):
+            utils.msgpack_skip(data[:-1])
+
+    def test_array_header(self):
+        for length in [0, 10, 300, 70000]:
+            data = bytearray(msgpack.dumps(range(length)))
+            num_items, offset = utils.msgpack_array_header(data)
+            assert num_items == length
+            assert offset == len(data) - sum(len(msgpack.dumps(i)) for i in range(length))
+
+    def test_array_header_of_non_array(self):
+        data = bytearray(msgpack.dumps({'a': 1}))
+        assert utils.msgpack_array_header(data) == (None, 0)
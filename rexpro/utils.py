@@ -1,5 +1,11 @@
 __author__ = 'bdeggleston'
 
+import os
+import struct
+import time
+
+from rexpro import exceptions
+
 
 def int_to_32bit_array(val):
     """
@@ -26,3 +32,131 @@ def int_from_32bit_array(val):
         rval |= fragment
     return rval
 
+
+#msgpack type bytes followed by a fixed size value
+_MSGPACK_FIXED_SIZES = {
+    0xca: 4, 0xcb: 8,                       #float 32, float 64
+    0xcc: 1, 0xcd: 2, 0xce: 4, 0xcf: 8,     #uint 8 - 64
+    0xd0: 1, 0xd1: 2, 0xd2: 4, 0xd3: 8,     #int 8 - 64
+    0xd4: 2, 0xd5: 3, 0xd6: 5, 0xd7: 9, 0xd8: 17,   #fixext 1 - 16, including the type byte
+}
+
+#msgpack type bytes followed by a length, mapped to (length format, extra bytes after the length)
+_MSGPACK_SIZED = {
+    0xc4: ('!B', 0), 0xc5: ('!H', 0), 0xc6: ('!I', 0),    #bin 8 - 32
+    0xc7: ('!B', 1), 0xc8: ('!H', 1), 0xc9: ('!I', 1),    #ext 8 - 32
+    0xd9: ('!B', 0), 0xda: ('!H', 0), 0xdb: ('!I', 0),    #raw/str 8 - 32
+}
+
+#msgpack container type bytes mapped to (length format, objects per entry)
+_MSGPACK_CONTAINERS = {
+    0xdc: ('!H', 1), 0xdd: ('!I', 1),   #array 16, 32
+    0xde: ('!H', 2), 0xdf: ('!I', 2),   #map 16, 32
+}
+
+def _unpack_length(fmt, data, offset):
+    """
+    Unpacks a big endian length from data, raising IndexError if data is too short
+    """
+    try:
+        return struct.unpack_from(fmt, data, offset)[0]
+    except struct.error:
+        raise IndexError('incomplete msgpack data')
+
+def msgpack_array_header(data, offset=0):
+    """
+    Reads a msgpack array header without decoding the array contents
+    :param data: the msgpack data
+    :type data: bytearray
+    :param offset: the position of the header in data
+    :type offset: int
+    :return: tuple of (number of array items, offset of the first item), the number of items is None if the object at offset isn't an array
+    :raises IndexError: if data ends before the header does
+    """
+    type_byte = data[offset]
+    if 0x90 <= type_byte <= 0x9f:
+        return type_byte & 0x0f, offset + 1
+    if type_byte == 0xdc:
+        return _unpack_length('!H', data, offset + 1), offset + 3
+    if type_byte == 0xdd:
+        return _unpack_length('!I', data, offset + 1), offset + 5
+    return None, offset
+
+def msgpack_skip(data, offset=0):
+    """
+    Finds the end of the msgpack object starting at offset without decoding it
+    :param data: the msgpack data
+    :type data: bytearray
+    :param offset: the position of the object in data
+    :type offset: int
+    :return: the offset just past the end of the object
+    :raises IndexError: if data ends before the object does
+    """
+    remaining = 1
+    while remaining:
+        remaining -= 1
+        type_byte = data[offset]
+        offset += 1
+
+        if type_byte <= 0x7f or type_byte >= 0xe0 or type_byte in (0xc0, 0xc2, 0xc3):
+            #fixints, nil and booleans are a single byte
+            pass
+        elif type_byte <= 0x8f:
+            remaining += 2 * (type_byte & 0x0f)
+        elif type_byte <= 0x9f:
+            remaining += type_byte & 0x0f
+        elif type_byte <= 0xbf:
+            offset += type_byte & 0x1f
+        elif type_byte in _MSGPACK_FIXED_SIZES:
+            offset += _MSGPACK_FIXED_SIZES[type_byte]
+        elif type_byte in _MSGPACK_SIZED:
+            fmt, extra = _MSGPACK_SIZED[type_byte]
+            size = struct.calcsize(fmt)
+            offset += size + extra + _unpack_length(fmt, data, offset)
+        elif type_byte in _MSGPACK_CONTAINERS:
+            fmt, per_entry = _MSGPACK_CONTAINERS[type_byte]
+            remaining += per_entry * _unpack_length(fmt, data, offset)
+            offset += struct.calcsize(fmt)
+        else:
+            raise ValueError('invalid msgpack type byte: {}'.format(hex(type_byte)))
+
+    if offset > len(data):
+        raise IndexError('incomplete msgpack data')
+    return offset
+
+def random_uuid_bytes():
+    """
+    Generates the 16 bytes of a random (version 4) uuid, without the
+    overhead of building a uuid.UUID
+    :return: str
+    """
+    data = bytearray(os.urandom(16))
+    data[6] = (data[6] & 0x0f) | 0x40
+    data[8] = (data[8] & 0x3f) | 0x80
+    return str(data)
+
+def deadline(timeout):
+    """
+    Returns the time a timeout that starts now runs out
+    :param timeout: the number of seconds, None for no timeout
+    :type timeout: float
+    :return: float, None if timeout is None
+    """
+    if timeout is None:
+        return None
+    return time.time() + timeout
+
+def time_left(deadline):
+    """
+    Returns the number of seconds left until a deadline
+    :param deadline: the time, as returned by deadline(), None if there isn't one
+    :type deadline: float
+    :return: float, None if deadline is None
+    :raises RexProTimeoutException: if the deadline has passed
+    """
+    if deadline is None:
+        return None
+    left = deadline - time.time()
+    if left <= 0:
+        raise exceptions.RexProTimeoutException('deadline exceeded')
+    return left
@@ -27,6 +27,7 @@ setup(
     ],
     keywords='rexster,tinkerpop,rexpro',
     install_requires=['msgpack-python'],
+    extras_require={'gevent': ['gevent'], 'numpy': ['numpy']},
     author='Blake Eggleston',
     author_email='bdeggleston@gmail.com',
     url='https://github.com/bdeggleston/rexpro-python',